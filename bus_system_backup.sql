@@ -481,6 +481,23 @@ INSERT INTO `bus_routes_total` VALUES
 UNLOCK TABLES;
 commit;
 
+--
+-- Table structure for table `bus_stop_times`
+--
+
+DROP TABLE IF EXISTS `bus_stop_times`;
+/*!40101 SET @saved_cs_client     = @@character_set_client */;
+/*!40101 SET character_set_client = utf8mb4 */;
+CREATE TABLE `bus_stop_times` (
+  `station_id` int(10) unsigned NOT NULL COMMENT '站點ID（對應 bus_route_stations.station_id）',
+  `trip_no` smallint(5) unsigned NOT NULL COMMENT '第幾班（從 1 開始）',
+  `departure_min` smallint(5) unsigned NOT NULL COMMENT '發車/到站時刻（午夜起算分鐘）',
+  PRIMARY KEY (`station_id`,`trip_no`),
+  KEY `idx_station_departure` (`station_id`,`departure_min`),
+  CONSTRAINT `fk_stop_times_station` FOREIGN KEY (`station_id`) REFERENCES `bus_route_stations` (`station_id`) ON DELETE CASCADE
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci;
+/*!40101 SET character_set_client = @saved_cs_client */;
+
 --
 -- Table structure for table `car_backup`
 --
@@ -501,7 +518,8 @@ CREATE TABLE `car_backup` (
   `route` varchar(30) DEFAULT NULL,
   `direction` enum('去程','回程','停駐','其他') DEFAULT NULL,
   `Current_Loaction` varchar(30) DEFAULT NULL,
-  PRIMARY KEY (`seq`)
+  PRIMARY KEY (`seq`),
+  KEY `idx_route_seq` (`route`,`seq`)
 ) ENGINE=InnoDB AUTO_INCREMENT=12 DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci;
 /*!40101 SET character_set_client = @saved_cs_client */;
 
@@ -1141,7 +1159,8 @@ CREATE TABLE `ttcarimport` (
   `Speed` tinyint(4) DEFAULT NULL COMMENT '車速',
   `Deg` smallint(6) DEFAULT NULL COMMENT '方位，0~359',
   `acc` bit(1) NOT NULL COMMENT '引擎狀態 (1=啟動, 0=熄火)',
-  PRIMARY KEY (`seq`)
+  PRIMARY KEY (`seq`),
+  KEY `idx_car_licence_seq` (`car_licence`,`seq`)
 ) ENGINE=InnoDB AUTO_INCREMENT=3858 DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_uca1400_ai_ci COMMENT='GPS 資料轉入表';
 /*!40101 SET character_set_client = @saved_cs_client */;
 
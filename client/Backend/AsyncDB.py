@@ -0,0 +1,137 @@
+"""
+async handler 用的資料存取（不阻塞事件迴圈）
+
+- AsyncDB：MySQL_Doing 的 async 版本，查詢交給專用的執行緒池；
+  執行緒數等於連線池上限，排隊發生在 executor（不佔執行緒），不會把 FastAPI 的 threadpool 卡住
+- LoopStallMonitor：除錯用（LOOP_STALL_MS > 0 才啟用），事件迴圈超過門檻沒有回應時，
+  印出當下事件迴圈執行緒的 stack，直接指出是哪一行同步呼叫卡住
+"""
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from threading import Thread, get_ident
+import asyncio
+import os
+import sys
+import time
+import traceback
+
+LOOP_STALL_MS = int(os.getenv("LOOP_STALL_MS", 0))  # 0 表示不啟用
+
+
+class AsyncDB:
+    def __init__(self, db, max_workers=None):
+        self._db = db
+        self.max_workers = max_workers or db.pool.max_size
+        self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="asyncdb")
+        self._counters = {"calls": 0, "errors": 0}
+        self._pending = 0
+        self._wait_max = 0.0
+
+    async def _call(self, fn, *args):
+        loop = asyncio.get_running_loop()
+        queued_at = time.monotonic()
+        self._counters["calls"] += 1
+        self._pending += 1
+
+        def timed():
+            # 記錄在 executor 排隊的時間（連線池不夠時會先在這裡等）
+            self._wait_max = max(self._wait_max, time.monotonic() - queued_at)
+            return fn(*args)
+
+        try:
+            return await loop.run_in_executor(self._executor, timed)
+        except Exception:
+            self._counters["errors"] += 1
+            raise
+        finally:
+            self._pending -= 1
+
+    async def run(self, sql, params=None):
+        return await self._call(partial(self._db.run, sql, params))
+
+    async def rows(self, sql, params=None):
+        return await self._call(partial(self._db.rows, sql, params))
+
+    async def fetch_one(self, sql, params=None):
+        return await self._call(partial(self._db.fetch_one, sql, params))
+
+    async def scalar(self, sql, params=None, default=None):
+        return await self._call(partial(self._db.scalar, sql, params, default))
+
+    async def run_many(self, sql, seq_params):
+        return await self._call(partial(self._db.run_many, sql, list(seq_params)))
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False)
+
+    def stats(self):
+        stats = dict(self._counters)
+        stats.update({"max_workers": self.max_workers, "pending": self._pending,
+                      "queue_wait_max_ms": round(self._wait_max * 1000, 1)})
+        return stats
+
+
+class LoopStallMonitor:
+    """
+    事件迴圈內的 task 每 interval 秒更新心跳；監看執行緒發現心跳超過 threshold 沒更新，
+    就印出事件迴圈執行緒目前的 stack（每次卡住只印一次），卡住結束後再印總時間
+    """
+
+    def __init__(self, threshold_ms=LOOP_STALL_MS, interval=0.05):
+        self.threshold = threshold_ms / 1000
+        self.interval = interval
+        self._beat = time.monotonic()
+        self._loop_thread_id = None
+        self._task = None
+        self._thread = None
+        self._stopped = False
+        self._counters = {"stalls": 0, "worst_ms": 0.0}
+
+    @property
+    def enabled(self):
+        return self.threshold > 0
+
+    async def _heartbeat(self):
+        while True:
+            now = time.monotonic()
+            lag = now - self._beat - self.interval
+            if lag > self.threshold:
+                lag_ms = round(lag * 1000, 1)
+                self._counters["stalls"] += 1
+                self._counters["worst_ms"] = max(self._counters["worst_ms"], lag_ms)
+                print(f"[LoopStall] 事件迴圈被阻塞約 {lag_ms} ms")
+            self._beat = now
+            await asyncio.sleep(self.interval)
+
+    def _watch(self):
+        reported_beat = None
+        while not self._stopped:
+            time.sleep(self.threshold / 2)
+            beat = self._beat
+            if time.monotonic() - beat > self.threshold + self.interval and beat != reported_beat:
+                reported_beat = beat
+                frame = sys._current_frames().get(self._loop_thread_id)
+                if frame is not None:
+                    stack = "".join(traceback.format_stack(frame)[-8:])
+                    print(f"[LoopStall] 事件迴圈超過 {int(self.threshold * 1000)} ms 沒有回應，目前位置：\n{stack}")
+
+    def start(self):
+        """在事件迴圈內呼叫（startup）；未啟用時不做任何事"""
+        if not self.enabled or self._task is not None:
+            return
+        self._loop_thread_id = get_ident()
+        self._beat = time.monotonic()
+        self._stopped = False
+        self._task = asyncio.ensure_future(self._heartbeat())
+        self._thread = Thread(target=self._watch, name="loop-stall-monitor", daemon=True)
+        self._thread.start()
+        print(f"[LoopStall] 已啟用，門檻 {int(self.threshold * 1000)} ms")
+
+    def stop(self):
+        self._stopped = True
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    def stats(self):
+        return dict(self._counters, enabled=self.enabled, threshold_ms=int(self.threshold * 1000))
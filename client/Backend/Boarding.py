@@ -0,0 +1,235 @@
+"""
+上車驗證的快速路徑
+
+- EligibilityCache：當天已付款且審核通過的訂位，依班次（booking_time）分組放在記憶體；
+  掃碼驗證直接查記憶體，查不到才回資料庫（合格的結果補進快取）。
+  付款、審核、取消等寫入會在 hbus:invalidate 廣播 ns="reservation"，收到後移除該筆；
+  定時 / 整份失效後的重新載入在背景執行，期間沿用舊的內容，只有跨日後第一次查詢會同步載入
+- DispatchWriteBehind：驗證通過後的 dispatch_status='assigned' 先放進佇列，
+  背景執行緒每 interval 秒（或累積 batch_size 筆）以一句 UPDATE ... IN (...) 寫入
+"""
+from datetime import date
+from threading import Event, Lock, Thread
+import os
+import time
+
+ELIGIBILITY_RELOAD_SEC = int(os.getenv("ELIGIBILITY_RELOAD_SEC", 600))
+DISPATCH_FLUSH_SEC = float(os.getenv("DISPATCH_FLUSH_SEC", 2))
+DISPATCH_BATCH_SIZE = int(os.getenv("DISPATCH_BATCH_SIZE", 200))
+
+ELIGIBILITY_COLUMNS = """reservation_id, user_id, booking_time, booking_number,
+           booking_start_station_name, booking_end_station_name,
+           payment_status, review_status, dispatch_status"""
+
+
+def _eligible(row):
+    return bool(row) and row.get("payment_status") == "paid" and row.get("review_status") == "approved"
+
+
+class EligibilityCache:
+    def __init__(self, db, reload_interval=ELIGIBILITY_RELOAD_SEC):
+        self._db = db
+        self.reload_interval = reload_interval
+        self._lock = Lock()
+        self._warm_lock = Lock()
+        self._index = {}        # reservation_id -> row
+        self._departures = {}   # booking_time -> {reservation_id, ...}
+        self._day = None
+        self._loaded_at = 0.0
+        self._reloading = False
+        self._generation = 0    # 每次失效 +1，避免查詢途中被失效的舊資料寫回快取
+        self._counters = {"hits": 0, "misses": 0, "warms": 0, "errors": 0, "invalidations": 0}
+
+    # === 載入 ===
+    def warm(self, if_expired=False):
+        """重新載入當天合格的訂位；失敗時保留現有內容。if_expired：排隊等鎖期間別人已載入完成就不再重查"""
+        with self._warm_lock:
+            if if_expired and not self._expired():
+                return True
+            generation = self._generation
+            try:
+                rows = self._db.rows(f"""
+                    SELECT {ELIGIBILITY_COLUMNS}
+                    FROM reservation
+                    WHERE payment_status = 'paid' AND review_status = 'approved'
+                      AND booking_time >= CURDATE() AND booking_time < CURDATE() + INTERVAL 1 DAY
+                """)
+            except Exception as e:
+                self._counters["errors"] += 1
+                print(f"[Boarding] 載入當日訂位失敗: {e}")
+                return False
+            index, departures = {}, {}
+            for row in rows:
+                rid = int(row["reservation_id"])
+                index[rid] = row
+                departures.setdefault(row.get("booking_time"), set()).add(rid)
+            with self._lock:
+                self._index, self._departures = index, departures
+                self._day = date.today()
+                self._loaded_at = time.monotonic()
+                # 載入期間有失效事件：內容可能已舊，下一次查詢再載入
+                if generation != self._generation:
+                    self._loaded_at = 0.0
+            self._counters["warms"] += 1
+            return True
+
+    def _expired(self):
+        return self._day != date.today() or time.monotonic() - self._loaded_at > self.reload_interval
+
+    def _reload_in_background(self):
+        """同時只跑一個重新載入；載入期間照常用舊的 index 回應"""
+        with self._lock:
+            if self._reloading:
+                return
+            self._reloading = True
+
+        def run():
+            try:
+                self.warm(if_expired=True)
+            finally:
+                self._reloading = False
+
+        Thread(target=run, name="eligibility-warm", daemon=True).start()
+
+    def _ensure_fresh(self):
+        if not self._expired():
+            return
+        if self._day != date.today():
+            # 還沒有今天的資料：只能同步載入，其餘請求等鎖後直接使用結果
+            self.warm(if_expired=True)
+        else:
+            self._reload_in_background()
+
+    # === 查詢 ===
+    def lookup(self, reservation_id):
+        """
+        回傳訂位 row（含 user_id / payment_status / review_status）或 None；
+        快取只放合格的訂位，不合格或查不到的一律回資料庫確認
+        """
+        rid = int(reservation_id)
+        self._ensure_fresh()
+        row = self._index.get(rid)
+        if row is not None:
+            self._counters["hits"] += 1
+            return row
+
+        self._counters["misses"] += 1
+        generation = self._generation
+        row = self._db.fetch_one(f"SELECT {ELIGIBILITY_COLUMNS} FROM reservation WHERE reservation_id = %s", (rid,))
+        if _eligible(row):
+            with self._lock:
+                if generation == self._generation:
+                    self._index[rid] = row
+                    self._departures.setdefault(row.get("booking_time"), set()).add(rid)
+        return row
+
+    def mark_dispatched(self, reservation_id):
+        row = self._index.get(int(reservation_id))
+        if row is not None:
+            row["dispatch_status"] = "assigned"
+
+    # === 失效 ===
+    def _drop(self, rid):
+        row = self._index.pop(rid, None)
+        if row is not None:
+            riders = self._departures.get(row.get("booking_time"))
+            if riders is not None:
+                riders.discard(rid)
+                if not riders:
+                    del self._departures[row.get("booking_time")]
+
+    def on_event(self, message):
+        """EventBus handler：有 reservation_id 只移除該筆，否則整份下次查詢時重新載入"""
+        self._counters["invalidations"] += 1
+        rid = message.get("reservation_id")
+        with self._lock:
+            self._generation += 1
+            if rid:
+                self._drop(int(rid))
+            else:
+                self._loaded_at = 0.0
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._counters)
+            stats.update({"day": str(self._day) if self._day else None, "reservations": len(self._index),
+                          "departures": len(self._departures),
+                          "age": round(time.monotonic() - self._loaded_at, 1) if self._loaded_at else None})
+        return stats
+
+
+class DispatchWriteBehind:
+    def __init__(self, db, interval=DISPATCH_FLUSH_SEC, batch_size=DISPATCH_BATCH_SIZE):
+        self._db = db
+        self.interval = interval
+        self.batch_size = batch_size
+        self._lock = Lock()
+        self._flush_lock = Lock()
+        self._pending = set()
+        self._stop = Event()
+        self._wake = Event()
+        self._thread = None
+        self._counters = {"queued": 0, "written": 0, "batches": 0, "errors": 0}
+        self._last_error = None
+        self._last_flush_ms = None
+
+    def enqueue(self, reservation_id):
+        with self._lock:
+            self._pending.add(int(reservation_id))
+            self._counters["queued"] += 1
+            full = len(self._pending) >= self.batch_size
+        if full:
+            self._wake.set()
+
+    def flush(self):
+        """寫入目前佇列中的全部訂位；失敗時放回佇列，下一輪重試"""
+        with self._flush_lock:
+            with self._lock:
+                batch, self._pending = self._pending, set()
+            if not batch:
+                return 0
+            start = time.monotonic()
+            ids = sorted(batch)
+            try:
+                self._db.run(f"""
+                    UPDATE reservation
+                    SET dispatch_status = 'assigned', updated_at = NOW()
+                    WHERE reservation_id IN ({', '.join(['%s'] * len(ids))})
+                """, tuple(ids))
+            except Exception as e:
+                with self._lock:
+                    self._pending |= batch
+                self._counters["errors"] += 1
+                self._last_error = str(e)
+                print(f"[Boarding] dispatch_status 批次寫入失敗（{len(ids)} 筆，稍後重試）: {e}")
+                return 0
+            self._counters["written"] += len(ids)
+            self._counters["batches"] += 1
+            self._last_flush_ms = round((time.monotonic() - start) * 1000, 1)
+            return len(ids)
+
+    def _loop(self):
+        while not self._stop.is_set():
+            self._wake.wait(self.interval)
+            self._wake.clear()
+            self.flush()
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._stop.clear()
+        self._thread = Thread(target=self._loop, name="dispatch-write-behind", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """停止背景執行緒並把剩下的寫完"""
+        self._stop.set()
+        self._wake.set()
+        self._thread = None
+        self.flush()
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._counters, pending=len(self._pending))
+        stats.update({"last_flush_ms": self._last_flush_ms, "last_error": self._last_error})
+        return stats
@@ -0,0 +1,109 @@
+"""
+乘車 token 的精簡格式
+
+    "HB2" + base32( rid u32 | uid u32 | exp u32 | 起站 station_id u16 | 迄站 station_id u16 | Ed25519 簽章 64 bytes )
+    "HB1" + base32( 同上 16 bytes 欄位 | HMAC-SHA256 前 10 bytes )
+
+- 全部是大寫英數字，QR 會用 alphanumeric 模式編碼：
+  HB2 131 字元、QR version 6（41x41）；HB1 45 字元、version 3；舊 JSON 格式約 170 字元、version 9（53x53）
+- HB2 以 Ed25519 簽章（簽的是 "HB2" + 欄位），司機端離線乘客名單（Backend.Manifest）只帶公鑰，
+  只能驗證、無法產生 token；伺服器持有私鑰，Ed25519 簽章是確定性的，驗證時直接重新簽章比對
+- HB1 為對稱 MAC，金鑰不能發給司機端；已停止簽發，只驗證到已簽發的 HB1 過期為止
+  （最長有效期為 generate_boarding_token 的 ttl，預設 1 小時），之後可移除
+- 站名不放進 token，需要顯示時以 station_id 反查；查不到 id 時為 0
+"""
+from functools import lru_cache
+import base64
+import hmac
+import os
+import struct
+
+from Crypto.PublicKey import ECC
+from Crypto.Signature import eddsa
+
+PREFIX_V1 = "HB1"
+PREFIX_V2 = "HB2"
+COMPACT_PREFIX = PREFIX_V2  # 目前簽發的版本
+_FIELDS = struct.Struct(">IIIHH")
+MAC_BYTES = 10
+SIG_BYTES = 64
+U16_MAX = 0xFFFF
+
+BOARDING_TOKEN_SIGNING_KEY = os.getenv("BOARDING_TOKEN_SIGNING_KEY", "")  # 32 bytes seed（hex），未設定時由 APP_SESSION_SECRET 衍生
+
+
+def _b32len(n):
+    return len(base64.b32encode(b"\0" * n).rstrip(b"="))
+
+
+_LENGTHS = {
+    PREFIX_V1: len(PREFIX_V1) + _b32len(_FIELDS.size + MAC_BYTES),
+    PREFIX_V2: len(PREFIX_V2) + _b32len(_FIELDS.size + SIG_BYTES),
+}
+COMPACT_LENGTH = _LENGTHS[COMPACT_PREFIX]
+
+
+def token_secret() -> str:
+    return os.getenv("APP_SESSION_SECRET") or os.getenv("APP_SECRET") or "dev-secret"
+
+
+# === HB1：對稱 MAC（僅驗證） ===
+@lru_cache(maxsize=4)
+def _key(secret: str) -> bytes:
+    return hmac.digest(secret.encode(), b"boarding-token:v1", "sha256")
+
+
+def _mac_v1(body: bytes, secret: str) -> bytes:
+    return hmac.digest(_key(secret), PREFIX_V1.encode() + body, "sha256")[:MAC_BYTES]
+
+
+# === HB2：Ed25519 ===
+@lru_cache(maxsize=4)
+def _signing_key(secret: str, seed_hex: str = BOARDING_TOKEN_SIGNING_KEY):
+    # 各 worker 必須用同一把金鑰：沒有指定時由共用的 session secret 衍生
+    seed = bytes.fromhex(seed_hex) if seed_hex else hmac.digest(secret.encode(), b"boarding-token:v2", "sha256")
+    return ECC.construct(curve="Ed25519", seed=seed)
+
+
+def _sign_v2(body: bytes, secret: str) -> bytes:
+    return eddsa.new(_signing_key(secret), "rfc8032").sign(PREFIX_V2.encode() + body)
+
+
+def token_public_key(secret: str = None) -> bytes:
+    """HB2 驗章公鑰（raw 32 bytes），放進司機端的離線乘客名單"""
+    return _signing_key(secret or token_secret()).public_key().export_key(format="raw")
+
+
+def is_compact(token: str) -> bool:
+    return token[:3] in _LENGTHS
+
+
+def encode_compact(rid: int, uid: int, exp: int, start_id: int = 0, end_id: int = 0, secret: str = None) -> str:
+    secret = secret or token_secret()
+    body = _FIELDS.pack(rid, uid, exp,
+                        start_id if 0 < (start_id or 0) <= U16_MAX else 0,
+                        end_id if 0 < (end_id or 0) <= U16_MAX else 0)
+    return PREFIX_V2 + base64.b32encode(body + _sign_v2(body, secret)).decode().rstrip("=")
+
+
+def decode_compact(token: str, secret: str = None, verify: bool = True):
+    """
+    回傳 {"v", "rid", "uid", "exp", "s", "e"}（s / e 為 station_id）；
+    格式錯誤或簽章 / MAC 不符回傳 None。verify=False 只解碼（例如讀 exp 當快取期限）
+    """
+    prefix = token[:3]
+    if _LENGTHS.get(prefix) != len(token):
+        return None
+    data = token[3:]
+    try:
+        raw = base64.b32decode(data + "=" * (-len(data) % 8))
+    except Exception:
+        return None
+    body, tag = raw[:_FIELDS.size], raw[_FIELDS.size:]
+    if verify:
+        secret = secret or token_secret()
+        expected = _mac_v1(body, secret) if prefix == PREFIX_V1 else _sign_v2(body, secret)
+        if not hmac.compare_digest(tag, expected):
+            return None
+    rid, uid, exp, start_id, end_id = _FIELDS.unpack(body)
+    return {"v": int(prefix[2]), "rid": rid, "uid": uid, "exp": exp, "s": start_id, "e": end_id}
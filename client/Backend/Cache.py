@@ -0,0 +1,268 @@
+"""
+兩層快取：行程內 LRU（含 TTL） → Redis（各 worker 共用） → 資料庫；以及定時重建的快照
+
+- 同一個 key 同時 miss 時只有一個執行緒去載入，其他等待結果（request coalescing）
+- Redis 上的 key 帶有版本號；admin 端寫入後把版本號 +1 並廣播，
+  各 worker 收到後清空 L1，舊版本的 Redis key 自然過期
+"""
+from collections import OrderedDict
+from datetime import date, datetime
+from decimal import Decimal
+from threading import Event, Lock, Thread
+import json
+import time
+
+
+def _json_default(v):
+    if isinstance(v, (datetime, date)):
+        return v.isoformat()
+    if isinstance(v, Decimal):
+        return float(v)
+    return str(v)
+
+
+class _Inflight:
+    __slots__ = ("done", "value", "error")
+
+    def __init__(self):
+        self.done = Event()
+        self.value = None
+        self.error = None
+
+
+class TwoTierCache:
+    def __init__(self, namespace, redis_client=None, maxsize=256, ttl=120, redis_ttl=600):
+        self.namespace = namespace
+        self._redis = redis_client
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.redis_ttl = redis_ttl
+
+        self._lock = Lock()
+        self._l1 = OrderedDict()  # key -> (expire_at, version, value)
+        self._inflight = {}       # key -> _Inflight
+        self._version = None
+
+        self._counters = {"l1_hit": 0, "l2_hit": 0, "miss": 0, "coalesced": 0, "invalidations": 0}
+
+    # === 版本號 ===
+    @property
+    def version_key(self):
+        return f"{self.namespace}:ver"
+
+    def _current_version(self):
+        if self._version is None:
+            version = "0"
+            if self._redis is not None:
+                try:
+                    version = self._redis.get(self.version_key) or "0"
+                except Exception as e:
+                    print(f"[Cache:{self.namespace}] 讀取版本號失敗: {e}")
+            self._version = str(version)
+        return self._version
+
+    def _use_version(self, version):
+        """呼叫端指定版本（例如 ETag 用的 DatasetVersions 版本字串）：與目前不同時清空 L1 改用它"""
+        version = str(version)
+        with self._lock:
+            if self._version != version:
+                self._l1.clear()
+                self._version = version
+        return version
+
+    def _redis_key(self, version, key):
+        return f"{self.namespace}:v{version}:" + ":".join(str(k) for k in key)
+
+    def _count(self, name):
+        with self._lock:
+            self._counters[name] += 1
+
+    # === 讀取 ===
+    def get(self, key, loader, version=None):
+        """
+        key 為 tuple；loader() 回傳可 JSON 序列化的值
+        version：回應的 ETag 依某個版本號產生時傳入同一個值，內容與 ETag 才會對應同一版
+        """
+        version = self._current_version() if version is None else self._use_version(version)
+        now = time.monotonic()
+
+        # L1
+        with self._lock:
+            entry = self._l1.get(key)
+            if entry and entry[0] > now and entry[1] == version:
+                self._l1.move_to_end(key)
+                self._counters["l1_hit"] += 1
+                return entry[2]
+
+            inflight = self._inflight.get(key)
+            owner = inflight is None
+            if owner:
+                inflight = self._inflight[key] = _Inflight()
+            else:
+                self._counters["coalesced"] += 1
+
+        if not owner:
+            inflight.done.wait()
+            if inflight.error is not None:
+                raise inflight.error
+            return inflight.value
+
+        try:
+            value = self._load(key, version, loader)
+            inflight.value = value
+            return value
+        except Exception as e:
+            inflight.error = e
+            raise
+        finally:
+            with self._lock:
+                self._inflight.pop(key, None)
+            inflight.done.set()
+
+    def _load(self, key, version, loader):
+        # L2
+        rkey = self._redis_key(version, key)
+        if self._redis is not None:
+            try:
+                raw = self._redis.get(rkey)
+                if raw is not None:
+                    value = json.loads(raw)
+                    self._count("l2_hit")
+                    self._store_l1(key, version, value)
+                    return value
+            except Exception as e:
+                print(f"[Cache:{self.namespace}] Redis 讀取失敗: {e}")
+
+        # DB
+        self._count("miss")
+        value = json.loads(json.dumps(loader(), ensure_ascii=False, default=_json_default))
+        if self._redis is not None:
+            try:
+                self._redis.setex(rkey, self.redis_ttl, json.dumps(value, ensure_ascii=False))
+            except Exception as e:
+                print(f"[Cache:{self.namespace}] Redis 寫入失敗: {e}")
+        self._store_l1(key, version, value)
+        return value
+
+    def _store_l1(self, key, version, value):
+        with self._lock:
+            # 載入期間若已失效（版本改變），就不放進 L1
+            if version != self._version:
+                return
+            self._l1[key] = (time.monotonic() + self.ttl, version, value)
+            self._l1.move_to_end(key)
+            while len(self._l1) > self.maxsize:
+                self._l1.popitem(last=False)
+
+    # === 失效 ===
+    def invalidate(self, version=None):
+        """清空 L1；version 為 admin 端廣播的新版本號（None 表示下次重新讀取）"""
+        with self._lock:
+            self._l1.clear()
+            self._version = str(version) if version is not None else None
+            self._counters["invalidations"] += 1
+
+    def on_event(self, message):
+        """EventBus handler"""
+        self.invalidate(message.get("version"))
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._counters)
+            stats.update({"namespace": self.namespace, "version": self._version, "l1_size": len(self._l1)})
+        lookups = stats["l1_hit"] + stats["l2_hit"] + stats["miss"]
+        stats["hit_ratio"] = round((stats["l1_hit"] + stats["l2_hit"]) / lookups, 4) if lookups else 0.0
+        return stats
+
+
+# ============================================================
+# 定時重建的快照：讀取端永遠立即拿到最後一份成功的結果
+# ============================================================
+class SnapshotCache:
+    def __init__(self, name, builder, interval=30, min_interval=2):
+        self.name = name
+        self._builder = builder
+        self.interval = interval
+        self.min_interval = min_interval  # poke() 觸發的重建最短間隔
+
+        self._value = None
+        self._built_at = None     # time.time()
+        self._build_lock = Lock()
+        self._stop = Event()
+        self._wake = Event()
+        self._thread = None
+        self._counters = {"builds": 0, "errors": 0, "reads": 0, "cold_waits": 0, "pokes": 0}
+        self._last_error = None
+        self._last_build_ms = None
+
+    def _build(self):
+        # 呼叫端需持有 _build_lock
+        start = time.monotonic()
+        try:
+            value = self._builder()
+        except Exception as e:
+            self._counters["errors"] += 1
+            self._last_error = str(e)
+            print(f"[Snapshot:{self.name}] 重建失敗，沿用舊快照: {e}")
+            return False
+        self._value = value
+        self._built_at = time.time()
+        self._last_build_ms = round((time.monotonic() - start) * 1000, 1)
+        self._counters["builds"] += 1
+        return True
+
+    def refresh(self):
+        """重建一次；同一時間只會有一個執行緒在建，失敗時保留舊快照"""
+        with self._build_lock:
+            return self._build()
+
+    def get(self):
+        """回傳 (value, age_seconds)；尚無快照時由第一個請求建立，其他請求等待同一次結果"""
+        self._counters["reads"] += 1
+        if self._built_at is None:
+            self._counters["cold_waits"] += 1
+            with self._build_lock:
+                # 排隊中的請求若發現前一個已建好就直接使用
+                if self._built_at is None:
+                    self._build()
+            if self._built_at is None:
+                raise RuntimeError(f"{self.name} snapshot unavailable: {self._last_error}")
+        return self._value, max(0.0, time.time() - self._built_at)
+
+    def poke(self):
+        """資料有變動時呼叫：背景執行緒會提早重建（不早於 min_interval）"""
+        self._counters["pokes"] += 1
+        self._wake.set()
+
+    def _loop(self):
+        while not self._stop.is_set():
+            started = time.monotonic()
+            self.refresh()
+            self._wake.wait(self.interval)
+            self._wake.clear()
+            rest = self.min_interval - (time.monotonic() - started)
+            if rest > 0:
+                self._stop.wait(rest)
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._stop.clear()
+        self._thread = Thread(target=self._loop, name=f"snapshot-{self.name}", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._wake.set()
+        self._thread = None
+
+    def stats(self):
+        stats = dict(self._counters)
+        stats.update({
+            "name": self.name,
+            "interval": self.interval,
+            "age": round(time.time() - self._built_at, 3) if self._built_at else None,
+            "last_build_ms": self._last_build_ms,
+            "last_error": self._last_error,
+        })
+        return stats
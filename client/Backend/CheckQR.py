@@ -1,7 +1,7 @@
+from Backend.BoardingToken import decode_compact, is_compact, token_secret
 from Backend.MySQL import MySQL_Doing
 from dotenv import load_dotenv
 import base64, hmac, hashlib, json, os, time
-import pandas as pd
 
 MySQL_Doing = MySQL_Doing()
 load_dotenv()
@@ -17,23 +17,48 @@ def _sign(raw: bytes, secret: str) -> str:
     return base64.urlsafe_b64encode(sig).decode().rstrip('=')
 
 
-def verify_boarding_token(token: str) -> dict:
-    """驗證乘車編碼：簽章、時效、資料庫資格。"""
-    if not token or '.' not in token:
-        return {"ok": False, "reason": "格式錯誤"}
-
-    # 解析 token
+def _parse_legacy_token(token: str, secret: str):
+    """舊格式 base64url(JSON).簽章；回傳 (data, 錯誤原因)"""
+    if '.' not in token:
+        return None, "格式錯誤"
     try:
         b64p, sig = token.split('.', 1)
         raw = _b64url_decode(b64p)
         data = json.loads(raw.decode('utf-8'))
     except Exception:
-        return {"ok": False, "reason": "解碼失敗"}
+        return None, "解碼失敗"
+    if not hmac.compare_digest(_sign(raw, secret), sig):
+        return None, "簽章不符"
+    return data, None
+
+
+def _fetch_reservation(rid: int):
+    return MySQL_Doing.fetch_one("""
+        SELECT r.reservation_id, r.user_id, r.payment_status, r.review_status
+        FROM reservation r
+        WHERE r.reservation_id = %s
+    """, (rid,))
 
-    # 驗簽
-    secret = os.getenv("APP_SESSION_SECRET") or os.getenv("APP_SECRET") or "dev-secret"
-    if _sign(raw, secret) != sig:
-        return {"ok": False, "reason": "簽章不符"}
+
+def verify_boarding_token(token: str, lookup=None) -> dict:
+    """
+    驗證乘車編碼：簽章、時效、資料庫資格。接受精簡格式（HB2 / HB1）與舊的 JSON 格式
+    lookup(reservation_id) 回傳訂位 row（預設直接查資料庫，Server 傳入 EligibilityCache.lookup）
+    """
+    if not token:
+        return {"ok": False, "reason": "格式錯誤"}
+    token = token.strip()
+
+    # 解析 token 並驗簽
+    secret = token_secret()
+    if is_compact(token):
+        data = decode_compact(token, secret)
+        if data is None:
+            return {"ok": False, "reason": "簽章不符"}
+    else:
+        data, reason = _parse_legacy_token(token, secret)
+        if data is None:
+            return {"ok": False, "reason": reason}
 
     # 檢查有效期
     if int(data.get('exp', 0)) < int(time.time()):
@@ -45,29 +70,15 @@ def verify_boarding_token(token: str) -> dict:
     if not rid or not uid:
         return {"ok": False, "reason": "內容缺失"}
 
-    # 以 DB 再驗狀態仍合格
-    sql = f"""
-        SELECT r.reservation_id, r.user_id, r.payment_status, r.review_status
-        FROM reservation r
-        WHERE r.reservation_id = {rid}
-    """
-    res = MySQL_Doing.run(sql)
-
-    # 支援 DataFrame 或 list 結果
-    if isinstance(res, pd.DataFrame):
-        if res.empty:
-            return {"ok": False, "reason": "查無訂位"}
-        df = res
-    else:
-        df = pd.DataFrame(res or [])
-        if df.empty:
-            return {"ok": False, "reason": "查無訂位"}
+    # 以 DB（或快取）再驗狀態仍合格
+    row = (lookup or _fetch_reservation)(rid)
+    if not row:
+        return {"ok": False, "reason": "查無訂位"}
 
-    row = df.iloc[0]
     try:
-        db_uid = int(row.get('user_id')) if isinstance(row, dict) else int(row['user_id'])
-        pay_ok = (row.get('payment_status') if isinstance(row, dict) else row['payment_status']) == 'paid'
-        rev_ok = (row.get('review_status') if isinstance(row, dict) else row['review_status']) == 'approved'
+        db_uid = int(row['user_id'])
+        pay_ok = row['payment_status'] == 'paid'
+        rev_ok = row['review_status'] == 'approved'
     except Exception:
         # 萬一欄位名異常
         return {"ok": False, "reason": "欄位異常"}
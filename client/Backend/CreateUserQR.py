@@ -1,6 +1,9 @@
+from Backend.BoardingToken import encode_compact, decode_compact, is_compact, token_secret
 from Backend.MySQL import MySQL_Doing
 from dotenv import load_dotenv
-import pandas as pd
+from collections import OrderedDict
+from io import BytesIO
+from threading import Lock
 import base64, hmac, hashlib, json, os, time
 import qrcode
 
@@ -23,20 +26,22 @@ def get_passenger_info(reservation_id: int):
     依 reservation_id 查詢乘客與訂位資訊，回傳是否符合乘車資格
     條件：payment_status='paid' 且 review_status='approved'
     """
-    sql = f"""
+    sql = """
         SELECT r.reservation_id, r.user_id, r.payment_status, r.review_status,
                r.dispatch_status, r.booking_start_station_name, r.booking_end_station_name,
-               u.username, u.email, u.phone, u.status
+               u.username, u.email, u.phone, u.status,
+               (SELECT MIN(s.station_id) FROM bus_route_stations s
+                 WHERE s.stop_name = r.booking_start_station_name) AS start_station_id,
+               (SELECT MIN(s.station_id) FROM bus_route_stations s
+                 WHERE s.stop_name = r.booking_end_station_name) AS end_station_id
         FROM reservation r
         JOIN users u ON r.user_id = u.user_id
-        WHERE r.reservation_id = {int(reservation_id)};
+        WHERE r.reservation_id = %s;
     """
-    results = MySQL_Doing.run(sql)
-    if results is None or len(results) == 0:
+    row = MySQL_Doing.fetch_one(sql, (int(reservation_id),))
+    if not row:
         return {"valid": False, "message": "找不到該筆訂位"}
 
-    df = pd.DataFrame(results)
-    row = df.loc[0]
     qualified = (row.get("payment_status") == "paid") and (row.get("review_status") == "approved")
 
     return {
@@ -51,22 +56,35 @@ def get_passenger_info(reservation_id: int):
         "dispatch_status": row.get("dispatch_status"),
         "start_station": row.get("booking_start_station_name"),
         "end_station": row.get("booking_end_station_name"),
+        "start_station_id": int(row.get("start_station_id") or 0),
+        "end_station_id": int(row.get("end_station_id") or 0),
         "qualified": qualified,
         "message": "乘車資格通過" if qualified else "未符合乘車資格",
     }
 
-def generate_boarding_token(reservation_id: int, ttl_seconds: int = 3600) -> str:
-    """產生乘車編碼（帶簽章），有效期預設 1 小時"""
+# 簽發時間以此秒數對齊：同一段時間內重複產生的 token 完全相同，QR 圖片可以共用快取
+TOKEN_ISSUE_STEP_SEC = 300
+
+def generate_boarding_token(reservation_id: int, ttl_seconds: int = 3600, compact: bool = True) -> str:
+    """
+    產生乘車編碼（帶簽章），有效期預設 1 小時（簽發時間對齊 TOKEN_ISSUE_STEP_SEC，實際剩餘 55~60 分鐘）
+    預設為精簡格式（見 Backend.BoardingToken）；compact=False 產生舊的 JSON 格式
+    """
     info = get_passenger_info(reservation_id)
     if not info.get("qualified"):
         raise ValueError(info.get("message") or "未符合乘車資格")
 
-    secret = os.getenv("APP_SESSION_SECRET") or os.getenv("APP_SECRET") or "dev-secret"
+    secret = token_secret()
+    exp = int(time.time()) // TOKEN_ISSUE_STEP_SEC * TOKEN_ISSUE_STEP_SEC + int(ttl_seconds)
+    if compact:
+        return encode_compact(int(info["reservation_id"]), int(info["user_id"]), exp,
+                              info.get("start_station_id") or 0, info.get("end_station_id") or 0, secret)
+
     payload = {
         "rid": int(info["reservation_id"]),
         "uid": int(info["user_id"]),
         "q": True,
-        "exp": int(time.time()) + int(ttl_seconds),
+        "exp": exp,
         "s": info.get("start_station") or "",
         "e": info.get("end_station") or "",
     }
@@ -74,9 +92,59 @@ def generate_boarding_token(reservation_id: int, ttl_seconds: int = 3600) -> str
     token = f"{_b64url(raw)}.{_sign(raw, secret)}"
     return token
 
+def token_exp(token: str) -> int:
+    """讀出 token 的 exp（不驗章，只用於快取期限）；格式不符回傳 0"""
+    try:
+        if is_compact(token):
+            return int((decode_compact(token, verify=False) or {}).get("exp", 0))
+        return int(json.loads(_b64url_decode(token.split(".", 1)[0])).get("exp", 0))
+    except Exception:
+        return 0
+
+def render_qr_png(token: str) -> bytes:
+    buf = BytesIO()
+    qrcode.make(token).save(buf, format="PNG")
+    return buf.getvalue()
+
 def save_qr_png(token: str, path: str) -> None:
-    img = qrcode.make(token)
-    img.save(path)
+    with open(path, "wb") as f:
+        f.write(render_qr_png(token))
+
+class QRImageCache:
+    """token → PNG bytes；LRU 上限 maxsize 張，每張留到 token 過期為止"""
+
+    def __init__(self, maxsize: int = 512):
+        self.maxsize = maxsize
+        self._lock = Lock()
+        self._images = OrderedDict()  # token -> (exp, png)
+        self._counters = {"hits": 0, "renders": 0, "expired": 0}
+
+    def get(self, token: str) -> bytes:
+        now = time.time()
+        with self._lock:
+            entry = self._images.get(token)
+            if entry and entry[0] > now:
+                self._images.move_to_end(token)
+                self._counters["hits"] += 1
+                return entry[1]
+            if entry:
+                del self._images[token]
+                self._counters["expired"] += 1
+
+        png = render_qr_png(token)
+        exp = token_exp(token)
+        with self._lock:
+            self._counters["renders"] += 1
+            if exp > now:
+                self._images[token] = (exp, png)
+                self._images.move_to_end(token)
+                while len(self._images) > self.maxsize:
+                    self._images.popitem(last=False)
+        return png
+
+    def stats(self):
+        with self._lock:
+            return dict(self._counters, size=len(self._images))
 
 if __name__ == "__main__":
     import sys
@@ -1,5 +1,5 @@
 ﻿from pydantic import BaseModel,Field
-from typing import Optional, Literal
+from typing import Optional, Literal, List
 from datetime import datetime
 
 class StationOut(BaseModel):
@@ -53,4 +53,12 @@ class CarInsertRequest(BaseModel):
     Speed: int
     Deg: int
     acc: int
-    rcv_dt: str | None = None
\ No newline at end of file
+    rcv_dt: str | None = None
+
+class ManifestCheckin(BaseModel):
+    reservation_id: int
+    user_id: Optional[int] = None
+    scanned_at: Optional[datetime] = None
+
+class ManifestCheckinUpload(BaseModel):
+    checkins: List[ManifestCheckin]
@@ -0,0 +1,85 @@
+"""
+跨 worker / 跨 app 的事件通知（Redis pub/sub）
+
+my-bus-system 寫入資料後會在 CACHE_CHANNEL 廣播 {"ns": ..., ...}，
+每個 uvicorn worker 各自訂閱，依 ns 分派給註冊的 handler（例如清除快取）。
+"""
+from threading import RLock
+import json
+import time
+
+CACHE_CHANNEL = "hbus:invalidate"
+
+
+class EventBus:
+    def __init__(self, redis_client, channel=CACHE_CHANNEL):
+        self._redis = redis_client
+        self.channel = channel
+        self._handlers = {}  # ns -> [handler, ...]
+        self._lock = RLock()
+        self._thread = None
+
+    def subscribe(self, ns, handler):
+        with self._lock:
+            self._handlers.setdefault(ns, []).append(handler)
+
+    def publish(self, ns, **payload):
+        """廣播給所有 worker（包含自己），Redis 失敗時只在本 worker 內分派"""
+        message = {"ns": ns, **payload}
+        try:
+            self._redis.publish(self.channel, json.dumps(message, ensure_ascii=False, default=str))
+        except Exception as e:
+            print(f"[Events] publish 失敗，僅通知本 worker: {e}")
+            self._dispatch(message)
+
+    async def publish_async(self, aredis, ns, **payload):
+        """async handler 用：同 publish，但透過 redis.asyncio client 送出"""
+        message = {"ns": ns, **payload}
+        try:
+            await aredis.publish(self.channel, json.dumps(message, ensure_ascii=False, default=str))
+        except Exception as e:
+            print(f"[Events] publish 失敗，僅通知本 worker: {e}")
+            self._dispatch(message)
+
+    def _dispatch(self, message):
+        with self._lock:
+            handlers = list(self._handlers.get(message.get("ns"), []))
+        for handler in handlers:
+            try:
+                handler(message)
+            except Exception as e:
+                print(f"[Events] handler 失敗 ({message.get('ns')}): {e}")
+
+    def _on_message(self, raw):
+        try:
+            message = json.loads(raw["data"])
+        except Exception:
+            return
+        if isinstance(message, dict):
+            self._dispatch(message)
+
+    def _on_error(self, e, pubsub, thread):
+        # 連線中斷時 redis-py 會在下次讀取時自動重連並重新訂閱，這裡只避免空轉
+        print(f"[Events] 訂閱中斷，稍後重試: {e}")
+        time.sleep(5)
+
+    def start(self):
+        """啟動背景訂閱執行緒（每個 worker 一條）"""
+        if self._thread is not None:
+            return
+        try:
+            pubsub = self._redis.pubsub(ignore_subscribe_messages=True)
+            pubsub.subscribe(**{self.channel: self._on_message})
+            self._thread = pubsub.run_in_thread(
+                sleep_time=1.0,
+                daemon=True,
+                exception_handler=self._on_error,
+            )
+            print(f"[Events] 已訂閱 {self.channel}")
+        except Exception as e:
+            print(f"[Events] 無法訂閱 {self.channel}: {e}")
+
+    def stop(self):
+        if self._thread is not None:
+            self._thread.stop()
+            self._thread = None
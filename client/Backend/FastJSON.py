@@ -0,0 +1,35 @@
+"""
+JSON 輸出快速路徑（orjson）
+
+- dumps() 直接產生 UTF-8 bytes；沒裝 orjson 時退回標準 json（輸出格式相同）
+- FastJSONResponse 給已經驗證過資料的端點使用，不再經過 response_model 驗證與 jsonable_encoder
+- Decimal、pandas Timestamp 等型別與 TwoTierCache 相同處理（_json_default）
+"""
+import json
+
+from fastapi import Response
+
+from Backend.Cache import _json_default
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover
+    orjson = None
+
+_ORJSON_OPTIONS = (orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY) if orjson is not None else 0
+
+
+def dumps(value):
+    if orjson is not None:
+        return orjson.dumps(value, default=_json_default, option=_ORJSON_OPTIONS)
+    return json.dumps(value, ensure_ascii=False, default=_json_default, separators=(",", ":")).encode("utf-8")
+
+
+class FastJSONResponse(Response):
+    media_type = "application/json"
+
+    def render(self, content):
+        # 已序列化的 bytes（快取的回應）直接送出
+        if isinstance(content, (bytes, bytearray)):
+            return bytes(content)
+        return dumps(content)
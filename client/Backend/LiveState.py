@@ -0,0 +1,276 @@
+"""
+車輛即時狀態（每台車最新定位、航向、速度、最近幾筆軌跡、所屬路線方向）
+
+- /api/car_insert、/api/car_backup_insert 收到定位時同步更新
+- 透過 Redis（hash + list + pub/sub）讓每個 uvicorn worker 都拿到同一份狀態
+- GIS_AllFast / GIS_About 直接讀這裡，不必再回頭查 ttcarimport / car_backup
+"""
+from collections import deque
+from datetime import datetime
+from threading import Lock
+import json
+import os
+import time
+import uuid
+
+LIVE_CHANNEL = "hbus:live"
+LIVE_HASH_KEY = "live:vehicles"          # plate -> 最新狀態 JSON
+LIVE_RECENT_KEY = "live:recent:{plate}"  # 最近幾筆定位（LPUSH + LTRIM）
+LIVE_SEQ_KEY = "live:seq"                # 全部 worker 共用的更新序號（推播重連用）
+LIVE_HISTORY = int(os.getenv("LIVE_HISTORY", 20))
+LIVE_RECENT_TTL_SEC = 6 * 3600
+
+
+def _epoch(value):
+    """GPS 時間字串轉 epoch；無法解析時回傳 None"""
+    if isinstance(value, datetime):
+        return value.timestamp()
+    try:
+        return datetime.fromisoformat(str(value).strip()).timestamp()
+    except (TypeError, ValueError):
+        return None
+
+
+def normalize_position(x, y):
+    """車機 X=經度、Y=緯度；若看起來顛倒就交換。回傳 (lat, lon)"""
+    lon, lat = float(x), float(y)
+    if abs(lat) > 90 or abs(lon) > 180:
+        lat, lon = lon, lat
+    return lat, lon
+
+
+class RouteResolver:
+    """車牌 → (路線, 方向)，來源為 route_schedule 正常營運班次，定時重新載入"""
+
+    def __init__(self, db, ttl=60):
+        self._db = db
+        self.ttl = ttl
+        self._rows = []
+        self._map = {}
+        self._loaded_at = 0.0
+        self._lock = Lock()
+
+    def _load(self):
+        rows = self._db.rows("""
+            SELECT route_no, direction, license_plate
+            FROM route_schedule
+            WHERE operation_status = "正常營運"
+        """)
+        assignments, mapping = [], {}
+        for row in rows:
+            plate = str(row.get("license_plate") or "").strip()
+            if plate and plate != "None":
+                assignments.append({"route_no": row.get("route_no"), "direction": row.get("direction"), "license_plate": plate})
+                mapping.setdefault(plate, (row.get("route_no"), row.get("direction")))
+        return assignments, mapping
+
+    def _ensure_loaded(self):
+        if time.monotonic() - self._loaded_at > self.ttl:
+            with self._lock:
+                if time.monotonic() - self._loaded_at > self.ttl:
+                    try:
+                        self._rows, self._map = self._load()
+                    except Exception as e:
+                        print(f"[LiveState] 讀取 route_schedule 失敗，沿用舊資料: {e}")
+                    self._loaded_at = time.monotonic()
+
+    def assignments(self):
+        """所有正常營運班次 [{"route_no", "direction", "license_plate"}]（同一台車可能跑去程與返程）"""
+        self._ensure_loaded()
+        return list(self._rows)
+
+    def resolve(self, plate):
+        self._ensure_loaded()
+        return self._map.get(plate, (None, None))
+
+    def invalidate(self, message=None):
+        self._loaded_at = 0.0
+
+
+class LiveStateStore:
+    def __init__(self, redis_client=None, resolver=None, history=LIVE_HISTORY, stop_namer=None):
+        self._redis = redis_client
+        self._resolver = resolver
+        self._stop_namer = stop_namer  # (route, direction, lat, lon) -> 最近站名，車機沒帶站名時補上
+        self.history = history
+        self.origin = uuid.uuid4().hex[:12]  # 用來忽略自己發出的廣播
+
+        self._lock = Lock()
+        self._latest = {}   # plate -> state dict
+        self._recent = {}   # plate -> deque[fix]
+        self._listeners = []
+        self._counters = {"ingested": 0, "stale": 0, "remote": 0, "seq_errors": 0}
+
+    # === 寫入 ===
+    def _next_seqs(self, n):
+        """向 Redis 一次取 n 個連續序號；Redis 不可用時回傳 None（推播端改送快照）"""
+        if self._redis is None or n <= 0:
+            return [None] * n
+        try:
+            last = int(self._redis.incrby(LIVE_SEQ_KEY, n))
+        except Exception as e:
+            self._counters["seq_errors"] += 1
+            print(f"[LiveState] 取得序號失敗: {e}")
+            return [None] * n
+        return list(range(last - n + 1, last + 1))
+
+    def _build_state(self, fix):
+        plate = str(fix["car_licence"]).strip()
+        lat, lon = normalize_position(fix["X"], fix["Y"])
+        route, direction = fix.get("route"), fix.get("direction")
+        if not route and self._resolver is not None:
+            route, direction = self._resolver.resolve(plate)
+        gps_time = str(fix.get("Gpstime") or "")
+        return {
+            "plate": plate,
+            "lat": lat,
+            "lon": lon,
+            "speed": fix.get("Speed"),
+            "heading": fix.get("Deg"),
+            "acc": fix.get("acc"),
+            "gps_time": gps_time,
+            "gps_ts": _epoch(gps_time) or time.time(),
+            "rcv_dt": str(fix.get("rcv_dt") or ""),
+            "route": str(route) if route not in (None, "") else None,
+            "direction": direction,
+            "current_stop": fix.get("Current_Loaction"),
+            "updated_at": time.time(),
+        }
+
+    def _nearest_stop(self, state):
+        if self._stop_namer is None or not str(state.get("route") or "").isdigit():
+            return None
+        try:
+            return self._stop_namer(state["route"], state.get("direction"), state["lat"], state["lon"])
+        except Exception as e:
+            print(f"[LiveState] 計算最近站點失敗: {e}")
+            return None
+
+    def _apply(self, state):
+        """套用到本 worker；比現有狀態舊的定位（補傳）直接略過，軌跡維持時間順序"""
+        plate = state["plate"]
+        with self._lock:
+            current = self._latest.get(plate)
+            if current is not None and state["gps_ts"] < current["gps_ts"]:
+                self._counters["stale"] += 1
+                return False
+
+            recent = self._recent.get(plate)
+            if recent is None:
+                recent = self._recent[plate] = deque(maxlen=self.history)
+            recent.append({k: state[k] for k in ("lat", "lon", "speed", "heading", "gps_time", "gps_ts")})
+            if current is not None:
+                # 車機備份資料帶有路線/站名，一般定位沒有時沿用路線與方向；
+                # 站名只在位置沒變時沿用，車子移動後改以最近站點重新計算
+                for key in ("route", "direction"):
+                    if state.get(key) in (None, "") and current.get(key) not in (None, ""):
+                        state[key] = current[key]
+                if (not state.get("current_stop") and current.get("current_stop")
+                        and (state["lat"], state["lon"]) == (current["lat"], current["lon"])):
+                    state["current_stop"] = current["current_stop"]
+        if not state.get("current_stop"):
+            # 站點索引第一次使用會查 DB，不在鎖內計算
+            state["current_stop"] = self._nearest_stop(state)
+        with self._lock:
+            newest = self._latest.get(plate)
+            if newest is not None and newest["gps_ts"] > state["gps_ts"]:
+                # 計算站名期間已寫入較新的定位
+                self._counters["stale"] += 1
+                return False
+            self._latest[plate] = state
+        for listener in list(self._listeners):
+            try:
+                listener(state)
+            except Exception as e:
+                print(f"[LiveState] listener 失敗: {e}")
+        return True
+
+    def ingest(self, fix):
+        """收到一筆定位：先更新本 worker，再寫 Redis 並廣播給其他 worker"""
+        state = self._build_state(fix)
+        state["seq"] = self._next_seqs(1)[0]
+        self._counters["ingested"] += 1
+        if not self._apply(state):
+            return state
+        self._publish([state])
+        return state
+
+    def ingest_many(self, fixes):
+        """批次補傳：每台車只廣播最新的一筆"""
+        newest = {}
+        fixes = sorted(fixes, key=lambda f: _epoch(f.get("Gpstime")) or 0)
+        for fix, seq in zip(fixes, self._next_seqs(len(fixes))):
+            state = self._build_state(fix)
+            state["seq"] = seq
+            self._counters["ingested"] += 1
+            if self._apply(state):
+                newest[state["plate"]] = state
+        self._publish(list(newest.values()))
+        return newest
+
+    def _publish(self, states):
+        if self._redis is None or not states:
+            return
+        try:
+            pipe = self._redis.pipeline(transaction=False)
+            for state in states:
+                raw = json.dumps(state, ensure_ascii=False, default=str)
+                recent_key = LIVE_RECENT_KEY.format(plate=state["plate"])
+                pipe.hset(LIVE_HASH_KEY, state["plate"], raw)
+                pipe.lpush(recent_key, raw)
+                pipe.ltrim(recent_key, 0, self.history - 1)
+                pipe.expire(recent_key, LIVE_RECENT_TTL_SEC)
+                pipe.publish(LIVE_CHANNEL, json.dumps({"ns": "vehicle", "origin": self.origin, "state": state},
+                                                      ensure_ascii=False, default=str))
+            pipe.execute()
+        except Exception as e:
+            print(f"[LiveState] 寫入 Redis 失敗（僅本 worker 可見）: {e}")
+
+    # === 其他 worker 的廣播 ===
+    def on_event(self, message):
+        if message.get("origin") == self.origin:
+            return
+        state = message.get("state")
+        if isinstance(state, dict) and state.get("plate"):
+            self._counters["remote"] += 1
+            self._apply(state)
+
+    def add_listener(self, fn):
+        """每次狀態更新後呼叫 fn(state)（例如推播給前端）"""
+        self._listeners.append(fn)
+
+    def warm(self):
+        """啟動時從 Redis 載入所有車的最新狀態與軌跡"""
+        if self._redis is None:
+            return 0
+        try:
+            raw_states = self._redis.hgetall(LIVE_HASH_KEY) or {}
+        except Exception as e:
+            print(f"[LiveState] 無法從 Redis 載入: {e}")
+            return 0
+        with self._lock:
+            for plate, raw in raw_states.items():
+                try:
+                    self._latest[plate] = json.loads(raw)
+                    recent = self._redis.lrange(LIVE_RECENT_KEY.format(plate=plate), 0, self.history - 1) or []
+                    self._recent[plate] = deque((json.loads(x) for x in reversed(recent)), maxlen=self.history)
+                except Exception:
+                    continue
+        return len(raw_states)
+
+    # === 讀取 ===
+    def latest(self, plate):
+        return self._latest.get(plate)
+
+    def all(self):
+        with self._lock:
+            return list(self._latest.values())
+
+    def recent(self, plate):
+        with self._lock:
+            return list(self._recent.get(plate, ()))
+
+    def stats(self):
+        stats = dict(self._counters)
+        stats["vehicles"] = len(self._latest)
+        return stats
@@ -0,0 +1,166 @@
+"""
+即時車輛推播（Server-Sent Events）
+
+- LiveStateStore 每套用一筆狀態（本 worker 寫入或其他 worker 經 hbus:live 廣播）就呼叫 on_state，
+  所以每個 worker 都看得到全車隊的更新，推播不必另外訂閱 Redis
+- 每筆更新只序列化一次，再依訂閱路線分送到各連線的佇列
+- 序號（seq）由 Redis INCR 產生、跨 worker 共用；斷線重連帶 Last-Event-ID 時，
+  本 worker 的重播緩衝還涵蓋就補送漏掉的更新，否則送一份完整快照
+- 連線佇列滿了（前端太慢）就丟掉積壓的更新改送快照：位置只需要最新的一筆
+"""
+from collections import deque
+import asyncio
+import json
+import os
+
+LIVE_STREAM_REPLAY = int(os.getenv("LIVE_STREAM_REPLAY", 2000))         # 每個 worker 保留的最近更新筆數
+LIVE_STREAM_QUEUE = int(os.getenv("LIVE_STREAM_QUEUE", 256))            # 每條連線最多積壓筆數
+LIVE_STREAM_MAX_CLIENTS = int(os.getenv("LIVE_STREAM_MAX_CLIENTS", 1000))
+LIVE_STREAM_HEARTBEAT_SEC = 15
+LIVE_STREAM_RETRY_MS = 3000
+
+DELTA_FIELDS = ("seq", "plate", "route", "direction", "lat", "lon", "speed", "heading", "gps_time", "current_stop")
+
+_RESYNC = object()  # 佇列中的標記：改送快照
+_CLOSE = object()   # 佇列中的標記：伺服器關閉，結束連線
+
+
+def _delta(state):
+    return {k: state.get(k) for k in DELTA_FIELDS}
+
+
+def _sse(event, data, seq=None):
+    head = f"id: {seq}\n" if seq is not None else ""
+    return f"{head}event: {event}\ndata: {json.dumps(data, ensure_ascii=False, default=str)}\n\n"
+
+
+class StreamClient:
+    def __init__(self, routes, since, queue_size):
+        self.routes = routes  # None 表示全部路線
+        self.since = since
+        self.queue = asyncio.Queue(maxsize=queue_size)
+        self.initial = []  # 連線建立時要先送的補送內容或快照
+        self.sent = 0
+        self.resyncs = 0
+
+    def wants(self, route):
+        return self.routes is None or route in self.routes
+
+    def offer(self, item):
+        """在事件迴圈執行緒呼叫；回傳 False 表示積壓過多、改送快照"""
+        try:
+            self.queue.put_nowait(item)
+            return True
+        except asyncio.QueueFull:
+            while not self.queue.empty():
+                self.queue.get_nowait()
+            self.queue.put_nowait(_RESYNC)
+            self.resyncs += 1
+            return False
+
+
+class LiveBroadcaster:
+    def __init__(self, store, replay=LIVE_STREAM_REPLAY, queue_size=LIVE_STREAM_QUEUE,
+                 max_clients=LIVE_STREAM_MAX_CLIENTS, heartbeat=LIVE_STREAM_HEARTBEAT_SEC):
+        self._store = store
+        self.queue_size = queue_size
+        self.max_clients = max_clients
+        self.heartbeat = heartbeat
+        self._loop = None
+        self._clients = set()
+        self._ring = deque(maxlen=replay)  # (seq, route, sse 文字)，只在事件迴圈執行緒存取
+        self._last_seq = None
+        self._counters = {"published": 0, "delivered": 0, "resyncs": 0, "replayed": 0, "snapshots": 0, "rejected": 0}
+
+    def attach(self, loop=None):
+        """記下 worker 的事件迴圈；on_state 由其他執行緒呼叫時交給它分送"""
+        if self._loop is not None:
+            return
+        try:
+            self._loop = loop or asyncio.get_running_loop()
+        except RuntimeError:
+            pass
+
+    # === 寫入端（任意執行緒） ===
+    def on_state(self, state):
+        """LiveStateStore listener"""
+        loop = self._loop
+        if loop is None or loop.is_closed():
+            return
+        delta = _delta(state)
+        text = _sse("delta", delta, delta["seq"])
+        loop.call_soon_threadsafe(self._dispatch, delta["seq"], delta["route"], text)
+
+    def _dispatch(self, seq, route, text):
+        self._counters["published"] += 1
+        if seq is not None:
+            self._ring.append((seq, route, text))
+            self._last_seq = seq if self._last_seq is None else max(self._last_seq, seq)
+        for client in self._clients:
+            if client.wants(route):
+                if client.offer(text):
+                    self._counters["delivered"] += 1
+                else:
+                    self._counters["resyncs"] += 1
+
+    # === 連線 ===
+    def open(self, routes=None, since=None):
+        """routes：路線代碼集合（None 為全部）；since：前端最後收到的 seq。連線數已滿時回傳 None"""
+        self.attach()
+        if len(self._clients) >= self.max_clients:
+            self._counters["rejected"] += 1
+            return None
+        client = StreamClient(routes, since, self.queue_size)
+        # 與 _dispatch 同在事件迴圈執行緒：補送內容與之後進佇列的更新不會重複或漏掉
+        client.initial = self._catch_up(client)
+        self._clients.add(client)
+        return client
+
+    def close(self, client):
+        self._clients.discard(client)
+
+    def close_all(self):
+        """worker 關閉前通知所有連線結束，前端會帶 Last-Event-ID 重連到其他 worker"""
+        for client in list(self._clients):
+            while not client.queue.empty():
+                client.queue.get_nowait()
+            client.queue.put_nowait(_CLOSE)
+
+    def _snapshot(self, client):
+        vehicles = [_delta(s) for s in self._store.all() if client.wants(s.get("route"))]
+        self._counters["snapshots"] += 1
+        return _sse("snapshot", {"seq": self._last_seq, "vehicles": vehicles}, self._last_seq)
+
+    def _catch_up(self, client):
+        """重連：緩衝涵蓋 since 之後的所有更新就逐筆補送，否則送快照"""
+        since = client.since
+        if since is not None and self._ring and self._ring[0][0] <= since + 1:
+            missed = [text for seq, route, text in self._ring if seq > since and client.wants(route)]
+            self._counters["replayed"] += len(missed)
+            return missed
+        return [self._snapshot(client)]
+
+    async def stream(self, client):
+        """SSE 內容產生器；前端斷線時 StreamingResponse 會取消它，finally 負責移除連線"""
+        try:
+            yield f"retry: {LIVE_STREAM_RETRY_MS}\n\n"
+            for text in client.initial:
+                yield text
+            client.initial = []
+            while True:
+                try:
+                    item = await asyncio.wait_for(client.queue.get(), timeout=self.heartbeat)
+                except asyncio.TimeoutError:
+                    yield ": ping\n\n"
+                    continue
+                if item is _CLOSE:
+                    break
+                yield self._snapshot(client) if item is _RESYNC else item
+                client.sent += 1
+        finally:
+            self.close(client)
+
+    def stats(self):
+        stats = dict(self._counters)
+        stats.update({"clients": len(self._clients), "buffered": len(self._ring), "last_seq": self._last_seq})
+        return stats
@@ -0,0 +1,249 @@
+"""
+離線乘客名單（司機端在沒有網路的路段也能驗證乘車 QR）
+
+名單檔案格式：base64url(JSON) "." base64url(Ed25519 簽章)
+    - 司機端以 /api/boarding_manifest/public_key 取得的公鑰驗章，確認名單未被竄改
+    - reservations 每列對應 columns：訂位、乘客、人數、上下車站、是否已上車
+    - token_public_key：HB2 token 的 Ed25519 驗章公鑰（名單不含任何能產生 token 的金鑰）
+驗證精簡 token（HB2...）時：base32 解碼 → 以公鑰驗證 "HB2" + 前 16 bytes 欄位的簽章 →
+    解出 rid / uid，名單內找到該筆且 uid 相符 → exp 未過期
+（HB1 是對稱 MAC，只能連線時由伺服器驗證；已停止簽發）
+
+下載名單與上傳掃碼紀錄都需要後台發給該班次的司機憑證（Bearer），只能存取憑證綁定的班次；
+回到有網路時上傳掃碼紀錄，apply_checkins 在同一個交易內鎖定這些訂位、
+逐筆檢查目前狀態，一句 UPDATE 寫入 dispatch_status，其餘列為衝突回報
+"""
+from datetime import date, datetime, timedelta
+import base64
+import hashlib
+import hmac
+import json
+import os
+import time
+
+from Crypto.PublicKey import ECC
+from Crypto.Signature import eddsa
+
+from Backend.BoardingToken import token_public_key, token_secret
+from Backend.FastJSON import dumps
+from Backend.Nearest import normalize_direction
+
+MANIFEST_SIGNING_KEY = os.getenv("MANIFEST_SIGNING_KEY", "")       # 32 bytes seed（hex），未設定時由 APP_SESSION_SECRET 衍生
+MANIFEST_WINDOW_MIN = int(os.getenv("MANIFEST_WINDOW_MIN", 30))    # 發車前 / 末站後各放寬幾分鐘
+MANIFEST_GRACE_SEC = int(os.getenv("MANIFEST_GRACE_SEC", 6 * 3600))  # 班次結束後名單仍有效的秒數
+
+MANIFEST_COLUMNS = ["rid", "uid", "count", "from", "to", "boarded"]
+
+
+def _b64url(data: bytes) -> str:
+    return base64.urlsafe_b64encode(data).decode().rstrip("=")
+
+
+def _b64url_decode(data: str) -> bytes:
+    return base64.urlsafe_b64decode(data + "=" * (-len(data) % 4))
+
+
+class ManifestSigner:
+    def __init__(self, seed_hex=MANIFEST_SIGNING_KEY):
+        # 各 worker 必須用同一把金鑰：沒有指定時由共用的 session secret 衍生
+        seed = bytes.fromhex(seed_hex) if seed_hex else hmac.digest(
+            token_secret().encode(), b"boarding-manifest:v1", "sha256")
+        self._key = ECC.construct(curve="Ed25519", seed=seed)
+        self.public_key = self._key.public_key().export_key(format="raw")
+        self.key_id = hashlib.sha256(self.public_key).hexdigest()[:8]
+
+    def sign(self, payload: dict) -> bytes:
+        raw = dumps(dict(payload, kid=self.key_id))
+        sig = eddsa.new(self._key, "rfc8032").sign(raw)
+        return f"{_b64url(raw)}.{_b64url(sig)}".encode()
+
+    def verify(self, blob):
+        """驗章並回傳名單內容；格式錯誤或簽章不符回傳 None"""
+        try:
+            raw_b64, sig_b64 = (blob.decode() if isinstance(blob, bytes) else blob).split(".", 1)
+            raw = _b64url_decode(raw_b64)
+            eddsa.new(self._key.public_key(), "rfc8032").verify(raw, _b64url_decode(sig_b64))
+        except (ValueError, TypeError):
+            return None
+        return json.loads(raw)
+
+    def public_info(self):
+        return {"alg": "Ed25519", "kid": self.key_id, "public_key": _b64url(self.public_key)}
+
+
+# === 名單內容 ===
+def _departure(service_date, departure_time):
+    # pymysql 的 TIME 欄位是 timedelta
+    if isinstance(departure_time, timedelta):
+        return datetime.combine(service_date, datetime.min.time()) + departure_time
+    if departure_time:
+        return datetime.combine(service_date, datetime.strptime(str(departure_time), "%H:%M:%S").time())
+    return None
+
+
+def _trip_scope(db, trip_id, service_date=None):
+    """
+    班次範圍：發車時間 - MANIFEST_WINDOW_MIN ～ 發車時間 + 末站 eta + MANIFEST_WINDOW_MIN，
+    上車站在該路線方向上；查無班次回傳 None
+    """
+    trip = db.fetch_one("""
+        SELECT id, route_no, direction, operation_status, departure_time, license_plate
+        FROM route_schedule
+        WHERE id = %s
+    """, (int(trip_id),))
+    if not trip:
+        return None
+
+    service_date = service_date or date.today()
+    direction = normalize_direction(trip.get("direction"))
+    stops = db.rows("""
+        SELECT stop_name, eta_from_start
+        FROM bus_route_stations
+        WHERE route_id = %s AND direction = %s
+        ORDER BY stop_order
+    """, (trip["route_no"], direction))
+
+    departure = _departure(service_date, trip.get("departure_time"))
+    if departure is None:
+        # 沒有排定發車時間：整個營運日
+        start = datetime.combine(service_date, datetime.min.time())
+        end = start + timedelta(days=1)
+    else:
+        span = max((int(s.get("eta_from_start") or 0) for s in stops), default=0)
+        start = departure - timedelta(minutes=MANIFEST_WINDOW_MIN)
+        end = departure + timedelta(minutes=span + MANIFEST_WINDOW_MIN)
+
+    return {"trip": trip, "date": service_date, "direction": direction, "departure": departure,
+            "start": start, "end": end,
+            "stops": sorted({s["stop_name"] for s in stops if s.get("stop_name")})}
+
+
+def _scope_filter(scope):
+    names = scope["stops"]
+    sql = f"""booking_time >= %s AND booking_time < %s
+              AND booking_start_station_name IN ({', '.join(['%s'] * len(names))})"""
+    return sql, (scope["start"], scope["end"], *names)
+
+
+def trip_reservation_ids(db, trip_id, service_date=None):
+    """班次範圍內的全部訂位 id（不論付款 / 審核狀態），上傳掃碼紀錄時確認屬於這個班次"""
+    scope = _trip_scope(db, trip_id, service_date)
+    if scope is None or not scope["stops"]:
+        return set()
+    where, params = _scope_filter(scope)
+    return {int(row["reservation_id"]) for row in db.rows(f"""
+        SELECT reservation_id FROM reservation WHERE {where}
+    """, params)}
+
+
+def build_trip_manifest(db, trip_id, service_date=None):
+    """
+    依 route_schedule 班次建立名單內容（尚未簽章）；查無班次回傳 None
+    名單只放班次範圍內（見 _trip_scope）已付款且審核通過的訂位
+    """
+    scope = _trip_scope(db, trip_id, service_date)
+    if scope is None:
+        return None
+    trip, departure, end = scope["trip"], scope["departure"], scope["end"]
+
+    rows = []
+    if scope["stops"]:
+        where, params = _scope_filter(scope)
+        rows = db.rows(f"""
+            SELECT reservation_id, user_id, booking_number,
+                   booking_start_station_name, booking_end_station_name, dispatch_status
+            FROM reservation
+            WHERE payment_status = 'paid' AND review_status = 'approved'
+              AND {where}
+            ORDER BY booking_time, reservation_id
+        """, params)
+
+    reservations = []
+    for row in rows:
+        rid, uid = int(row["reservation_id"]), int(row.get("user_id") or 0)
+        if not uid:
+            continue
+        reservations.append([
+            rid, uid, int(row.get("booking_number") or 1),
+            row.get("booking_start_station_name") or "", row.get("booking_end_station_name") or "",
+            1 if row.get("dispatch_status") == "assigned" else 0,
+        ])
+
+    return {
+        "v": 1,
+        "trip": {
+            "id": int(trip["id"]),
+            "route_id": int(trip["route_no"]),
+            "direction": scope["direction"],
+            "date": scope["date"].isoformat(),
+            "departure": departure.strftime("%H:%M") if departure else None,
+            "license_plate": trip.get("license_plate"),
+            "operation_status": trip.get("operation_status"),
+        },
+        "issued_at": int(time.time()),
+        "expires_at": int(end.timestamp()) + MANIFEST_GRACE_SEC,
+        "passengers": sum(r[2] for r in reservations),
+        "columns": MANIFEST_COLUMNS,
+        "reservations": reservations,
+        "token_public_key": _b64url(token_public_key()),
+    }
+
+
+# === 上傳掃碼紀錄 ===
+def apply_checkins(db, checkins, allowed_ids=None):
+    """
+    checkins：[{"reservation_id", "user_id"（可省略）}, ...]；allowed_ids 為該班次的訂位（trip_reservation_ids），
+    不在其中的不鎖定也不寫入
+    回傳 {"applied": [reservation_id, ...], "conflicts": [{"reservation_id", "reason", ...}, ...]}
+    衝突原因：duplicate（同批重複）、not_on_trip（不是這個班次的訂位）、not_found、user_mismatch、not_eligible（名單下載後被取消 / 退款）、
+    already_boarded（已在線上驗證或重複上傳，不影響結果）
+    """
+    wanted, conflicts = {}, []
+    for item in checkins:
+        rid = int(item["reservation_id"])
+        if rid in wanted:
+            conflicts.append({"reservation_id": rid, "reason": "duplicate"})
+            continue
+        if allowed_ids is not None and rid not in allowed_ids:
+            conflicts.append({"reservation_id": rid, "reason": "not_on_trip"})
+            continue
+        wanted[rid] = item
+    if not wanted:
+        return {"applied": [], "conflicts": conflicts}
+
+    ids = sorted(wanted)
+    placeholders = ", ".join(["%s"] * len(ids))
+    applied = []
+    with db.transaction() as cursor:
+        # 鎖定這些訂位，避免與後台同時修改狀態
+        cursor.execute(f"""
+            SELECT reservation_id, user_id, payment_status, review_status, dispatch_status
+            FROM reservation
+            WHERE reservation_id IN ({placeholders})
+            FOR UPDATE
+        """, ids)
+        current = {int(row["reservation_id"]): row for row in cursor.fetchall()}
+
+        for rid in ids:
+            row, uid = current.get(rid), wanted[rid].get("user_id")
+            if row is None:
+                conflicts.append({"reservation_id": rid, "reason": "not_found"})
+            elif uid is not None and int(row.get("user_id") or 0) != int(uid):
+                conflicts.append({"reservation_id": rid, "reason": "user_mismatch"})
+            elif row.get("payment_status") != "paid" or row.get("review_status") != "approved":
+                conflicts.append({"reservation_id": rid, "reason": "not_eligible",
+                                  "payment_status": row.get("payment_status"),
+                                  "review_status": row.get("review_status")})
+            elif row.get("dispatch_status") == "assigned":
+                conflicts.append({"reservation_id": rid, "reason": "already_boarded"})
+            else:
+                applied.append(rid)
+
+        if applied:
+            cursor.execute(f"""
+                UPDATE reservation
+                SET dispatch_status = 'assigned', updated_at = NOW()
+                WHERE reservation_id IN ({', '.join(['%s'] * len(applied))})
+            """, applied)
+
+    return {"applied": applied, "conflicts": conflicts}
@@ -0,0 +1,187 @@
+"""
+路線進度比對（map matching）：把 GPS 定位投影到路線折線上
+
+每條 (route_id, direction) 依 stop_order 串成折線，線段端點預先投影成平面公尺座標並補齊成同寬矩陣。
+整個車隊（每台車 × 去程/回程兩個候選）一次向量化算完：
+  - 每個線段上的垂足與垂直距離
+  - 航向與線段方位角差距的懲罰（區分共用道路的去程/回程）
+  - 取成本最低的線段 → 沿線距離、上一站、下一站
+"""
+import numpy as np
+
+from Backend.Nearest import normalize_direction
+
+EARTH_RADIUS_M = 6371000.0
+DIRECTIONS = ("去程", "回程")
+
+HEADING_PENALTY_M = 120.0   # 航向完全相反時加的成本（公尺）
+HEADING_MIN_SPEED = 5       # 低於此速度（km/h）航向不可靠，不加懲罰
+SWITCH_PENALTY_M = 25.0     # 不是排班方向時加的成本，成本相近時沿用排班方向
+AT_STOP_RADIUS_M = 40.0     # 距下一站小於此距離視為已到站
+
+
+class RouteMatcher:
+    def __init__(self, stops, ref_lat=None):
+        """
+        stops：dict 的可迭代物件，需有 route_id, direction, latitude, longitude, stop_name，
+               stop_order 可選（沒有則依輸入順序）
+        """
+        groups = {}
+        for s in stops:
+            try:
+                lat = float(s["latitude"])
+                lon = float(s["longitude"])
+            except (TypeError, ValueError):
+                continue
+            if not lat or not lon:
+                continue
+            key = (int(s["route_id"]), normalize_direction(s.get("direction")))
+            groups.setdefault(key, []).append((s.get("stop_order"), lat, lon, s.get("stop_name")))
+
+        all_lat = [r[1] for rows in groups.values() for r in rows]
+        self.ref_lat = ref_lat if ref_lat is not None else (float(np.mean(all_lat)) if all_lat else 23.98)
+        self._kx = EARTH_RADIUS_M * np.cos(np.radians(self.ref_lat)) * np.pi / 180
+        self._ky = EARTH_RADIUS_M * np.pi / 180
+
+        self.keys = sorted(groups)
+        self._key_pos = {k: i for i, k in enumerate(self.keys)}
+        # 只有一站的路線視為長度 0 的線段
+        width = max((max(len(v) - 1, 1) for v in groups.values()), default=1)
+
+        n = len(self.keys)
+        self.ax = np.zeros((n, width))
+        self.ay = np.zeros((n, width))
+        self.dx = np.zeros((n, width))       # 線段向量
+        self.dy = np.zeros((n, width))
+        self.seg_len = np.zeros((n, width))
+        self.seg_len2 = np.ones((n, width))  # 長度平方（0 長度以 1 代替避免除以 0）
+        self.cum = np.zeros((n, width))      # 線段起點的沿線距離
+        self.bearing = np.zeros((n, width))  # 線段方位角（度，北=0 順時針）
+        self.valid = np.zeros((n, width), dtype=bool)
+        self.route_len = np.zeros(n)
+        self.stop_names = []
+        self.stop_orders = []
+        self.stop_cum = []                   # 每站的沿線距離
+
+        for i, key in enumerate(self.keys):
+            rows = groups[key]
+            rows.sort(key=lambda r: (r[0] is None, r[0] or 0))
+            x, y = self._project(np.array([r[1] for r in rows]), np.array([r[2] for r in rows]))
+            if len(rows) == 1:
+                x, y = np.repeat(x, 2), np.repeat(y, 2)
+            m = len(x) - 1
+            seg_dx, seg_dy = np.diff(x), np.diff(y)
+            seg_len = np.hypot(seg_dx, seg_dy)
+
+            self.ax[i, :m], self.ay[i, :m] = x[:-1], y[:-1]
+            self.dx[i, :m], self.dy[i, :m] = seg_dx, seg_dy
+            self.seg_len[i, :m] = seg_len
+            self.seg_len2[i, :m] = np.where(seg_len > 0, seg_len ** 2, 1.0)
+            self.cum[i, :m] = np.concatenate(([0.0], np.cumsum(seg_len)[:-1]))
+            self.bearing[i, :m] = np.degrees(np.arctan2(seg_dx, seg_dy)) % 360
+            self.valid[i, :m] = True
+            self.route_len[i] = float(seg_len.sum())
+
+            self.stop_names.append([r[3] for r in rows])
+            self.stop_orders.append([r[0] if r[0] is not None else j + 1 for j, r in enumerate(rows)])
+            self.stop_cum.append(np.concatenate(([0.0], np.cumsum(seg_len)))[:len(rows)])
+
+    @classmethod
+    def from_rows(cls, rows):
+        return cls(rows)
+
+    def __len__(self):
+        return len(self.keys)
+
+    def _project(self, lat, lon):
+        return np.asarray(lon, dtype=float) * self._kx, np.asarray(lat, dtype=float) * self._ky
+
+    def match_many(self, route_ids, lats, lons, headings=None, speeds=None, directions=None):
+        """
+        每台車同時比對該路線的去程與回程，回傳與輸入等長的 list：
+          {"direction", "distance_along_m", "route_length_m", "offset_m",
+           "last_stop", "last_stop_order", "next_stop", "next_stop_order", "current_stop"}
+        directions 為排班方向（可為 None），成本相近時優先；路線沒有站點則為 None
+        """
+        count = len(route_ids)
+        if count == 0:
+            return []
+        headings = headings if headings is not None else [None] * count
+        speeds = speeds if speeds is not None else [None] * count
+        preferred = [normalize_direction(d) if d not in (None, "") else None for d in (directions or [None] * count)]
+
+        # 候選：第 v 台車 × 兩個方向 → 第 2v、2v+1 列
+        pos = np.array([
+            self._key_pos.get((int(r), d), -1)
+            for r in route_ids for d in DIRECTIONS
+        ], dtype=np.int64)
+        known = pos >= 0
+        out = [None] * count
+        if not known.any():
+            return out
+
+        px, py = self._project(np.repeat(np.asarray(lats, dtype=float), 2), np.repeat(np.asarray(lons, dtype=float), 2))
+        idx = np.where(known, pos, 0)
+
+        # 每個線段上的垂足（t 限制在 0~1）與垂直距離
+        ax, ay, dx, dy = self.ax[idx], self.ay[idx], self.dx[idx], self.dy[idx]
+        t = np.clip(((px[:, None] - ax) * dx + (py[:, None] - ay) * dy) / self.seg_len2[idx], 0.0, 1.0)
+        offset = np.hypot(ax + t * dx - px[:, None], ay + t * dy - py[:, None])
+
+        # 航向懲罰：與線段方位角同向為 0，反向為 HEADING_PENALTY_M
+        heading = np.array([
+            float(h) if h not in (None, "") and (s in (None, "") or float(s) >= HEADING_MIN_SPEED) else np.nan
+            for h, s in zip(headings, speeds) for _ in DIRECTIONS
+        ])
+        diff = np.radians(heading[:, None] - self.bearing[idx])
+        penalty = np.where(np.isnan(diff), 0.0, HEADING_PENALTY_M * (1 - np.cos(diff)) / 2)
+
+        cost = np.where(self.valid[idx] & known[:, None], offset + penalty, np.inf)
+        best = np.argmin(cost, axis=1)
+        rows = np.arange(len(idx))
+        best_cost = cost[rows, best]
+        best_t = t[rows, best]
+        best_offset = offset[rows, best]
+        along = self.cum[idx, best] + best_t * self.seg_len[idx, best]
+
+        # 兩個方向擇一（非排班方向加 SWITCH_PENALTY_M）
+        for v in range(count):
+            choice = None
+            for c in (2 * v, 2 * v + 1):
+                if not np.isfinite(best_cost[c]):
+                    continue
+                direction = DIRECTIONS[c - 2 * v]
+                score = best_cost[c] + (SWITCH_PENALTY_M if preferred[v] and direction != preferred[v] else 0.0)
+                if choice is None or score < choice[0]:
+                    choice = (score, c, direction)
+            if choice is None:
+                continue
+            _, c, direction = choice
+            out[v] = self._describe(int(idx[c]), int(best[c]), direction, float(along[c]), float(best_offset[c]))
+        return out
+
+    def _describe(self, i, seg, direction, along, offset):
+        names, orders, stop_cum = self.stop_names[i], self.stop_orders[i], self.stop_cum[i]
+        last = min(seg, len(names) - 1)
+        # 垂足已到線段終點（含最後一段的末端）時，上一站往後推一站
+        if last + 1 < len(names) and along >= stop_cum[last + 1] - 1e-6:
+            last += 1
+        nxt = last + 1 if last + 1 < len(names) else None
+
+        current = names[last]
+        if nxt is not None and stop_cum[nxt] - along <= AT_STOP_RADIUS_M:
+            current = names[nxt]
+        return {
+            "direction": direction,
+            "distance_along_m": round(along, 1),
+            "route_length_m": round(float(self.route_len[i]), 1),
+            "offset_m": round(offset, 1),
+            "last_stop": names[last],
+            "last_stop_order": int(orders[last]),
+            "next_stop": names[nxt] if nxt is not None else None,
+            "next_stop_order": int(orders[nxt]) if nxt is not None else None,
+            "current_stop": current,
+        }
+
+    def match(self, route_id, lat, lon, heading=None, speed=None, direction=None):
+        return self.match_many([route_id], [lat], [lon], [heading], [speed], [direction])[0]
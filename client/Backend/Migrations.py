@@ -0,0 +1,77 @@
+"""
+啟動時自動套用的 schema 調整（可重複執行）
+
+每一筆：(名稱, 檢查 SQL, 套用 SQL 或 callable(db))
+檢查 SQL 回傳 >0 表示已存在就略過；新建的資料庫則由 bus_system_backup.sql 直接帶入。
+"""
+from Backend.Timetable import parse_minutes
+
+
+def backfill_stop_times(db):
+    """把 bus_route_stations.schedule 的 "HH:MM,..." 字串拆成 bus_stop_times（每站每班一列）"""
+    rows = db.rows("SELECT station_id, schedule FROM bus_route_stations WHERE schedule IS NOT NULL AND schedule <> ''")
+    params = [
+        (row["station_id"], trip_no, minute)
+        for row in rows
+        for trip_no, minute in enumerate(parse_minutes(row["schedule"]), start=1)
+    ]
+    count = db.run_many(
+        "INSERT IGNORE INTO bus_stop_times (station_id, trip_no, departure_min) VALUES (%s, %s, %s)",
+        params,
+    )
+    print(f"[Migrations] bus_stop_times 匯入 {count} 筆（{len(rows)} 站）")
+
+
+MIGRATIONS = [
+    (
+        "ttcarimport.idx_car_licence_seq",
+        """SELECT COUNT(*) AS n FROM information_schema.STATISTICS
+           WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = 'ttcarimport' AND INDEX_NAME = 'idx_car_licence_seq'""",
+        "CREATE INDEX IF NOT EXISTS idx_car_licence_seq ON ttcarimport (car_licence, seq)",
+    ),
+    (
+        "car_backup.idx_route_seq",
+        """SELECT COUNT(*) AS n FROM information_schema.STATISTICS
+           WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = 'car_backup' AND INDEX_NAME = 'idx_route_seq'""",
+        "CREATE INDEX IF NOT EXISTS idx_route_seq ON car_backup (route, seq)",
+    ),
+    (
+        "bus_stop_times",
+        """SELECT COUNT(*) AS n FROM information_schema.TABLES
+           WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = 'bus_stop_times'""",
+        """CREATE TABLE IF NOT EXISTS bus_stop_times (
+               station_id int(10) unsigned NOT NULL COMMENT '站點ID（對應 bus_route_stations.station_id）',
+               trip_no smallint(5) unsigned NOT NULL COMMENT '第幾班（從 1 開始）',
+               departure_min smallint(5) unsigned NOT NULL COMMENT '發車/到站時刻（午夜起算分鐘）',
+               PRIMARY KEY (station_id, trip_no),
+               KEY idx_station_departure (station_id, departure_min),
+               CONSTRAINT fk_stop_times_station FOREIGN KEY (station_id)
+                   REFERENCES bus_route_stations (station_id) ON DELETE CASCADE
+           ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci""",
+    ),
+    (
+        # 已有任何資料就視為匯入過；之後由時刻表匯入功能同時寫入兩邊
+        "bus_stop_times.backfill",
+        "SELECT COUNT(*) AS n FROM bus_stop_times",
+        backfill_stop_times,
+    ),
+]
+
+
+def apply_migrations(db):
+    """db 為 MySQL_Doing；回傳本次實際套用的名稱列表"""
+    applied = []
+    for name, check_sql, apply_sql in MIGRATIONS:
+        try:
+            if db.scalar(check_sql, default=0):
+                continue
+            print(f"[Migrations] 套用 {name}")
+            if callable(apply_sql):
+                apply_sql(db)
+            else:
+                db.run(apply_sql)
+            applied.append(name)
+        except Exception as e:
+            # 多個 worker 同時啟動時可能互相搶先，失敗只記錄不中斷啟動
+            print(f"[Migrations] {name} 失敗: {e}")
+    return applied
@@ -1,13 +1,191 @@
 from dotenv import load_dotenv
 from pymysql.err import OperationalError
+from collections import deque
+from contextlib import contextmanager
+from threading import Condition
 import pymysql
 import pandas as pd
+import time
 import os
 
 load_dotenv()
 
+
+# ============================================================
+# 🧵 連線池設定（可由環境變數調整，建議依 uvicorn worker 數分配）
+# ============================================================
+DB_POOL_MIN = int(os.getenv("DB_POOL_MIN", 2))           # 常駐最少連線數
+DB_POOL_MAX = int(os.getenv("DB_POOL_MAX", 10))          # 同時借出的最大連線數
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", 1800))  # 連線存活超過 N 秒就回收重建
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", 10))  # 池滿時最多等待秒數
+DB_POOL_PING_IDLE = float(os.getenv("DB_POOL_PING_IDLE", 5))  # 閒置超過 N 秒才在借出時 ping
+
+
+class PoolTimeout(OperationalError):
+    """連線池耗盡且等待逾時"""
+
+
+class _PooledConn:
+    """包一層連線，紀錄建立與最後使用時間"""
+    __slots__ = ("raw", "created_at", "last_used")
+
+    def __init__(self, raw):
+        now = time.monotonic()
+        self.raw = raw
+        self.created_at = now
+        self.last_used = now
+
+
+# ============================================================
+# ✅ ConnectionPool：有上下限、借出時健康檢查、逾時回收、統計資訊
+# ============================================================
+class ConnectionPool:
+    def __init__(self, connect, min_size=DB_POOL_MIN, max_size=DB_POOL_MAX,
+                 recycle=DB_POOL_RECYCLE, timeout=DB_POOL_TIMEOUT, ping_idle=DB_POOL_PING_IDLE):
+        self._connect = connect
+        self.min_size = max(0, min_size)
+        self.max_size = max(1, max_size, self.min_size)
+        self.recycle = recycle
+        self.timeout = timeout
+        self.ping_idle = ping_idle
+
+        self._idle = deque()
+        self._in_use = 0
+        self._waiters = 0
+        self._cond = Condition()
+
+        # 統計
+        self._checkouts = 0
+        self._timeouts = 0
+        self._created = 0
+        self._discarded = 0
+        self._wait_total = 0.0
+        self._wait_max = 0.0
+
+    # === 內部工具 ===
+    def _new_conn(self):
+        conn = _PooledConn(self._connect())
+        with self._cond:
+            self._created += 1
+        return conn
+
+    def _close(self, conn):
+        try:
+            conn.raw.close()
+        except Exception:
+            pass
+        with self._cond:
+            self._discarded += 1
+
+    def _is_usable(self, conn):
+        """回收過舊連線；閒置一段時間的連線借出前先 ping"""
+        now = time.monotonic()
+        if self.recycle > 0 and now - conn.created_at > self.recycle:
+            return False
+        if now - conn.last_used > self.ping_idle:
+            try:
+                conn.raw.ping(reconnect=False)
+            except Exception:
+                return False
+        return True
+
+    def warmup(self):
+        """預先建立 min_size 條連線"""
+        while True:
+            with self._cond:
+                if len(self._idle) + self._in_use >= self.min_size:
+                    return
+                self._in_use += 1  # 先佔位，避免超過上限
+            try:
+                conn = self._new_conn()
+            except Exception:
+                with self._cond:
+                    self._in_use -= 1
+                    self._cond.notify()
+                raise
+            with self._cond:
+                self._in_use -= 1
+                self._idle.append(conn)
+                self._cond.notify()
+
+    # === 借出 / 歸還 ===
+    def acquire(self):
+        start = time.monotonic()
+        deadline = start + self.timeout
+        conn = None
+        with self._cond:
+            while True:
+                if self._idle:
+                    conn = self._idle.pop()
+                    break
+                if self._in_use < self.max_size:
+                    break
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self._timeouts += 1
+                    raise PoolTimeout(f"connection pool exhausted (max={self.max_size}, waited {self.timeout}s)")
+                self._waiters += 1
+                try:
+                    self._cond.wait(remaining)
+                finally:
+                    self._waiters -= 1
+            self._in_use += 1
+
+        try:
+            if conn is not None and not self._is_usable(conn):
+                self._close(conn)
+                conn = None
+            if conn is None:
+                conn = self._new_conn()
+        except Exception:
+            with self._cond:
+                self._in_use -= 1
+                self._cond.notify()
+            raise
+
+        waited = time.monotonic() - start
+        with self._cond:
+            self._checkouts += 1
+            self._wait_total += waited
+            if waited > self._wait_max:
+                self._wait_max = waited
+        return conn
+
+    def release(self, conn, discard=False):
+        if discard:
+            self._close(conn)
+        else:
+            conn.last_used = time.monotonic()
+        with self._cond:
+            self._in_use -= 1
+            if not discard:
+                self._idle.append(conn)
+            self._cond.notify()
+
+    def stats(self):
+        with self._cond:
+            checkouts = self._checkouts
+            return {
+                "min_size": self.min_size,
+                "max_size": self.max_size,
+                "in_use": self._in_use,
+                "idle": len(self._idle),
+                "waiters": self._waiters,
+                "checkouts": checkouts,
+                "timeouts": self._timeouts,
+                "created": self._created,
+                "discarded": self._discarded,
+                "checkout_avg_ms": round(self._wait_total / checkouts * 1000, 3) if checkouts else 0.0,
+                "checkout_max_ms": round(self._wait_max * 1000, 3),
+            }
+
+
+# 同一個 process 內所有 MySQL_Doing 共用同一組連線池（依連線參數區分）
+_POOLS = {}
+
+
 # ============================================================
-# ✅ 改良後的 MySQL_Doing（自動重連＋回傳 DataFrame）
+# ✅ 改良後的 MySQL_Doing（連線池＋回傳 DataFrame）
 # ============================================================
 class MySQL_Doing:
     def __init__(self):
@@ -16,7 +194,10 @@ class MySQL_Doing:
         self.Port = int(os.getenv("Port", 3306))
         self.Password = os.getenv("Password_SQL", "")
         self.Database = os.getenv("Database", "")
-        self.conn = self._connect()  # 💡 初始化連線
+        key = (self.Host, self.Port, self.User, self.Database)
+        if key not in _POOLS:
+            _POOLS[key] = ConnectionPool(self._connect)
+        self.pool = _POOLS[key]  # 💡 連線改為第一次使用時才建立
 
     def _connect(self):
         """建立新的資料庫連線"""
@@ -31,24 +212,104 @@ class MySQL_Doing:
             autocommit=True
         )
 
-    def run(self, sql, params=None):
-        """每次查詢都開新連線，確保執行安全"""
+    def warmup(self):
+        self.pool.warmup()
+
+    def stats(self):
+        return self.pool.stats()
+
+    def _execute(self, sql, params, fetch):
+        """從連線池借連線執行，連線異常時直接丟棄不放回池中"""
+        conn = self.pool.acquire()
+        broken = False
         try:
-            conn = self._connect()
-            with conn.cursor() as cursor:
+            with conn.raw.cursor() as cursor:
                 cursor.execute(sql, params or ())
-                conn.commit()  # ✅ 無論 SELECT 或 UPDATE 都會提交
+                conn.raw.commit()  # ✅ 無論 SELECT 或 UPDATE 都會提交
 
-                if cursor.description:
-                    rows = cursor.fetchall()
-                    return pd.DataFrame(rows)
-                return None
-        except OperationalError as e:
+                if not cursor.description:
+                    return None
+                if fetch == "one":
+                    return cursor.fetchone()
+                return cursor.fetchall()
+        except (OperationalError, pymysql.err.InterfaceError) as e:
+            broken = True  # 連線層級錯誤才丟棄，SQL 錯誤的連線仍可重用
             print("[MySQL] OperationalError:", e)
             raise
         finally:
+            self.pool.release(conn, discard=broken)
+
+    def run_many(self, sql, seq_params):
+        """
+        批次寫入，回傳影響筆數。
+        INSERT ... VALUES (%s, ...) 會由 pymysql 展開成多列 INSERT（超過 max_allowed_packet 自動分段），
+        整批在同一條連線、同一個交易內完成
+        """
+        seq_params = list(seq_params)
+        if not seq_params:
+            return 0
+        conn = self.pool.acquire()
+        broken = False
+        try:
+            conn.raw.begin()
             try:
-                conn.close()
-            except:
-                pass
+                with conn.raw.cursor() as cursor:
+                    count = cursor.executemany(sql, seq_params)
+                conn.raw.commit()
+            except Exception:
+                conn.raw.rollback()
+                raise
+            return count
+        except (OperationalError, pymysql.err.InterfaceError) as e:
+            broken = True
+            print("[MySQL] OperationalError:", e)
+            raise
+        finally:
+            self.pool.release(conn, discard=broken)
+
+    @contextmanager
+    def transaction(self):
+        """
+        同一條連線、同一個交易內執行多句 SQL：with 區塊拿到 cursor（DictCursor），
+        正常結束 commit，發生例外 rollback 後往外拋
+        """
+        conn = self.pool.acquire()
+        broken = False
+        try:
+            conn.raw.begin()
+            try:
+                with conn.raw.cursor() as cursor:
+                    yield cursor
+                conn.raw.commit()
+            except Exception:
+                conn.raw.rollback()
+                raise
+        except (OperationalError, pymysql.err.InterfaceError) as e:
+            broken = True
+            print("[MySQL] OperationalError:", e)
+            raise
+        finally:
+            self.pool.release(conn, discard=broken)
+
+    def run(self, sql, params=None):
+        """回傳 DataFrame（SELECT）或 None，給需要 pandas 運算的地方用"""
+        rows = self._execute(sql, params, "all")
+        if rows is None:
+            return None
+        return pd.DataFrame(rows)
+
+    # === 輕量結果：不經過 pandas，直接回傳 dict ===
+    def rows(self, sql, params=None):
+        """回傳 list[dict]；非查詢語句回傳空 list"""
+        return list(self._execute(sql, params, "all") or [])
+
+    def fetch_one(self, sql, params=None):
+        """回傳第一筆 dict，查無資料回傳 None"""
+        return self._execute(sql, params, "one")
 
+    def scalar(self, sql, params=None, default=None):
+        """回傳第一筆第一欄的值，查無資料回傳 default"""
+        row = self._execute(sql, params, "one")
+        if not row:
+            return default
+        return next(iter(row.values()))
@@ -0,0 +1,147 @@
+"""
+最近站點計算（NumPy 向量化 haversine）
+
+每條 (route_id, direction) 的站點座標預先轉成弧度並補齊成同寬的矩陣，
+多台車可以一次算完對自己路線所有站點的距離，不再逐站呼叫 Python 函式。
+GIS_AllFast、GIS_About 與之後的 ETA 計算共用。
+"""
+from threading import Lock
+import numpy as np
+
+EARTH_RADIUS_M = 6371000.0
+
+
+def normalize_direction(x):
+    t = str(x or "").strip()
+    if "返" in t or "回" in t or t == "1":
+        return "回程"
+    return "去程"
+
+
+def haversine_np(lat1, lon1, lat2, lon2):
+    """參數為弧度（可廣播），回傳公尺"""
+    dphi = lat2 - lat1
+    dlambda = lon2 - lon1
+    a = np.sin(dphi / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin(dlambda / 2) ** 2
+    return 2 * EARTH_RADIUS_M * np.arcsin(np.sqrt(np.clip(a, 0.0, 1.0)))
+
+
+class StopIndex:
+    def __init__(self, stops):
+        """
+        stops：dict 的可迭代物件，需有 route_id, direction, latitude, longitude, stop_name，
+               stop_order 可選（沒有則依輸入順序編號）
+        """
+        groups = {}
+        for s in stops:
+            try:
+                lat = float(s["latitude"])
+                lon = float(s["longitude"])
+            except (TypeError, ValueError):
+                continue
+            key = (int(s["route_id"]), normalize_direction(s.get("direction")))
+            groups.setdefault(key, []).append((s.get("stop_order"), lat, lon, s.get("stop_name")))
+
+        self.keys = sorted(groups)
+        self._key_pos = {k: i for i, k in enumerate(self.keys)}
+        width = max((len(v) for v in groups.values()), default=1)
+
+        n = len(self.keys)
+        self.lat = np.full((n, width), np.nan)   # 弧度
+        self.lon = np.full((n, width), np.nan)
+        self.valid = np.zeros((n, width), dtype=bool)
+        self.names = [[None] * width for _ in range(n)]
+        self.orders = np.zeros((n, width), dtype=np.int32)
+
+        for i, key in enumerate(self.keys):
+            rows = groups[key]
+            rows.sort(key=lambda r: (r[0] is None, r[0] or 0))
+            m = len(rows)
+            self.lat[i, :m] = np.radians([r[1] for r in rows])
+            self.lon[i, :m] = np.radians([r[2] for r in rows])
+            self.valid[i, :m] = True
+            self.orders[i, :m] = [r[0] if r[0] is not None else j + 1 for j, r in enumerate(rows)]
+            for j, r in enumerate(rows):
+                self.names[i][j] = r[3]
+
+    @classmethod
+    def from_rows(cls, rows):
+        return cls(rows)
+
+    def __len__(self):
+        return len(self.keys)
+
+    def has_route(self, route_id, direction):
+        return (int(route_id), normalize_direction(direction)) in self._key_pos
+
+    def stops(self, route_id, direction):
+        """回傳該路線方向的站點 [(stop_order, lat, lon, stop_name)]（度）"""
+        i = self._key_pos.get((int(route_id), normalize_direction(direction)))
+        if i is None:
+            return []
+        m = int(self.valid[i].sum())
+        return [
+            (int(self.orders[i, j]), float(np.degrees(self.lat[i, j])), float(np.degrees(self.lon[i, j])), self.names[i][j])
+            for j in range(m)
+        ]
+
+    def nearest_many(self, route_ids, directions, lats, lons):
+        """
+        多台車一次計算；回傳與輸入等長的 list，
+        每筆為 {"stop_name", "stop_order", "distance_m"}，找不到路線則為 None
+        """
+        count = len(route_ids)
+        if count == 0:
+            return []
+        pos = np.array([
+            self._key_pos.get((int(r), normalize_direction(d)), -1)
+            for r, d in zip(route_ids, directions)
+        ], dtype=np.int64)
+        known = pos >= 0
+        out = [None] * count
+        if not known.any():
+            return out
+
+        idx = pos[known]
+        car_lat = np.radians(np.asarray(lats, dtype=float)[known])[:, None]
+        car_lon = np.radians(np.asarray(lons, dtype=float)[known])[:, None]
+
+        dist = haversine_np(car_lat, car_lon, self.lat[idx], self.lon[idx])
+        dist = np.where(self.valid[idx], dist, np.inf)
+        best = np.argmin(dist, axis=1)
+        best_dist = dist[np.arange(len(idx)), best]
+
+        for k, i in enumerate(np.flatnonzero(known)):
+            if not np.isfinite(best_dist[k]):
+                continue
+            row, col = idx[k], best[k]
+            out[i] = {
+                "stop_name": self.names[row][col],
+                "stop_order": int(self.orders[row, col]),
+                "distance_m": float(best_dist[k]),
+            }
+        return out
+
+    def nearest(self, route_id, direction, lat, lon):
+        return self.nearest_many([route_id], [direction], [lat], [lon])[0]
+
+
+class LazyIndex:
+    """第一次使用時才載入，收到失效通知（例如站點被修改）後下次重新建立"""
+
+    def __init__(self, builder):
+        self._builder = builder
+        self._value = None
+        self._lock = Lock()
+
+    def get(self):
+        value = self._value
+        if value is not None:
+            return value
+        with self._lock:
+            if self._value is None:
+                self._value = self._builder()
+            return self._value
+
+    def invalidate(self, message=None):
+        self._value = None
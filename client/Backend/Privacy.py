@@ -0,0 +1,150 @@
+"""
+隱私權政策文件（/api/privacy）
+
+- 來源為 PRIVACY_URL（預設 GitHub gist），以 httpx.AsyncClient 在背景定時更新，不阻塞事件迴圈
+- 成功取得的內容寫到磁碟（PRIVACY_CACHE_PATH），冷啟動先讀磁碟，不依賴遠端
+- 回應 body 與 ETag 在更新時就算好，請求只是讀記憶體
+"""
+from datetime import datetime
+import asyncio
+import hashlib
+import json
+import os
+import tempfile
+
+import httpx
+
+from Backend.FastJSON import dumps
+
+PRIVACY_URL = os.getenv(
+    "PRIVACY_URL",
+    "https://gist.githubusercontent.com/Cody20179/ef17eeb9e2880a3a677bb5c74232c003/raw/gistfile1.txt",
+)
+PRIVACY_CACHE_PATH = os.getenv(
+    "PRIVACY_CACHE_PATH",
+    os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "cache", "privacy.json"),
+)
+PRIVACY_REFRESH_SEC = int(os.getenv("PRIVACY_REFRESH_SEC", 3600))
+PRIVACY_TIMEOUT_SEC = 10
+
+
+class PrivacyDocument:
+    def __init__(self, url=PRIVACY_URL, cache_path=PRIVACY_CACHE_PATH,
+                 refresh_interval=PRIVACY_REFRESH_SEC, timeout=PRIVACY_TIMEOUT_SEC):
+        self.url = url
+        self.cache_path = cache_path
+        self.refresh_interval = refresh_interval
+        self.timeout = timeout
+
+        self.content = None
+        self.body = None           # {"content": ...} 序列化後的 bytes
+        self.etag = None
+        self.fetched_at = None
+        self._upstream_etag = None
+        self._refreshing = None    # 進行中的更新（同時只會有一個）
+        self._task = None
+        self._counters = {"refreshes": 0, "not_modified": 0, "errors": 0}
+        self._last_error = None
+
+    # === 內容 ===
+    def _set(self, content, upstream_etag=None, fetched_at=None):
+        self.content = content
+        self.body = dumps({"content": content})
+        self.etag = '"privacy-' + hashlib.sha256(content.encode("utf-8")).hexdigest()[:16] + '"'
+        self._upstream_etag = upstream_etag
+        self.fetched_at = fetched_at or datetime.now().isoformat(timespec="seconds")
+
+    def load_disk(self):
+        """冷啟動時讀磁碟快取；檔案不存在或損毀時回傳 False"""
+        try:
+            with open(self.cache_path, encoding="utf-8") as f:
+                saved = json.load(f)
+            if not saved.get("content"):
+                return False
+            self._set(saved["content"], saved.get("upstream_etag"), saved.get("fetched_at"))
+            return True
+        except FileNotFoundError:
+            return False
+        except Exception as e:
+            print(f"[Privacy] 磁碟快取讀取失敗: {e}")
+            return False
+
+    def _save_disk(self):
+        # 先寫暫存檔再換名，避免寫到一半被讀到；各 worker 各自更新，暫存檔名不能共用
+        directory = os.path.dirname(self.cache_path)
+        os.makedirs(directory, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=directory, prefix=os.path.basename(self.cache_path) + ".", suffix=".tmp")
+        try:
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                json.dump({"content": self.content, "upstream_etag": self._upstream_etag, "fetched_at": self.fetched_at},
+                          f, ensure_ascii=False)
+            os.replace(tmp, self.cache_path)
+        except BaseException:
+            os.unlink(tmp)
+            raise
+
+    # === 更新 ===
+    async def _fetch(self):
+        headers = {"If-None-Match": self._upstream_etag} if self._upstream_etag and self.content else {}
+        try:
+            async with httpx.AsyncClient(timeout=self.timeout, follow_redirects=True) as client:
+                resp = await client.get(self.url, headers=headers)
+            if resp.status_code == 304:
+                self._counters["not_modified"] += 1
+                return True
+            resp.raise_for_status()
+            if not resp.text.strip():
+                raise ValueError("遠端內容為空")
+        except Exception as e:
+            self._counters["errors"] += 1
+            self._last_error = str(e)
+            print(f"[Privacy] 更新失敗，沿用現有內容: {e}")
+            return False
+
+        self._counters["refreshes"] += 1
+        if resp.text != self.content:
+            self._set(resp.text, resp.headers.get("etag"))
+            try:
+                await asyncio.to_thread(self._save_disk)
+            except Exception as e:
+                print(f"[Privacy] 寫入磁碟快取失敗: {e}")
+        else:
+            self._upstream_etag = resp.headers.get("etag")
+        return True
+
+    async def refresh(self):
+        """同時多個呼叫時共用同一次請求"""
+        if self._refreshing is None:
+            self._refreshing = asyncio.ensure_future(self._fetch())
+            self._refreshing.add_done_callback(lambda _: setattr(self, "_refreshing", None))
+        return await asyncio.shield(self._refreshing)
+
+    async def ensure(self):
+        """還沒有任何內容時（磁碟也沒有）等一次遠端"""
+        if self.body is None:
+            await self.refresh()
+        return self.body is not None
+
+    async def _loop(self):
+        while True:
+            await asyncio.sleep(self.refresh_interval)
+            await self.refresh()
+
+    async def start(self):
+        """在 startup 呼叫：有磁碟快取就立即可用並在背景更新，否則等第一次下載"""
+        if self.load_disk():
+            asyncio.ensure_future(self.refresh())
+        else:
+            await self.refresh()
+        if self._task is None:
+            self._task = asyncio.ensure_future(self._loop())
+
+    def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    def stats(self):
+        stats = dict(self._counters)
+        stats.update({"url": self.url, "etag": self.etag, "fetched_at": self.fetched_at, "last_error": self._last_error})
+        return stats
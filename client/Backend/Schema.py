@@ -0,0 +1,138 @@
+"""
+資料表欄位快取（client 與 my-bus-system 共用同一份實作與 Redis 版本號）
+
+啟動時從 information_schema 一次載入所有資料表的欄位與型別，
+之後只在 TTL 到期或 Redis 上的 schema 版本號改變時才重新載入，
+不再於每個請求執行 SHOW COLUMNS。
+
+兩個服務各自的 Docker build context 只含自己的目錄，所以 client/Backend/Schema.py 與
+my-bus-system/Schema.py 是同一份檔案的兩個副本：修改時兩邊一起改，
+client/tests/test_schema_copies.py 會在內容不一致時失敗。
+"""
+from threading import RLock
+import os
+import time
+
+SCHEMA_TTL_SEC = int(os.getenv("SCHEMA_TTL_SEC", 3600))            # 最長多久強制重新載入
+SCHEMA_VERSION_CHECK_SEC = int(os.getenv("SCHEMA_VERSION_CHECK_SEC", 10))  # 多久檢查一次版本號
+SCHEMA_VERSION_KEY = "schema:version"
+
+_COLUMNS_SQL = """
+    SELECT TABLE_NAME, COLUMN_NAME, DATA_TYPE
+    FROM information_schema.COLUMNS
+    WHERE TABLE_SCHEMA = DATABASE()
+    ORDER BY TABLE_NAME, ORDINAL_POSITION
+"""
+
+
+class TableRegistry:
+    def __init__(self, fetch_rows, redis_client=None, ttl=SCHEMA_TTL_SEC, check_every=SCHEMA_VERSION_CHECK_SEC):
+        """
+        fetch_rows(sql) -> list[dict]：執行查詢的函式（兩個 app 各自傳入）
+        redis_client：用來讀寫共用的 schema 版本號；可傳連線、回傳連線的函式或 None
+        """
+        self._fetch_rows = fetch_rows
+        self._redis = redis_client
+        self.ttl = ttl
+        self.check_every = check_every
+
+        self._lock = RLock()
+        self._tables = {}        # table -> [(column, data_type), ...]
+        self._select_cache = {}  # (table, desired, aliases) -> select 欄位字串
+        self._version = None
+        self._loaded_at = 0.0
+        self._checked_at = 0.0
+
+    # === 版本號 ===
+    def _redis_client(self):
+        return self._redis() if callable(self._redis) else self._redis
+
+    def _remote_version(self):
+        client = self._redis_client()
+        if client is None:
+            return None
+        try:
+            return client.get(SCHEMA_VERSION_KEY)
+        except Exception as e:
+            print(f"[Schema] 讀取版本號失敗: {e}")
+            return self._version
+
+    def bump_version(self):
+        """schema 變更（migration）後呼叫，所有 worker 與另一個 app 會在下次檢查時重新載入"""
+        client = self._redis_client()
+        if client is not None:
+            try:
+                client.incr(SCHEMA_VERSION_KEY)
+            except Exception as e:
+                print(f"[Schema] 更新版本號失敗: {e}")
+        self.refresh()
+
+    # === 載入 ===
+    def refresh(self):
+        version = self._remote_version()
+        rows = self._fetch_rows(_COLUMNS_SQL) or []
+        tables = {}
+        for row in rows:
+            tables.setdefault(row["TABLE_NAME"], []).append((row["COLUMN_NAME"], row["DATA_TYPE"]))
+        with self._lock:
+            self._tables = tables
+            self._select_cache = {}
+            self._version = version
+            self._loaded_at = self._checked_at = time.monotonic()
+        print(f"[Schema] 已載入 {len(tables)} 張資料表欄位 (version={version})")
+
+    def _ensure_fresh(self):
+        now = time.monotonic()
+        if self._tables and now - self._loaded_at < self.ttl:
+            if now - self._checked_at < self.check_every:
+                return
+            self._checked_at = now
+            if self._remote_version() == self._version:
+                return
+        with self._lock:
+            # 其他執行緒可能已經重新載入
+            if self._tables and time.monotonic() - self._loaded_at < 1:
+                return
+            self.refresh()
+
+    # === 查詢介面 ===
+    def columns(self, table):
+        self._ensure_fresh()
+        return [c for c, _ in self._tables.get(table, [])]
+
+    def types(self, table):
+        self._ensure_fresh()
+        return dict(self._tables.get(table, []))
+
+    def has_column(self, table, column):
+        return column in self.types(table)
+
+    def select_list(self, table, desired=None, aliases=None):
+        """
+        依實際存在的欄位組出 SELECT 欄位字串，讓查詢結果直接對應輸出模型。
+        desired：想要輸出的欄位（None 表示全部）
+        aliases：{輸出欄位: [候選 DB 欄位, ...]}，DB 欄位名不同時用 AS 轉成輸出名稱
+        """
+        self._ensure_fresh()
+        key = (table, tuple(desired or ()), tuple(sorted((k, tuple(v)) for k, v in (aliases or {}).items())))
+        cached = self._select_cache.get(key)
+        if cached is not None:
+            return cached
+
+        existing = [c for c, _ in self._tables.get(table, [])]
+        if not existing:
+            raise KeyError(f"unknown table: {table}")
+        names = set(existing)
+        parts = []
+        for col in (desired or existing):
+            if col in names:
+                parts.append(f"`{col}`")
+                continue
+            for candidate in (aliases or {}).get(col, []):
+                if candidate in names:
+                    parts.append(f"`{candidate}` AS `{col}`")
+                    break
+        result = ", ".join(parts)
+        with self._lock:
+            self._select_cache[key] = result
+        return result
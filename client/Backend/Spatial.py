@@ -0,0 +1,191 @@
+"""
+全路網站點空間索引（經緯度網格分桶）
+
+- 公車站（bus_route_stations，每條路線一組）與行動遊花蓮點位（action_tour_hualien）放在同一個網格
+- 查詢只看涵蓋半徑的那幾格，再用 haversine 精算距離；不掃整張表
+- 站點異動時只重建該路線那一組（admin 廣播 route_stops 帶 route_id），沒帶 route_id 才整個重建
+"""
+from threading import Lock
+import math
+
+EARTH_RADIUS_M = 6371000.0
+METERS_PER_DEG_LAT = 111320.0
+
+
+def haversine_m(lat1, lon1, lat2, lon2):
+    """參數為度，回傳公尺"""
+    phi1, phi2 = math.radians(lat1), math.radians(lat2)
+    dphi = phi2 - phi1
+    dlambda = math.radians(lon2 - lon1)
+    a = math.sin(dphi / 2) ** 2 + math.cos(phi1) * math.cos(phi2) * math.sin(dlambda / 2) ** 2
+    return 2 * EARTH_RADIUS_M * math.asin(math.sqrt(min(1.0, a)))
+
+
+def _coord(value):
+    try:
+        v = float(value)
+    except (TypeError, ValueError):
+        return None
+    return v if v else None  # 0 / NULL 視為未設定座標
+
+
+class GridIndex:
+    """
+    依 (緯度格, 經度格) 分桶；格子大小約 cell_m 公尺（以 ref_lat 換算經度寬度）。
+    點位以 group 為單位整組替換：寫入時先建好新的桶再換上，讀取端不需要加鎖。
+    """
+
+    def __init__(self, cell_m=250, ref_lat=23.98):
+        self.cell_m = cell_m
+        self.dlat = cell_m / METERS_PER_DEG_LAT
+        self.dlon = cell_m / (METERS_PER_DEG_LAT * math.cos(math.radians(ref_lat)))
+
+        self._lock = Lock()
+        self._buckets = {}  # (i, j) -> tuple[(lat, lon, record)]
+        self._groups = {}   # group -> list[(cell, point)]
+
+    def _cell(self, lat, lon):
+        return (math.floor(lat / self.dlat), math.floor(lon / self.dlon))
+
+    def __len__(self):
+        return sum(len(points) for points in self._groups.values())
+
+    def groups(self):
+        return list(self._groups)
+
+    def replace_group(self, group, records):
+        """records：dict 的可迭代物件，需有 lat, lon；座標無效的略過。records 為空等同移除該組"""
+        added = []
+        for rec in records:
+            lat, lon = _coord(rec.get("lat")), _coord(rec.get("lon"))
+            if lat is None or lon is None:
+                continue
+            rec = dict(rec, lat=lat, lon=lon)
+            added.append((self._cell(lat, lon), (lat, lon, rec)))
+
+        with self._lock:
+            buckets = dict(self._buckets)
+            changed = {}
+            for cell, point in self._groups.pop(group, ()):
+                bucket = changed.get(cell)
+                if bucket is None:
+                    bucket = changed[cell] = list(buckets.get(cell, ()))
+                bucket.remove(point)
+            for cell, point in added:
+                bucket = changed.get(cell)
+                if bucket is None:
+                    bucket = changed[cell] = list(buckets.get(cell, ()))
+                bucket.append(point)
+            for cell, bucket in changed.items():
+                if bucket:
+                    buckets[cell] = tuple(bucket)
+                else:
+                    buckets.pop(cell, None)
+            if added:
+                self._groups[group] = added
+            self._buckets = buckets
+        return len(added)
+
+    def clear(self):
+        with self._lock:
+            self._buckets = {}
+            self._groups = {}
+
+    # === 查詢 ===
+    def within(self, lat, lon, radius_m, kinds=None):
+        """半徑內所有點，依距離排序；回傳 [(distance_m, record)]"""
+        buckets = self._buckets
+        span_lat = radius_m / METERS_PER_DEG_LAT
+        # 經度寬度以範圍內最靠近極區的緯度計算，確保不會漏掉邊緣的格子
+        cos_lat = math.cos(math.radians(min(89.0, abs(lat) + span_lat)))
+        span_lon = span_lat / max(cos_lat, 1e-6)
+
+        i0, j0 = self._cell(lat - span_lat, lon - span_lon)
+        i1, j1 = self._cell(lat + span_lat, lon + span_lon)
+        hits = []
+        for i in range(i0, i1 + 1):
+            for j in range(j0, j1 + 1):
+                for plat, plon, rec in buckets.get((i, j), ()):
+                    if kinds and rec.get("kind") not in kinds:
+                        continue
+                    d = haversine_m(lat, lon, plat, plon)
+                    if d <= radius_m:
+                        hits.append((d, rec))
+        hits.sort(key=lambda h: h[0])
+        return hits
+
+    def nearest(self, lat, lon, k=5, max_radius_m=5000, kinds=None):
+        """最近 k 個點：從一格的半徑開始倍增，半徑內已滿 k 個時即為答案"""
+        radius = self.cell_m
+        while True:
+            radius = min(radius, max_radius_m)
+            hits = self.within(lat, lon, radius, kinds)
+            if len(hits) >= k or radius >= max_radius_m:
+                return hits[:k]
+            radius *= 2
+
+
+class NetworkStops:
+    """
+    GridIndex 的載入與失效：
+      load_route(route_id) → 該路線的公車站 records（route_id=None 表示全部）
+      load_tour()          → 行動遊花蓮 records
+    第一次查詢時整批載入；route_stops 事件帶 route_id 時只重建那條路線。
+    """
+
+    def __init__(self, load_route, load_tour, cell_m=250):
+        self._load_route = load_route
+        self._load_tour = load_tour
+        self.cell_m = cell_m
+        self.index = GridIndex(cell_m=cell_m)
+        self._lock = Lock()
+        self._ready = False
+        self._counters = {"full_builds": 0, "route_builds": 0, "errors": 0}
+
+    def _full_build(self):
+        by_route = {}
+        for rec in self._load_route(None):
+            by_route.setdefault(int(rec["route_id"]), []).append(rec)
+        tour = list(self._load_tour())
+
+        # 建好新的索引再換上，查詢中的請求繼續用舊的
+        index = GridIndex(cell_m=self.cell_m)
+        for route_id, records in by_route.items():
+            index.replace_group(("route", route_id), records)
+        index.replace_group(("tour",), tour)
+        self.index = index
+        self._counters["full_builds"] += 1
+        print(f"[Spatial] 索引建立完成：{len(by_route)} 條路線、{len(self.index)} 個點位")
+
+    def get(self):
+        if not self._ready:
+            with self._lock:
+                if not self._ready:
+                    self._full_build()
+                    self._ready = True
+        return self.index
+
+    def rebuild_route(self, route_id):
+        with self._lock:
+            if not self._ready:
+                return  # 尚未載入過，下次查詢時會整批建立
+            try:
+                self.index.replace_group(("route", int(route_id)), self._load_route(int(route_id)))
+                self._counters["route_builds"] += 1
+            except Exception as e:
+                self._counters["errors"] += 1
+                self._ready = False
+                print(f"[Spatial] 路線 {route_id} 重建失敗，下次查詢時整批重建: {e}")
+
+    def on_event(self, message):
+        """EventBus handler（route_stops）"""
+        route_id = message.get("route_id")
+        if route_id in (None, ""):
+            self._ready = False
+        else:
+            self.rebuild_route(route_id)
+
+    def stats(self):
+        stats = dict(self._counters)
+        stats.update({"ready": self._ready, "points": len(self.index), "groups": len(self.index.groups())})
+        return stats
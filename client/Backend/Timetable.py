@@ -0,0 +1,161 @@
+"""
+編譯後的路線時刻表（/api/Route_ScheduleTime）
+
+每條 (route_id, direction) 第一次查詢時讀取 bus_stop_times（尚未匯入的站才解析 schedule 字串），
+存成「站 × 班次」的整數分鐘矩陣（午夜起算），並預先算好一天 1440 分鐘各自對應的當前班次 k。
+查表以整分鐘比較：HH:MM:00 整點用該分鐘，已過了幾秒就用下一分鐘（lookup_minute），
+與原本 now.time() <= head[k] 含秒數的比較相同；23:59 過後的下一分鐘為 1440，另外多算一格。
+之後每次查詢只是查表＋取矩陣的一欄；站點或時刻異動（route_stops 事件）時才重新編譯。
+"""
+from datetime import datetime
+from threading import Lock
+import numpy as np
+
+MINUTES_PER_DAY = 24 * 60
+
+
+def parse_minutes(s):
+    """ "HH:MM,..." → [分鐘]；格式錯誤的項目略過（與原本 strptime 的容錯相同）"""
+    out = []
+    if not s:
+        return out
+    for t in str(s).split(","):
+        t = t.strip()
+        try:
+            tm = datetime.strptime(t, "%H:%M")
+        except ValueError:
+            continue
+        out.append(tm.hour * 60 + tm.minute)
+    return out
+
+
+def lookup_minute(now):
+    """查表用的分鐘：剛好整分用該分鐘，否則下一分鐘（發車時間本身沒有秒數，08:00:30 已過 08:00 班次）"""
+    minute = now.hour * 60 + now.minute
+    return minute + 1 if now.second or now.microsecond else minute
+
+
+def format_minutes(m):
+    return f"{m // 60:02d}:{m % 60:02d}"
+
+
+class CompiledTimetable:
+    def __init__(self, rows):
+        """
+        rows：已依 stop_order 排序的 dict，需有 stop_name；
+              有 times（bus_stop_times 的分鐘列表）就直接使用，否則解析 schedule 字串
+        """
+        self.stop_names = [r["stop_name"] for r in rows]
+        parsed, self.full = [], []
+        for r in rows:
+            times = r.get("times")
+            if times:
+                parsed.append(list(times))
+                self.full.append(",".join(format_minutes(m) for m in times))
+            else:
+                full = (r.get("schedule") or "").strip()
+                parsed.append(parse_minutes(full))
+                self.full.append(full)
+
+        n_trips = max((len(p) for p in parsed), default=0)
+        # 站 × 班次；某站班次不足時以該站最後一班補齊（等同原本「沒有第 k 筆就取最後一筆」）
+        self.matrix = np.full((len(rows), max(n_trips, 1)), -1, dtype=np.int16)
+        self.has_times = np.zeros(len(rows), dtype=bool)
+        for i, times in enumerate(parsed):
+            if times:
+                self.matrix[i, :len(times)] = times
+                self.matrix[i, len(times):] = times[-1]
+                self.has_times[i] = True
+
+        head = parsed[0] if parsed else []
+        tail = parsed[-1] if parsed else []
+        self.trips = min(len(head), len(tail))  # 頭尾站班次數不同時取較短者
+        self.trip_at = self._compile_lookup(head[:self.trips], tail[:self.trips])
+        self._answers = {}  # minute -> data（同一分鐘內的結果相同）
+
+    def _compile_lookup(self, head, tail):
+        """
+        每分鐘的當前班次 k（只看頭尾站）：
+          1) 第一個 minute <= head[k] 的 k
+          2) 否則第一個 minute <= tail[k] 的 k
+          3) 否則最後一班
+        """
+        if not self.trips:
+            return None
+        minutes = np.arange(MINUTES_PER_DAY + 1)[:, None]  # 多一格 1440：23:59 之後
+        by_head = minutes <= np.asarray(head)[None, :]
+        by_tail = minutes <= np.asarray(tail)[None, :]
+        return np.where(
+            by_head.any(axis=1), by_head.argmax(axis=1),
+            np.where(by_tail.any(axis=1), by_tail.argmax(axis=1), self.trips - 1),
+        ).astype(np.int32)
+
+    def trip_index(self, minute):
+        if self.trip_at is None:
+            return None
+        if not 0 <= minute <= MINUTES_PER_DAY:
+            minute %= MINUTES_PER_DAY
+        return int(self.trip_at[minute])
+
+    def answer(self, minute):
+        """回傳 (k, data)；data 為 [{"stop_name", "next_time", "full_schedule"}]"""
+        k = self.trip_index(minute)
+        data = self._answers.get(minute)
+        if data is None:
+            data = [
+                {
+                    "stop_name": name,
+                    "next_time": format_minutes(int(self.matrix[i, k])) if k is not None and self.has_times[i] else None,
+                    "full_schedule": full,
+                }
+                for i, (name, full) in enumerate(zip(self.stop_names, self.full))
+            ]
+            self._answers[minute] = data
+        return k, data
+
+
+class TimetableStore:
+    """
+    load_rows(route_id) → 該路線所有站 [{"stop_name", "schedule", "times", "direction", "ord"}]
+    每條路線載入一次，依 direction 分別編譯；direction 為空時與原本相同，整條路線一起排序。
+    """
+
+    def __init__(self, load_rows):
+        self._load_rows = load_rows
+        self._lock = Lock()
+        self._compiled = {}  # (route_id, direction or "") -> CompiledTimetable
+        self._counters = {"compiles": 0, "hits": 0, "invalidations": 0}
+
+    def get(self, route_id, direction=None):
+        key = (int(route_id), direction or "")
+        table = self._compiled.get(key)
+        if table is not None:
+            self._counters["hits"] += 1
+            return table
+        with self._lock:
+            table = self._compiled.get(key)
+            if table is None:
+                rows = [r for r in self._load_rows(key[0]) if not direction or r.get("direction") == direction]
+                rows.sort(key=lambda r: r["ord"])
+                table = CompiledTimetable(rows)
+                self._counters["compiles"] += 1
+                if rows:  # 不存在的路線不快取，避免任意 route_id 讓快取無限成長
+                    self._compiled[key] = table
+        return table
+
+    def invalidate(self, route_id=None):
+        with self._lock:
+            if route_id in (None, ""):
+                self._compiled = {}
+            else:
+                self._compiled = {k: v for k, v in self._compiled.items() if k[0] != int(route_id)}
+            self._counters["invalidations"] += 1
+
+    def on_event(self, message):
+        """EventBus handler（route_stops）"""
+        self.invalidate(message.get("route_id"))
+
+    def stats(self):
+        stats = dict(self._counters)
+        stats["compiled"] = len(self._compiled)
+        return stats
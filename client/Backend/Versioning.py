@@ -0,0 +1,171 @@
+"""
+參考資料的版本號與條件式 GET（ETag / Last-Modified）
+
+- 每份資料集（routes、route_stops、tour、announcements）在 Redis 有 {ns}:ver 與 {ns}:mtime，
+  寫入端（my-bus-system、公告 API）把版本 +1 並在 hbus:invalidate 廣播
+- {ns}:epoch 是隨機值，不存在時才產生：Redis 清空後 :ver 會從 1 重新計數，
+  版本字串為 "{epoch}.{ver}"，舊 ETag 不會對到清空後的內容
+- ETag 由「資料集 + 版本 + 查詢參數」組成，不看內容；If-None-Match 命中時直接 304，不查資料庫
+- 200 的回應 body 依 (資料集, 參數) 快取已序列化的 bytes（orjson），版本改變才重新查詢與序列化
+"""
+from collections import OrderedDict
+from email.utils import formatdate, parsedate_to_datetime
+from threading import Lock
+import hashlib
+import secrets
+import time
+
+from fastapi import Response
+
+from Backend.FastJSON import FastJSONResponse, dumps
+
+
+def _quote(value):
+    return f'"{value}"'
+
+
+def not_modified(request, etag, mtime=None):
+    """
+    條件式 GET 判斷：If-None-Match 依逗號拆開、去掉 W/ 後弱比較（* 一律命中），
+    有帶 If-None-Match 就不看 If-Modified-Since
+    """
+    inm = request.headers.get("if-none-match")
+    if inm is not None:
+        tags = {t.strip().removeprefix("W/") for t in inm.split(",")}
+        return "*" in tags or etag in tags
+    ims = request.headers.get("if-modified-since")
+    if ims and mtime is not None:
+        try:
+            return int(mtime) <= parsedate_to_datetime(ims).timestamp()
+        except (TypeError, ValueError):
+            return False
+    return False
+
+
+class DatasetVersions:
+    """dataset → (version, mtime)；行程內快取 ttl 秒，收到廣播立即更新"""
+
+    def __init__(self, redis_client, ttl=30):
+        self._redis = redis_client
+        self.ttl = ttl
+        self._lock = Lock()
+        self._known = {}  # ns -> (expire_at, version, mtime)
+        self._counters = {"redis_reads": 0, "redis_errors": 0, "events": 0, "bumps": 0, "epochs": 0}
+
+    def get(self, ns):
+        """回傳 (version, mtime)；Redis 讀不到時回傳 None（呼叫端不送驗證標頭）"""
+        entry = self._known.get(ns)
+        if entry and entry[0] > time.monotonic():
+            return entry[1], entry[2]
+        try:
+            version, mtime, epoch = self._redis.mget(f"{ns}:ver", f"{ns}:mtime", f"{ns}:epoch")
+            self._counters["redis_reads"] += 1
+            if not epoch:
+                epoch = self._ensure_epoch(ns)
+        except Exception as e:
+            self._counters["redis_errors"] += 1
+            print(f"[Versioning] 讀取 {ns} 版本失敗: {e}")
+            return None
+        self._remember(ns, version, mtime, epoch)
+        return self._known[ns][1], self._known[ns][2]
+
+    def _ensure_epoch(self, ns):
+        """{ns}:epoch 不存在（首次使用或 Redis 被清空）時產生；多個 worker 同時產生以先寫入的為準"""
+        self._redis.set(f"{ns}:epoch", secrets.token_hex(4), nx=True)
+        self._counters["epochs"] += 1
+        return self._redis.get(f"{ns}:epoch")
+
+    def _remember(self, ns, version, mtime, epoch):
+        try:
+            mtime = float(mtime) if mtime not in (None, "") else None
+        except (TypeError, ValueError):
+            mtime = None
+        with self._lock:
+            self._known[ns] = (time.monotonic() + self.ttl, f"{epoch}.{version or 0}", mtime)
+
+    def bump(self, ns):
+        """本服務自己寫入時呼叫：版本 +1、記錄修改時間；回傳要廣播的 payload"""
+        now = time.time()
+        pipe = self._redis.pipeline(transaction=True)
+        pipe.incr(f"{ns}:ver")
+        pipe.set(f"{ns}:mtime", now)
+        pipe.get(f"{ns}:epoch")
+        version, _, epoch = pipe.execute()
+        epoch = epoch or self._ensure_epoch(ns)
+        self._counters["bumps"] += 1
+        self._remember(ns, version, now, epoch)
+        return {"version": version, "epoch": epoch, "mtime": now}
+
+    def on_event(self, message):
+        """EventBus handler：廣播帶有新版本（與 epoch）時直接採用，否則下次讀 Redis"""
+        self._counters["events"] += 1
+        ns = message.get("ns")
+        if message.get("version") is not None and message.get("epoch"):
+            self._remember(ns, message["version"], message.get("mtime"), message["epoch"])
+        else:
+            with self._lock:
+                self._known.pop(ns, None)
+
+    def stats(self):
+        stats = dict(self._counters)
+        stats["datasets"] = {ns: {"version": v, "mtime": m} for ns, (_, v, m) in self._known.items()}
+        return stats
+
+
+class VersionedResponses:
+    """以 DatasetVersions 產生條件式回應，並快取已序列化的 body"""
+
+    def __init__(self, versions, maxsize=512):
+        self._versions = versions
+        self.maxsize = maxsize
+        self._lock = Lock()
+        self._bodies = OrderedDict()  # (ns, key) -> (version, body)
+        self._counters = {"not_modified": 0, "body_hit": 0, "body_miss": 0, "unversioned": 0}
+
+    def etag(self, ns, version, key):
+        digest = hashlib.blake2b(repr(key).encode("utf-8"), digest_size=6).hexdigest()
+        return _quote(f"{ns}-v{version}-{digest}")
+
+    def _body(self, ns, key, version, loader):
+        cache_key = (ns, key)
+        with self._lock:
+            entry = self._bodies.get(cache_key)
+            if entry and entry[0] == version:
+                self._bodies.move_to_end(cache_key)
+                self._counters["body_hit"] += 1
+                return entry[1]
+        self._counters["body_miss"] += 1
+        body = dumps(loader())
+        with self._lock:
+            self._bodies[cache_key] = (version, body)
+            self._bodies.move_to_end(cache_key)
+            while len(self._bodies) > self.maxsize:
+                self._bodies.popitem(last=False)
+        return body
+
+    def respond(self, request, ns, key, loader, max_age=60):
+        """
+        key：查詢參數 tuple（不含 ns）；loader() 回傳可 JSON 序列化的資料
+        同一版本內回應視為不變：304 與 200 都帶 ETag / Last-Modified / Cache-Control
+        """
+        current = self._versions.get(ns)
+        if current is None:
+            self._counters["unversioned"] += 1
+            return FastJSONResponse(loader(), headers={"Cache-Control": "no-cache"})
+
+        version, mtime = current
+        etag = self.etag(ns, version, key)
+        headers = {"ETag": etag, "Cache-Control": f"public, max-age={max_age}, must-revalidate"}
+        if mtime is not None:
+            headers["Last-Modified"] = formatdate(mtime, usegmt=True)
+
+        if not_modified(request, etag, mtime):
+            self._counters["not_modified"] += 1
+            return Response(status_code=304, headers=headers)
+        return FastJSONResponse(self._body(ns, key, version, loader), headers=headers)
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._counters)
+            stats["bodies"] = len(self._bodies)
+        return stats
@@ -0,0 +1,425 @@
+"""
+效能微基準（不需連資料庫，用假資料模擬真實欄位）
+
+用法: python Benchmark.py [項目 ...]
+      不給項目則全部執行
+"""
+from datetime import datetime, timedelta
+from decimal import Decimal
+import random
+import sys
+import timeit
+
+import pandas as pd
+
+
+def _report(name, seconds, loops):
+    print(f"  {name:<40} {seconds / loops * 1e6:10.1f} µs/次")
+
+
+# ============================================================
+# rows：DataFrame 結果 vs 輕量 dict 結果（bus_route_stations 欄位）
+# ============================================================
+def _fake_route_stations(n):
+    base = datetime(2025, 1, 1, 8, 0, 0)
+    rows = []
+    for i in range(n):
+        rows.append({
+            "station_id": i + 1,
+            "route_id": 1 + i // 40,
+            "route_name": "市民小巴1(洽公直達線)",
+            "direction": "去程" if i % 2 == 0 else "回程",
+            "stop_name": f"站點{i}",
+            "latitude": Decimal("23.9") + Decimal(random.randint(0, 99999)) / Decimal(10 ** 7),
+            "longitude": Decimal("121.5") + Decimal(random.randint(0, 99999)) / Decimal(10 ** 7),
+            "eta_from_start": i % 40,
+            "stop_order": i % 40 + 1,
+            "schedule": ",".join(f"{8 + k}:{(i * 3) % 60:02d}" for k in range(10)),
+            "address": "花蓮縣花蓮市",
+            "status": 1,
+            "created_at": base + timedelta(minutes=i),
+        })
+    return rows
+
+
+class _StubCursor:
+    """DictCursor 替身：每次 fetch 都重新建立 dict（與 pymysql 相同）"""
+
+    def __init__(self, rows):
+        self._rows = rows
+        self.description = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def execute(self, sql, params=()):
+        self.description = [(k,) for k in self._rows[0]] if self._rows else [("station_id",)]
+
+    def fetchall(self):
+        return [dict(r) for r in self._rows]
+
+    def fetchone(self):
+        return dict(self._rows[0]) if self._rows else None
+
+
+class _StubPool:
+    """MySQL_Doing 的連線池替身：省掉網路，只量結果轉換的成本"""
+
+    def __init__(self, rows):
+        raw = type("Raw", (), {"cursor": lambda _self: _StubCursor(rows), "commit": lambda _self: None})()
+        self._conn = type("Conn", (), {"raw": raw})()
+
+    def acquire(self):
+        return self._conn
+
+    def release(self, conn, discard=False):
+        pass
+
+
+def bench_rows():
+    from Backend.MySQL import MySQL_Doing
+
+    sql = "SELECT * FROM bus_route_stations WHERE route_id = %s"
+    print("[rows] bus_route_stations（經過 MySQL_Doing，游標為 DictCursor 替身）")
+    for n in (1, 40, 400):
+        db = MySQL_Doing()
+        db.pool = _StubPool(_fake_route_stations(n))
+
+        def via_dataframe():
+            # 原本端點的寫法：run() 取 DataFrame 再轉回 records、修正 numpy 型別
+            df = db.run(sql, (1,))
+            records = df.where(pd.notnull(df), None).to_dict(orient="records")
+            for r in records:
+                for k, v in r.items():
+                    if hasattr(v, "item"):
+                        r[k] = v.item()
+            return records
+
+        def via_rows():
+            return db.rows(sql, (1,))
+
+        assert len(via_dataframe()) == len(via_rows()) == n
+        loops = 2000 if n < 400 else 200
+        print(f" n={n}")
+        _report("run() → DataFrame → records", timeit.timeit(via_dataframe, number=loops), loops)
+        _report("rows() (list[dict])", timeit.timeit(via_rows, number=loops), loops)
+
+    # 單筆查詢（/me、verify_boarding_token 這類）
+    db = MySQL_Doing()
+    db.pool = _StubPool(_fake_route_stations(1))
+    loops = 5000
+    print(" fetch_one")
+    _report("run().iloc[0].to_dict()", timeit.timeit(lambda: db.run(sql, (1,)).iloc[0].to_dict(), number=loops), loops)
+    _report("fetch_one() (dict)", timeit.timeit(lambda: db.fetch_one(sql, (1,)), number=loops), loops)
+
+
+# ============================================================
+# nearest：DataFrame.apply(haversine) vs NumPy 向量化 StopIndex
+# ============================================================
+def _haversine(lat1, lon1, lat2, lon2):
+    import math
+    R = 6371000
+    phi1, phi2 = math.radians(lat1), math.radians(lat2)
+    dphi = math.radians(lat2 - lat1)
+    dlambda = math.radians(lon2 - lon1)
+    a = math.sin(dphi / 2) ** 2 + math.cos(phi1) * math.cos(phi2) * math.sin(dlambda / 2) ** 2
+    return 2 * R * math.atan2(math.sqrt(a), math.sqrt(1 - a))
+
+
+def bench_nearest():
+    from Backend.Nearest import StopIndex
+
+    random.seed(7)
+    stops = []
+    for route_id in range(1, 9):
+        for direction in ("去程", "回程"):
+            for order in range(1, 41):
+                stops.append({
+                    "route_id": route_id, "direction": direction, "stop_order": order,
+                    "stop_name": f"{route_id}-{direction}-{order}",
+                    "latitude": 23.95 + random.random() * 0.05,
+                    "longitude": 121.58 + random.random() * 0.05,
+                })
+    df_stops = pd.DataFrame(stops)
+    index = StopIndex.from_rows(stops)
+
+    print("[nearest] 8 路線 × 2 方向 × 40 站")
+    for fleet in (10, 100):
+        cars = [(random.randint(1, 8), random.choice(("去程", "回程")),
+                 23.95 + random.random() * 0.05, 121.58 + random.random() * 0.05) for _ in range(fleet)]
+
+        def via_apply():
+            out = []
+            for route_id, direction, lat, lon in cars:
+                df = df_stops.loc[(df_stops["route_id"] == route_id) & (df_stops["direction"] == direction)].copy()
+                df.loc[:, "distance_m"] = df.apply(
+                    lambda s: _haversine(lat, lon, float(s["latitude"]), float(s["longitude"])), axis=1)
+                out.append(df.loc[df["distance_m"].idxmin()]["stop_name"])
+            return out
+
+        def via_numpy():
+            hits = index.nearest_many([c[0] for c in cars], [c[1] for c in cars],
+                                      [c[2] for c in cars], [c[3] for c in cars])
+            return [h["stop_name"] for h in hits]
+
+        assert via_apply() == via_numpy(), "結果不一致"
+        loops = 20 if fleet > 10 else 100
+        print(f" 車輛數={fleet}")
+        _report("DataFrame.apply(haversine)", timeit.timeit(via_apply, number=loops), loops)
+        _report("StopIndex.nearest_many", timeit.timeit(via_numpy, number=loops * 10), loops * 10)
+
+
+# ============================================================
+# ingest：批次定位逐筆驗證 + 即時狀態更新（不含 DB 寫入）
+# ============================================================
+def bench_ingest():
+    from Backend.Define import CarInsertRequest
+    from Backend.LiveState import LiveStateStore
+
+    base = datetime(2025, 1, 1, 8, 0, 0)
+    records = [{
+        "car_licence": f"KKA-{i % 30:04d}",
+        "Gpstime": (base + timedelta(seconds=i)).strftime("%Y-%m-%d %H:%M:%S"),
+        "X": 121.58 + random.random() * 0.05, "Y": 23.95 + random.random() * 0.05,
+        "Speed": random.randint(0, 60), "Deg": random.randint(0, 359), "acc": 1,
+    } for i in range(1000)]
+
+    def validate_and_ingest():
+        store = LiveStateStore()
+        fixes = [CarInsertRequest.model_validate(rec).model_dump() for rec in records]
+        store.ingest_many(fixes)
+
+    loops = 20
+    print("[ingest] 1000 筆補傳定位（30 台車）")
+    seconds = timeit.timeit(validate_and_ingest, number=loops)
+    _report("validate + ingest_many (每批)", seconds, loops)
+    print(f"  {'約':<40} {1000 * loops / seconds:10.0f} 筆/秒")
+
+
+# ============================================================
+# nearby：全路網附近站點，逐點掃描 vs GridIndex
+# ============================================================
+def bench_nearby():
+    from Backend.Spatial import GridIndex, haversine_m
+
+    random.seed(11)
+    points = [{"kind": "bus_stop", "name": f"s{i}", "lat": 23.90 + random.random() * 0.15,
+               "lon": 121.52 + random.random() * 0.12} for i in range(2000)]
+    index = GridIndex()
+    index.replace_group(("all",), points)
+    queries = [(23.90 + random.random() * 0.15, 121.52 + random.random() * 0.12) for _ in range(100)]
+
+    def via_scan():
+        return [sorted((haversine_m(la, lo, p["lat"], p["lon"]), p["name"]) for p in points)[:10] for la, lo in queries]
+
+    def via_grid():
+        return [[(d, rec["name"]) for d, rec in index.nearest(la, lo, 10)] for la, lo in queries]
+
+    assert via_scan() == via_grid(), "結果不一致"
+    print("[nearby] 2000 點位，k=10（每次 100 個查詢）")
+    _report("逐點掃描 + 排序", timeit.timeit(via_scan, number=5), 5)
+    _report("GridIndex.nearest", timeit.timeit(via_grid, number=50), 50)
+
+
+# ============================================================
+# mapmatch：整個車隊投影到路線折線（去程/回程兩個候選）
+# ============================================================
+def bench_mapmatch():
+    from Backend.MapMatch import RouteMatcher
+
+    random.seed(5)
+    stops = []
+    for route_id in range(1, 9):
+        for direction in ("去程", "回程"):
+            lat, lon = 23.95 + random.random() * 0.03, 121.58 + random.random() * 0.03
+            for order in range(1, 41):
+                lat += (random.random() - 0.3) * 0.002
+                lon += (random.random() - 0.3) * 0.002
+                stops.append({"route_id": route_id, "direction": direction, "stop_order": order,
+                              "stop_name": f"{route_id}-{direction}-{order}", "latitude": lat, "longitude": lon})
+    matcher = RouteMatcher.from_rows(stops)
+
+    print("[mapmatch] 8 路線 × 2 方向 × 40 站")
+    for fleet in (10, 100):
+        cars = [(random.randint(1, 8), 23.95 + random.random() * 0.05, 121.58 + random.random() * 0.05,
+                 random.randint(0, 359), random.randint(0, 50)) for _ in range(fleet)]
+        args = ([c[0] for c in cars], [c[1] for c in cars], [c[2] for c in cars],
+                [c[3] for c in cars], [c[4] for c in cars])
+        loops = 200
+        print(f" 車輛數={fleet}")
+        _report("RouteMatcher.match_many", timeit.timeit(lambda: matcher.match_many(*args), number=loops), loops)
+
+
+# ============================================================
+# json：/api/Route_Stations、/api/All_Route 整個 ASGI 請求（不經網路）
+#       原本：每次建 StationOut + response_model 驗證 + jsonable_encoder
+#       現在：載入時驗證一次，回應送出版本快取的 orjson bytes
+# ============================================================
+def _fake_routes(n):
+    base = datetime(2025, 1, 1)
+    return [{"route_id": i + 1, "route_name": f"市民小巴{i + 1}", "direction": "雙向", "start_stop": "花蓮轉運站",
+             "end_stop": "花蓮縣政府", "stop_count": 40, "status": 1, "created_at": base + timedelta(days=i)}
+            for i in range(n)]
+
+
+class _StaticVersions:
+    """固定版本號（取代 Redis）"""
+
+    def mget(self, *keys):
+        return ["7", "1735689600", "bench"]
+
+
+def _asgi_get(app, path, query=b"", headers=()):
+    import asyncio
+
+    scope = {"type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1", "method": "GET", "scheme": "http",
+             "path": path, "raw_path": path.encode(), "root_path": "", "query_string": query,
+             "headers": [(b"host", b"bench")] + list(headers), "client": ("127.0.0.1", 1), "server": ("bench", 80)}
+    result = {}
+
+    async def receive():
+        return {"type": "http.request", "body": b"", "more_body": False}
+
+    async def send(message):
+        if message["type"] == "http.response.start":
+            result["status"] = message["status"]
+        elif message["type"] == "http.response.body":
+            result["body"] = result.get("body", b"") + message.get("body", b"")
+
+    async def run(loops):
+        for _ in range(loops):
+            await app(scope, receive, send)
+
+    return result, lambda loops: asyncio.run(run(loops))
+
+
+def bench_json():
+    from typing import List
+    from fastapi import Depends, FastAPI, Request
+    from Backend.Define import StationOut, RouteStationsQuery
+    from Backend.Versioning import DatasetVersions, VersionedResponses
+    import json
+
+    stations = _fake_route_stations(40)
+    routes = _fake_routes(12)
+    conditional = VersionedResponses(DatasetVersions(_StaticVersions()))
+    validated = [StationOut(**r).model_dump(mode="json") for r in stations]
+
+    before, after = FastAPI(), FastAPI()
+
+    @before.get("/Route_Stations", response_model=List[StationOut])
+    def before_stations(q: RouteStationsQuery = Depends()):
+        return [StationOut(**r) for r in stations]  # 快取命中後仍逐筆建模型
+
+    @before.get("/All_Route")
+    def before_routes():
+        return routes
+
+    @after.get("/Route_Stations", response_model=List[StationOut])
+    def after_stations(request: Request, q: RouteStationsQuery = Depends()):
+        return conditional.respond(request, "route_stops", (q.route_id, q.direction or ""), lambda: validated)
+
+    @after.get("/All_Route")
+    def after_routes(request: Request):
+        return conditional.respond(request, "routes", (), lambda: routes)
+
+    query = b"route_id=1&direction=%E5%8E%BB%E7%A8%8B"
+    print("[json] 同一個 ASGI app 直接呼叫（40 站 / 12 條路線）")
+    for path, q in (("/Route_Stations", query), ("/All_Route", b"")):
+        (res_b, run_b), (res_a, run_a) = _asgi_get(before, path, q), _asgi_get(after, path, q)
+        run_b(1)
+        run_a(1)
+        assert json.loads(res_b["body"]) == json.loads(res_a["body"]), f"{path} 結果不一致"
+        loops = 500
+        print(f" {path}")
+        for name, run in (("原本（response_model / jsonable_encoder）", run_b), ("快取 bytes（orjson）", run_a)):
+            seconds = timeit.timeit(lambda: run(loops), number=1)
+            print(f"  {name:<40} {seconds / loops * 1e6:10.1f} µs/次 {loops / seconds:8.0f} 次/秒")
+        etag = conditional.etag("route_stops" if q else "routes", "bench.7", (1, "去程") if q else ())
+        res_304, run_304 = _asgi_get(after, path, q, [(b"if-none-match", etag.encode())])
+        run_304(1)
+        assert res_304["status"] == 304
+        seconds = timeit.timeit(lambda: run_304(loops), number=1)
+        print(f"  {'If-None-Match 命中（304）':<40} {seconds / loops * 1e6:10.1f} µs/次 {loops / seconds:8.0f} 次/秒")
+
+
+# ============================================================
+# token：乘車 token 舊格式（base64url JSON + 簽章）vs 精簡格式（base32 定長欄位）
+#       HB2 為 Ed25519 簽章（目前簽發），HB1 為 HMAC（僅驗證）
+#       比較字元數、QR 版本（模組數）與編碼 / 解碼驗章時間
+# ============================================================
+def bench_token():
+    from Backend.BoardingToken import encode_compact, decode_compact, token_public_key, _FIELDS, _mac_v1
+    from Backend.CheckQR import _parse_legacy_token
+    from Backend.CreateUserQR import _b64url, _sign
+    from Crypto.Signature import eddsa
+    import base64
+    import json
+    import qrcode
+
+    secret = "bench-secret"
+    rid, uid, exp = 12345, 678, 1767225600
+    start, end = "花蓮轉運站", "花蓮縣政府"
+
+    def legacy_encode():
+        payload = {"rid": rid, "uid": uid, "q": True, "exp": exp, "s": start, "e": end}
+        raw = json.dumps(payload, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+        return f"{_b64url(raw)}.{_sign(raw, secret)}"
+
+    def hb1_encode():
+        body = _FIELDS.pack(rid, uid, exp, 101, 140)
+        return "HB1" + base64.b32encode(body + _mac_v1(body, secret)).decode().rstrip("=")
+
+    def hb2_encode():
+        return encode_compact(rid, uid, exp, 101, 140, secret)
+
+    public_key = eddsa.import_public_key(token_public_key(secret))
+
+    def hb2_device_verify():
+        # 司機端離線驗證：只有名單內的公鑰
+        raw = base64.b32decode(hb2[3:] + "=" * (-len(hb2[3:]) % 8))
+        eddsa.new(public_key, "rfc8032").verify(b"HB2" + raw[:_FIELDS.size], raw[_FIELDS.size:])
+
+    legacy, hb1, hb2 = legacy_encode(), hb1_encode(), hb2_encode()
+    assert _parse_legacy_token(legacy, secret)[0]["rid"] == rid
+    assert decode_compact(hb1, secret)["rid"] == decode_compact(hb2, secret)["rid"] == rid
+    hb2_device_verify()
+
+    print("[token] 乘車 token（QR 容錯等級 M）")
+    for name, token in (("舊格式", legacy), ("HB1", hb1), ("HB2", hb2)):
+        qr = qrcode.QRCode(error_correction=qrcode.constants.ERROR_CORRECT_M)
+        qr.add_data(token)
+        qr.make(fit=True)
+        modules = qr.modules_count
+        print(f"  {name:<10} {len(token):4d} 字元  QR version {qr.version:2d}（{modules}x{modules} 模組）")
+
+    for name, fn, loops in (("編碼 舊格式", legacy_encode, 20000),
+                            ("編碼 HB2（Ed25519 簽章）", hb2_encode, 500),
+                            ("解碼+驗章 舊格式", lambda: _parse_legacy_token(legacy, secret), 20000),
+                            ("解碼+驗章 HB1", lambda: decode_compact(hb1, secret), 20000),
+                            ("解碼+驗章 HB2（伺服器，重新簽章比對）", lambda: decode_compact(hb2, secret), 500),
+                            ("解碼+驗章 HB2（司機端，公鑰驗章）", hb2_device_verify, 200)):
+        _report(name, timeit.timeit(fn, number=loops), loops)
+
+
+BENCHES = {
+    "rows": bench_rows,
+    "nearest": bench_nearest,
+    "ingest": bench_ingest,
+    "nearby": bench_nearby,
+    "mapmatch": bench_mapmatch,
+    "json": bench_json,
+    "token": bench_token,
+}
+
+
+if __name__ == "__main__":
+    names = sys.argv[1:] or list(BENCHES)
+    for name in names:
+        if name not in BENCHES:
+            print(f"未知項目: {name}，可用: {', '.join(BENCHES)}")
+            raise SystemExit(1)
+        BENCHES[name]()
@@ -1,22 +1,6 @@
 from Backend.MySQL import MySQL_Doing
+from Backend.Nearest import StopIndex, normalize_direction
 import pandas as pd
-import math
-
-# --- 計算兩點距離 (Haversine公式) ---
-def haversine(lat1, lon1, lat2, lon2):
-    R = 6371000  # 地球半徑（公尺）
-    phi1, phi2 = math.radians(lat1), math.radians(lat2)
-    dphi = math.radians(lat2 - lat1)
-    dlambda = math.radians(lon2 - lon1)
-    a = math.sin(dphi / 2) ** 2 + math.cos(phi1) * math.cos(phi2) * math.sin(dlambda / 2) ** 2
-    return 2 * R * math.atan2(math.sqrt(a), math.sqrt(1 - a))
-
-# --- 統一方向名稱 ---
-def normalize_direction(x):
-    t = str(x or "").strip()
-    if "返" in t or "回" in t or t == "1":
-        return "返程"
-    return "去程"
 
 # --- 連線 ---
 db = MySQL_Doing()
@@ -40,6 +24,7 @@ if dfA.empty:
 dfA["direction"] = dfA["direction"].map(normalize_direction)
 print("\n📍 站點資料：")
 print(dfA.head())
+stop_index = StopIndex.from_rows(dfA.to_dict(orient="records"))
 
 # 結果儲存
 results = []
@@ -60,21 +45,12 @@ for _, row in dfB.iterrows():
     car_lat = float(dfC.iloc[0]["latitude"])
     car_lon = float(dfC.iloc[0]["longitude"])
 
-    # 找該路線該方向的所有站
-    df_route = dfA.loc[(dfA["route_id"] == route_id) & (dfA["direction"] == direction)].copy()
-    if df_route.empty:
+    # 找出最近站（向量化計算）
+    nearest = stop_index.nearest(route_id, direction, car_lat, car_lon)
+    if nearest is None:
         print(f"⚠️ 找不到 {route_id} {direction} 的站點資料")
         continue
 
-    # 計算距離
-    df_route.loc[:, "distance_m"] = df_route.apply(
-        lambda s: haversine(car_lat, car_lon, float(s["latitude"]), float(s["longitude"])),
-        axis=1
-    )
-
-    # 找出最近站
-    nearest = df_route.loc[df_route["distance_m"].idxmin()]
-
     results.append({
         "license_plate": plate,
         "route_id": route_id,
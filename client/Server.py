@@ -3,24 +3,42 @@
 # ====================================
 from Backend import Define
 from Backend.MySQL import MySQL_Doing
+from Backend.Schema import TableRegistry
+from Backend.Migrations import apply_migrations
+from Backend.Nearest import StopIndex, LazyIndex, normalize_direction
+from Backend.Spatial import NetworkStops
+from Backend.MapMatch import RouteMatcher
+from Backend.Timetable import TimetableStore, parse_minutes, format_minutes, lookup_minute
+from Backend.LiveState import LiveStateStore, RouteResolver, LIVE_CHANNEL
+from Backend.LiveStream import LiveBroadcaster
+from Backend.Cache import TwoTierCache, SnapshotCache
+from Backend.Events import EventBus
+from Backend.Versioning import DatasetVersions, VersionedResponses, not_modified
+from Backend.FastJSON import FastJSONResponse, dumps as fast_dumps
+from Backend.Privacy import PrivacyDocument
+from Backend.AsyncDB import AsyncDB, LoopStallMonitor
 # === 產生乘車 QR 與驗證乘車資格 ===
-from Backend.CreateUserQR import generate_boarding_token, save_qr_png
+from Backend.CreateUserQR import generate_boarding_token, token_exp, QRImageCache
 from Backend.CheckQR import verify_boarding_token
+from Backend.Boarding import EligibilityCache, DispatchWriteBehind
+from Backend.Manifest import ManifestSigner, build_trip_manifest, trip_reservation_ids, apply_checkins
 # ====================================
 # 📦 第三方套件
 # ====================================
-from fastapi import FastAPI, Request, HTTPException, APIRouter, Body
+from fastapi import FastAPI, Request, Response, HTTPException, APIRouter, Body, Depends
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from fastapi.responses import RedirectResponse, FileResponse, StreamingResponse
 from fastapi.staticfiles import StaticFiles
 from starlette.exceptions import HTTPException as StarletteHTTPException
 from Crypto.Cipher import AES
 from Crypto.Util.Padding import pad
 from dotenv import load_dotenv
-from pydantic import BaseModel, Field
+from pydantic import BaseModel, Field, ValidationError
 from io import BytesIO
 import pandas as pd
 import redis
+import redis.asyncio
 import httpx
 import qrcode
 # ====================================
@@ -36,7 +54,6 @@ from urllib.parse import urlparse, quote
 from base64 import b64decode
 from decimal import Decimal
 from typing import List, Tuple, Optional
-from threading import RLock
 import os, json, time, math, base64, requests
 import urllib, hmac, hashlib, secrets, tempfile, smtplib
 
@@ -60,10 +77,9 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# Simple in-process cache to reduce DB load when users toggle directions rapidly
-_ROUTE_STOPS_CACHE: dict[Tuple[int, str], Tuple[float, list]] = {}
+# 路線站點快取時間（L1 行程內 / L2 Redis）
 _ROUTE_STOPS_TTL_SEC = 120  # 2 minutes
-_ROUTE_STOPS_LOCK = RLock()
+_ROUTE_STOPS_REDIS_TTL_SEC = 600
 
 
 # === Redis 初始化 ===
@@ -75,6 +91,121 @@ FRONTEND_DEFAULT_URL = f"{BASE_URL}/profile"
 FRONTEND_DEFAULT_HOST = urlparse(FRONTEND_DEFAULT_URL).hostname if FRONTEND_DEFAULT_URL.startswith(('http://', 'https://')) else None
 r = redis.from_url(REDIS_URL, decode_responses=True)
 
+# === async handler 專用：查詢交給專用執行緒池、Redis 用 asyncio client，不阻塞事件迴圈 ===
+ADB = AsyncDB(MySQL_Doing)
+ar = redis.asyncio.from_url(REDIS_URL, decode_responses=True)
+LoopStall = LoopStallMonitor()
+
+# === 資料表欄位快取（與 my-bus-system 共用 Redis 版本號）===
+Tables = TableRegistry(MySQL_Doing.rows, r)
+
+# === 快取失效通知（my-bus-system 寫入後廣播）===
+Events = EventBus(r)
+
+# === 參考資料版本號：GET 回應帶 ETag，版本沒變就回 304 ===
+REFERENCE_DATASETS = ("routes", "route_stops", "tour", "announcements")
+Versions = DatasetVersions(r)
+Conditional = VersionedResponses(Versions)
+for _ns in REFERENCE_DATASETS:
+    Events.subscribe(_ns, Versions.on_event)
+
+def _bump_dataset(ns):
+    """本服務寫入參考資料後呼叫：版本 +1 並通知各 worker"""
+    try:
+        Events.publish(ns, **Versions.bump(ns))
+    except Exception as e:
+        print(f"[Versioning] 更新 {ns} 版本失敗（回應會在 ETag 過期前沿用舊版）: {e}")
+
+# === 路線站點兩層快取：切換方向時不必每次打 DB ===
+RouteStopsCache = TwoTierCache("route_stops", r, ttl=_ROUTE_STOPS_TTL_SEC, redis_ttl=_ROUTE_STOPS_REDIS_TTL_SEC)
+Events.subscribe("route_stops", RouteStopsCache.on_event)
+
+# === 最近站點索引、路線折線（站點異動時重建）===
+def _load_stop_rows():
+    return MySQL_Doing.rows("""
+        SELECT route_id, direction, latitude, longitude, stop_name, stop_order
+        FROM bus_route_stations
+    """)
+
+StopIndexHolder = LazyIndex(lambda: StopIndex.from_rows(_load_stop_rows()))
+Events.subscribe("route_stops", StopIndexHolder.invalidate)
+RouteMatcherHolder = LazyIndex(lambda: RouteMatcher.from_rows(_load_stop_rows()))
+Events.subscribe("route_stops", RouteMatcherHolder.invalidate)
+
+# === 編譯後的時刻表（站 × 班次分鐘矩陣），站點或時刻異動時該路線重新編譯 ===
+def _load_schedule_rows(route_id):
+    """每站的班次時刻來自 bus_stop_times；該站在表中沒有資料時保留 schedule 字串給 Timetable 解析"""
+    stations = {}
+    for row in MySQL_Doing.rows("""
+        SELECT s.station_id, s.stop_name, s.schedule, s.direction, COALESCE(s.stop_order, 9999) AS ord,
+               t.departure_min
+        FROM bus_route_stations s
+        LEFT JOIN bus_stop_times t ON t.station_id = s.station_id
+        WHERE s.route_id = %s
+        ORDER BY s.station_id, t.trip_no
+    """, (route_id,)):
+        st = stations.get(row["station_id"])
+        if st is None:
+            st = stations[row["station_id"]] = {
+                "stop_name": row["stop_name"], "schedule": row["schedule"],
+                "direction": row["direction"], "ord": row["ord"], "times": [],
+            }
+        if row["departure_min"] is not None:
+            st["times"].append(int(row["departure_min"]))
+    return list(stations.values())
+
+Timetables = TimetableStore(_load_schedule_rows)
+Events.subscribe("route_stops", Timetables.on_event)
+
+# === 全路網附近站點索引（公車站 + 行動遊花蓮），站點異動時只重建該路線 ===
+def _load_route_points(route_id=None):
+    sql = """
+        SELECT station_id, route_id, route_name, direction, stop_name, stop_order, address, latitude, longitude
+        FROM bus_route_stations
+    """
+    params = None
+    if route_id is not None:
+        sql += " WHERE route_id = %s"
+        params = (route_id,)
+    return [
+        {
+            "kind": "bus_stop", "name": row["stop_name"], "address": row.get("address"),
+            "route_id": row["route_id"], "route_name": row.get("route_name"),
+            "direction": row.get("direction"), "stop_order": row.get("stop_order"),
+            "station_id": row.get("station_id"), "lat": row.get("latitude"), "lon": row.get("longitude"),
+        }
+        for row in MySQL_Doing.rows(sql, params)
+    ]
+
+def _load_tour_points():
+    return [
+        {"kind": "tour", "name": row["station_name"], "address": row.get("address"),
+         "lat": row.get("latitude"), "lon": row.get("longitude")}
+        for row in MySQL_Doing.rows("SELECT station_name, address, latitude, longitude FROM action_tour_hualien")
+    ]
+
+NearbyStops = NetworkStops(_load_route_points, _load_tour_points)
+Events.subscribe("route_stops", NearbyStops.on_event)
+Events.subscribe("tour", NearbyStops.on_event)
+
+# === 上車驗證：當日合格訂位放記憶體，dispatch_status 批次寫回 ===
+Eligibility = EligibilityCache(MySQL_Doing)
+Events.subscribe("reservation", Eligibility.on_event)
+DispatchQueue = DispatchWriteBehind(MySQL_Doing)
+
+# === 車輛即時狀態：定位寫入時同步更新，各 worker 透過 Redis 同步 ===
+Resolver = RouteResolver(MySQL_Doing)
+
+def _nearest_stop_name(route, direction, lat, lon):
+    hit = StopIndexHolder.get().nearest(route, direction, lat, lon)
+    return hit["stop_name"] if hit else None
+
+LiveStore = LiveStateStore(r, Resolver, stop_namer=_nearest_stop_name)
+LiveEvents = EventBus(r, channel=LIVE_CHANNEL)
+LiveEvents.subscribe("vehicle", LiveStore.on_event)
+LiveStream = LiveBroadcaster(LiveStore)
+LiveStore.add_listener(LiveStream.on_state)  # 本 worker 與其他 worker 的更新都會推給前端
+
 # === LINE 相關設定 ===
 CHANNEL_ID = os.getenv("LINE_CHANNEL_ID")
 CHANNEL_SECRET = os.getenv("LINE_CHANNEL_SECRET")
@@ -266,22 +397,6 @@ class CreatePaymentIn(BaseModel):
 class CreatePaymentOut(BaseModel):
     pay_url: str
 
-# --- 計算兩點距離 (Haversine公式) ---
-def haversine(lat1, lon1, lat2, lon2):
-    R = 6371000  # 地球半徑（公尺）
-    phi1, phi2 = math.radians(lat1), math.radians(lat2)
-    dphi = math.radians(lat2 - lat1)
-    dlambda = math.radians(lon2 - lon1)
-    a = math.sin(dphi / 2) ** 2 + math.cos(phi1) * math.cos(phi2) * math.sin(dlambda / 2) ** 2
-    return 2 * R * math.atan2(math.sqrt(a), math.sqrt(1 - a))
-
-# --- 統一方向 ---
-def normalize_direction(x):
-    t = str(x or "").strip()
-    if "返" in t or "回" in t or t == "1":
-        return "回程"
-    return "去程"
-
 # ========== 全域設定 ==========
 TZ_NAME = os.getenv("TZ", "Asia/Taipei")
 MAIL_SEND_HOUR = int(os.getenv("MAIL_SEND_HOUR", "8"))
@@ -388,9 +503,37 @@ def start_scheduler():
 @app.on_event("startup")
 def on_startup():
     start_scheduler()
+    Events.start()
+    print(f"[LiveState] 從 Redis 載入 {LiveStore.warm()} 台車")
+    LiveEvents.start()
+    LiveStream.attach()
+    GisSnapshot.start()
+    DispatchQueue.start()
+    try:
+        MySQL_Doing.warmup()
+        print(f"[MySQL] pool ready: {MySQL_Doing.stats()}")
+        if apply_migrations(MySQL_Doing):
+            Tables.bump_version()
+        else:
+            Tables.refresh()
+        if Eligibility.warm():
+            print(f"[Boarding] 當日合格訂位 {Eligibility.stats()['reservations']} 筆")
+    except Exception as e:
+        print(f"[MySQL] pool warmup failed: {e}")
+
+@app.on_event("startup")
+async def on_startup_async():
+    LoopStall.start()
+    await Privacy.start()
 
 @app.on_event("shutdown")
 def on_shutdown():
+    Privacy.stop()
+    LoopStall.stop()
+    ADB.shutdown()
+    LiveStream.close_all()
+    GisSnapshot.stop()
+    DispatchQueue.stop()
     sched = getattr(app.state, "scheduler", None)
     if sched:
         sched.shutdown()
@@ -402,116 +545,79 @@ def healthz():
     """用於監控或負載平衡器的健康檢查端點"""
     return {"status": "error 404"}
 
-@api.get("/All_Route", tags=["Client"], summary="所有路線")
-def All_Route():
-    rows = MySQL_Doing.run("SELECT * FROM bus_routes_total")
-
-    df_cols = MySQL_Doing.run("SHOW COLUMNS FROM bus_routes_total")
-    columns = df_cols["Field"].tolist()
+@app.get("/healthz/db_pool", tags=["meta"], summary="資料庫連線池狀態")
+def db_pool_stats():
+    """回傳連線池使用量（in-use / idle / waiters / checkout 延遲），用來調整每個 worker 的池大小"""
+    return MySQL_Doing.stats()
 
-    df = pd.DataFrame(rows, columns=columns)
+@app.get("/healthz/cache", tags=["meta"], summary="快取命中統計")
+def cache_stats():
+    return {"route_stops": RouteStopsCache.stats(), "gis_all": GisSnapshot.stats(), "live": LiveStore.stats(),
+            "nearby_stops": NearbyStops.stats(), "timetables": Timetables.stats(), "live_stream": LiveStream.stats(),
+            "versions": Versions.stats(), "conditional": Conditional.stats(), "privacy": Privacy.stats(),
+            "boarding_qr": BoardingQRImages.stats(), "eligibility": Eligibility.stats(),
+            "dispatch_queue": DispatchQueue.stats()}
 
-    if "created_at" in df.columns:
-        df["created_at"] = pd.to_datetime(df["created_at"], errors="coerce") \
-            .apply(lambda x: x.to_pydatetime() if pd.notnull(x) else None)
+@app.get("/healthz/loop", tags=["meta"], summary="事件迴圈與 async 查詢狀態")
+def loop_stats():
+    """LOOP_STALL_MS > 0 時會記錄事件迴圈被阻塞的次數與最長時間"""
+    return {"async_db": ADB.stats(), "loop_stall": LoopStall.stats()}
 
-    records = df.where(pd.notnull(df), None).to_dict(orient="records")
-    return records
+@api.get("/All_Route", tags=["Client"], summary="所有路線")
+def All_Route(request: Request):
+    def load():
+        cols = Tables.select_list("bus_routes_total")
+        return MySQL_Doing.rows(f"SELECT {cols} FROM bus_routes_total")
+    return Conditional.respond(request, "routes", (), load)
+
+# Route_Stations 輸出欄位，以及 DB 欄位名稱不同時的對應
+STATION_OUT_COLS = [
+    "station_id", "route_id", "route_name", "direction", "stop_name",
+    "latitude", "longitude", "eta_from_start", "stop_order",
+    "schedule", "address", "status", "created_at",
+]
+STATION_COL_ALIASES = {
+    "stop_name": ["station_name"],
+    "eta_from_start": ["est_time"],
+    "stop_order": ["order_no", "seq"],
+}
 
 @api.post("/Route_Stations",
     response_model=List[Define.StationOut],
     tags=["Client"],
     summary="所有站點"
 )
-def get_route_stations(q: Define.RouteStationsQuery):
-    # === 建立查詢語句 ===
-    sql = "SELECT * FROM bus_route_stations WHERE route_id = %s"
-    params = [q.route_id]
-    if q.direction:
-        sql += " AND direction = %s"
-        params.append(q.direction)
-
-    # === 嘗試查詢資料 ===
-    try:
-        rows = MySQL_Doing.run(sql, params)
-    except TypeError:
-        # 某些自定義封裝不支援 %s 語法時 fallback
-        if q.direction:
-            rows = MySQL_Doing.run(
-                f"SELECT * FROM bus_route_stations "
-                f"WHERE route_id = {int(q.route_id)} AND direction = '{q.direction}'"
-            )
-        else:
-            rows = MySQL_Doing.run(
-                f"SELECT * FROM bus_route_stations WHERE route_id = {int(q.route_id)}"
-            )
-
-    # === 取出欄位結構 ===
-    df_cols = MySQL_Doing.run("SHOW COLUMNS FROM bus_route_stations")
-    if isinstance(df_cols, pd.DataFrame):
-        columns = df_cols["Field"].tolist()
-    elif isinstance(df_cols, list) and len(df_cols) > 0:
-        if isinstance(df_cols[0], dict):
-            columns = [c["Field"] for c in df_cols]
-        else:
-            columns = [c[0] for c in df_cols]
-    else:
-        columns = []
-
-    # === 組成 DataFrame ===
-    df = pd.DataFrame(rows, columns=columns)
-    if df.empty:
-        return []
-
-    # === 欄位對應與格式轉換 ===
-    col_map = {
-        "station_name": "stop_name",
-        "stop_name": "stop_name",
-        "est_time": "eta_from_start",
-        "eta_from_start": "eta_from_start",
-        "order_no": "stop_order",
-        "seq": "stop_order",
-        "schedule": "schedule",
-    }
-    df = df.rename(columns={k: v for k, v in col_map.items() if k in df.columns})
-
-    # 數值轉換
-    for col in ["latitude", "longitude", "eta_from_start", "stop_order"]:
-        if col in df.columns:
-            df[col] = pd.to_numeric(df[col], errors="coerce")
-
-    # 時間轉換
-    if "created_at" in df.columns:
-        df["created_at"] = pd.to_datetime(df["created_at"], errors="coerce").apply(
-            lambda x: x.to_pydatetime() if pd.notnull(x) else None
-        )
-
-    # === 保留需要的欄位 ===
-    desired_cols = [
-        "station_id",
-        "route_id",
-        "route_name",
-        "direction",
-        "stop_name",
-        "latitude",
-        "longitude",
-        "eta_from_start",
-        "stop_order",
-        "schedule",
-        "address",
-        "status",
-        "created_at",
-    ]
-    keep_cols = [c for c in desired_cols if c in df.columns]
-    df = df[keep_cols]
-
-    # === 轉換為 JSON 物件 ===
-    records = df.where(pd.notnull(df), None).to_dict(orient="records")
-    data: List[Define.StationOut] = [Define.StationOut(**r) for r in records]
-    return data
+def get_route_stations(request: Request, q: Define.RouteStationsQuery):
+    # response_model 只用於文件；資料在載入時已驗證，直接送出快取的 bytes
+    return Conditional.respond(request, "route_stops", (q.route_id, q.direction or ""),
+                               lambda: _route_stations(q.route_id, q.direction))
+
+@api.get("/Route_Stations", response_model=List[Define.StationOut], tags=["Client"],
+         summary="所有站點（可快取，支援 If-None-Match）")
+def get_route_stations_cached(request: Request, q: Define.RouteStationsQuery = Depends()):
+    """與 POST 版相同內容；站點版本沒變時回 304"""
+    return Conditional.respond(request, "route_stops", (q.route_id, q.direction or ""),
+                               lambda: _route_stations(q.route_id, q.direction))
+
+def _route_stations(route_id, direction=None):
+    """StationOut 的 JSON dict 列表；每筆只在載入時驗證一次，之後快取的是驗證後的結果"""
+    def load():
+        # === 建立查詢語句（欄位由 Tables 快取決定，不再每次 SHOW COLUMNS）===
+        cols = Tables.select_list("bus_route_stations", STATION_OUT_COLS, STATION_COL_ALIASES)
+        sql = f"SELECT {cols} FROM bus_route_stations WHERE route_id = %s"
+        params = [route_id]
+        if direction:
+            sql += " AND direction = %s"
+            params.append(direction)
+        return [Define.StationOut(**row).model_dump(mode="json") for row in MySQL_Doing.rows(sql, params)]
+
+    # 與 Conditional 的 ETag 用同一個版本字串：漏接廣播時兩邊也不會各自認定不同版本
+    current = Versions.get("route_stops")
+    return RouteStopsCache.get(("stations", route_id, direction or ""), load,
+                               version=current[0] if current else None)
 
 @api.get("/Route_ScheduleTime", tags=["Client"], summary="取得路線時刻表（僅以頭尾站決定當前班次）")
-def get_route_schedule_time(route_id: int, direction: str = None):
+def get_route_schedule_time(response: Response, route_id: int, direction: str = None, at: Optional[str] = None):
     """
     只用「頭站與尾站」的時刻表決定當前班次索引 k：
       - 若 now <= head[k] 的第一個班次 → k 即為該索引
@@ -519,239 +625,324 @@ def get_route_schedule_time(route_id: int, direction: str = None):
       - 若超過最後一個 tail → k = 最後一班
     接著每一站都取自己 full_schedule 的第 k 筆（若沒有第 k 筆就取最後一筆）。
     這樣所有站的時間屬於同一輪，不會倒退。
-    """
-    # 讀站點與時刻
-    sql = f"""
-    SELECT stop_name, schedule, 
-            COALESCE(stop_order, 9999) AS ord
-    FROM bus_route_stations
-    WHERE route_id = {route_id} {f"AND direction='{direction}'" if direction else ""}
-    """
 
-    rows = MySQL_Doing.run(sql)
-    df = pd.DataFrame(rows)
-    if df.empty:
-        return {"status": "success", "route_id": route_id, "direction": direction, "data": []}
-
-    # 依序排序（頭→尾）
-    df = df.sort_values("ord").reset_index(drop=True)
-
-    # 工具：把 "HH:MM,..." 轉成 time 物件陣列
-    def parse_times(s: str):
-        out = []
-        if not s:
-            return out
-        for t in str(s).split(","):
-            t = t.strip()
-            try:
-                out.append(datetime.strptime(t, "%H:%M").time())
-            except ValueError:
-                pass
-        return out
-
-    # 頭站、尾站
-    head_name = df.iloc[0]["stop_name"]
-    tail_name = df.iloc[-1]["stop_name"]
-    head_times = parse_times(df.iloc[0]["schedule"])
-    tail_times = parse_times(df.iloc[-1]["schedule"])
-
-    # 沒時刻直接回傳
-    if not head_times or not tail_times:
-        data = [{
-            "stop_name": r["stop_name"],
-            "next_time": None,
-            "full_schedule": (r["schedule"] or "").strip()
-        } for _, r in df.iterrows()]
-        return {"status": "success", "route_id": route_id, "direction": direction, "data": data}
-
-    # 若長度不同，對齊為較短的長度（避免索引超界）
-    L = min(len(head_times), len(tail_times))
-    head_times = head_times[:L]
-    tail_times = tail_times[:L]
-
-    now = datetime.now().time()
-
-    # ---- 決定當前班次索引 k（只看頭尾站）----
-    # 規則：
-    # 1) 若 now <= 第一個 head → k=該 head 的索引
-    # 2) 否則找最小 k 使 now <= tail[k]
-    # 3) 否則 k=L-1
-    def locate_cycle_index(now_t):
-        # 先看 head
-        for i, ht in enumerate(head_times):
-            if now_t <= ht:
-                return i
-        # 再看 tail
-        for i, tt in enumerate(tail_times):
-            if now_t <= tt:
-                return i
-        return L - 1
-
-    k = locate_cycle_index(now)
-
-    # ---- 逐站取第 k 筆時刻（若該站不足 k+1 筆，就取最後一筆）----
-    results = []
-    for _, r in df.iterrows():
-        full = (r["schedule"] or "").strip()
-        times = parse_times(full)
-        if not times:
-            results.append({"stop_name": r["stop_name"], "next_time": None, "full_schedule": full})
-            continue
-        idx = min(k, len(times) - 1)
-        results.append({
-            "stop_name": r["stop_name"],
-            "next_time": times[idx].strftime("%H:%M"),
-            "full_schedule": full
-        })
+    時刻表編譯後常駐記憶體（Backend/Timetable.py），每分鐘對應的 k 已預先算好。
+    at=HH:MM 可指定時間（預設現在）；現在時間已過整分幾秒時以下一分鐘查表（見 lookup_minute），
+    同一分鐘內其餘時間的回應相同，可快取到這一分鐘結束。
+    """
+    if at:
+        minutes = parse_minutes(at)
+        if not minutes:
+            raise HTTPException(status_code=400, detail="at 格式須為 HH:MM")
+        minute = key = minutes[0]
+        response.headers["Cache-Control"] = "public, max-age=60"
+    else:
+        now = datetime.now()
+        minute, key = now.hour * 60 + now.minute, lookup_minute(now)
+        # 快取到這一分鐘結束；剛好整分時下一刻答案就變了，不快取
+        response.headers["Cache-Control"] = f"public, max-age={60 - now.second}" if key != minute else "no-cache"
 
+    table = Timetables.get(route_id, direction)
+    k, data = table.answer(key)
     return {
         "status": "success",
         "route_id": route_id,
         "direction": direction,
-        "data": results
+        "at": format_minutes(minute),
+        "trip_index": k,
+        "data": data,
     }
 
+STOP_DEPARTURES_MAX = 50
+
+@api.get("/stop_departures", tags=["Client"], summary="某站之後的班次（bus_stop_times 索引查詢）")
+def stop_departures(stop_name: Optional[str] = None, station_id: Optional[int] = None,
+                    route_id: Optional[int] = None, direction: Optional[str] = None,
+                    after: Optional[str] = None, limit: int = 10):
+    """
+    例：stop_name=花蓮轉運站&after=14:00 → 14:00 之後經過該站的班次（跨路線，依時間排序）
+    after 預設為現在；可再以 route_id / direction 或 station_id 縮小範圍
+    """
+    if not stop_name and station_id is None:
+        raise HTTPException(status_code=400, detail="需提供 stop_name 或 station_id")
+    if after:
+        minutes = parse_minutes(after)
+        if not minutes:
+            raise HTTPException(status_code=400, detail="after 格式須為 HH:MM")
+        after_min = minutes[0]
+    else:
+        now = datetime.now()
+        after_min = now.hour * 60 + now.minute
+    limit = max(1, min(int(limit), STOP_DEPARTURES_MAX))
+
+    where = ["t.departure_min >= %s"]
+    params = [after_min]
+    if station_id is not None:
+        where.append("s.station_id = %s")
+        params.append(station_id)
+    if stop_name:
+        where.append("s.stop_name = %s")
+        params.append(stop_name)
+    if route_id is not None:
+        where.append("s.route_id = %s")
+        params.append(route_id)
+    if direction:
+        where.append("s.direction = %s")
+        params.append(direction)
+    params.append(limit)
+
+    rows = MySQL_Doing.rows(f"""
+        SELECT s.station_id, s.route_id, s.route_name, s.direction, s.stop_order, s.stop_name,
+               t.trip_no, t.departure_min
+        FROM bus_route_stations s
+        JOIN bus_stop_times t ON t.station_id = s.station_id
+        WHERE {" AND ".join(where)}
+        ORDER BY t.departure_min, s.route_id, s.direction
+        LIMIT %s
+    """, params)
+    for row in rows:
+        row["departure"] = format_minutes(int(row["departure_min"]))
+    return {"status": "success", "after": format_minutes(after_min), "data": rows}
+
 @api.get("/yo_hualien", tags=["Client"], summary="行動遊花蓮")
-def yo_hualien():
-    rows = MySQL_Doing.run("SELECT station_name, address, latitude, longitude FROM action_tour_hualien")
-    columns = ["station_name", "address", "latitude", "longitude"]
-    df = pd.DataFrame(rows, columns=columns)
-    return df.to_dict(orient="records") 
+def yo_hualien(request: Request):
+    def load():
+        rows = MySQL_Doing.run("SELECT station_name, address, latitude, longitude FROM action_tour_hualien")
+        columns = ["station_name", "address", "latitude", "longitude"]
+        df = pd.DataFrame(rows, columns=columns)
+        return df.to_dict(orient="records")
+    return Conditional.respond(request, "tour", (), load)
+
+NEARBY_MAX_RADIUS_M = 5000
+NEARBY_MAX_K = 50
+
+@api.get("/nearby_stops", tags=["Client"], summary="附近站點（全路網＋行動遊花蓮）")
+def nearby_stops(lat: float, lon: float, radius: Optional[float] = None, k: int = 10, kind: Optional[str] = None):
+    """
+    radius（公尺）有給：回傳半徑內的站點，最多 k 個；
+    沒給：回傳最近的 k 個（搜尋範圍上限 NEARBY_MAX_RADIUS_M）。
+    kind 可為 bus_stop / tour，不給則兩者都有。
+    """
+    if not (-90 <= lat <= 90 and -180 <= lon <= 180):
+        raise HTTPException(status_code=400, detail="lat / lon 超出範圍")
+    if kind not in (None, "", "bus_stop", "tour"):
+        raise HTTPException(status_code=400, detail="kind 只能是 bus_stop 或 tour")
+    k = max(1, min(int(k), NEARBY_MAX_K))
+    kinds = {kind} if kind else None
+
+    try:
+        index = NearbyStops.get()
+    except Exception as e:
+        raise HTTPException(status_code=503, detail=f"站點索引載入失敗: {e}")
+
+    if radius is not None:
+        if radius <= 0:
+            raise HTTPException(status_code=400, detail="radius 必須大於 0")
+        hits = index.within(lat, lon, min(radius, NEARBY_MAX_RADIUS_M), kinds)[:k]
+    else:
+        hits = index.nearest(lat, lon, k, NEARBY_MAX_RADIUS_M, kinds)
+
+    return {
+        "status": "success",
+        "count": len(hits),
+        "data": [dict(rec, distance_m=round(d, 1)) for d, rec in hits],
+    }
+
+GIS_ABOUT_ROUTES = ("1", "2", "3")
 
 @api.get("/GIS_About", tags=["Client"], summary="取得最新車輛資訊")
 def Get_GIS_About():
-    Results = MySQL_Doing.run("""
-    Select route from car_resource
-    where route != 'None'
-    """)
+    # 優先讀即時狀態：每條路線取最新的一台車
+    latest_by_route = {}
+    for st in LiveStore.all():
+        route = st.get("route")
+        if route in GIS_ABOUT_ROUTES and (route not in latest_by_route or st["gps_ts"] > latest_by_route[route]["gps_ts"]):
+            latest_by_route[route] = st
+    rows = [
+        {"route": st["route"], "X": st["lon"], "Y": st["lat"], "direction": st.get("direction"), "Current_Loaction": st.get("current_stop")}
+        for st in latest_by_route.values()
+    ]
 
-    print(Results["route"].tolist())
-    Results = MySQL_Doing.run("""
-    SELECT c.route, c.X, c.Y, c.direction, c.Current_Loaction
-    FROM car_backup c
-    JOIN (
-        SELECT route, MAX(seq) AS max_seq
-        FROM car_backup
-        WHERE route IN ('1', '2', '3')
-        GROUP BY route
-    ) t ON c.route = t.route AND c.seq = t.max_seq;
-    """)
-    return Results
+    unseen = [route for route in GIS_ABOUT_ROUTES if route not in latest_by_route]
+    if unseen:
+        # 即時狀態還沒有這些路線的車（冷啟動、Redis 也沒有）：只對這些路線查 car_backup
+        placeholders = ", ".join(["%s"] * len(unseen))
+        rows += MySQL_Doing.rows(f"""
+        SELECT c.route, c.X, c.Y, c.direction, c.Current_Loaction
+        FROM car_backup c
+        JOIN (
+            SELECT route, MAX(seq) AS max_seq
+            FROM car_backup
+            WHERE route IN ({placeholders})
+            GROUP BY route
+        ) t ON c.route = t.route AND c.seq = t.max_seq;
+        """, tuple(unseen))
+
+    # 車機沒帶目前站名時，用最近站點補上（X=經度, Y=緯度）
+    missing = [row for row in rows if not row.get("Current_Loaction") and str(row.get("route") or "").isdigit()]
+    if missing:
+        hits = StopIndexHolder.get().nearest_many(
+            [row["route"] for row in missing], [row["direction"] for row in missing],
+            [row["Y"] for row in missing], [row["X"] for row in missing],
+        )
+        for row, hit in zip(missing, hits):
+            if hit:
+                row["Current_Loaction"] = hit["stop_name"]
+    return rows
+
+@api.get("/live/stream", tags=["Client"], summary="即時車輛推播（SSE）")
+async def live_stream(request: Request, routes: Optional[str] = None, since: Optional[int] = None):
+    """
+    text/event-stream：先送 snapshot（或重連時補送漏掉的 delta），之後每收到一筆定位推一筆 delta。
+    routes 為逗號分隔的路線代碼（不帶則全部）；重連時瀏覽器會帶 Last-Event-ID，優先於 since。
+    """
+    last_id = request.headers.get("last-event-id")
+    if last_id:
+        try:
+            since = int(last_id)
+        except ValueError:
+            since = None
+    wanted = {r.strip() for r in routes.split(",") if r.strip()} if routes else None
+
+    client = LiveStream.open(wanted or None, since)
+    if client is None:
+        raise HTTPException(status_code=503, detail="推播連線數已滿，請改用輪詢")
+    return StreamingResponse(
+        LiveStream.stream(client),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+def fetch_latest_fixes(plates):
+    """一次查詢多台車的最新一筆 GPS，回傳 {車牌: {"longitude", "latitude"}}"""
+    plates = sorted({p for p in plates if p and p != "None"})
+    if not plates:
+        return {}
+    placeholders = ", ".join(["%s"] * len(plates))
+    rows = MySQL_Doing.rows(f"""
+        SELECT t.car_licence, t.X AS longitude, t.Y AS latitude
+        FROM ttcarimport t
+        JOIN (
+            SELECT car_licence, MAX(seq) AS max_seq
+            FROM ttcarimport
+            WHERE car_licence IN ({placeholders})
+            GROUP BY car_licence
+        ) m ON t.seq = m.max_seq
+    """, plates)
+    return {row["car_licence"]: row for row in rows}
 
 @api.get("/GIS_AllFast", tags=["Client"], summary="今日正常營運路線即時摘要（30秒快取）")
 def gis_all_fast():
-    print("=== [DEBUG] /GIS_AllFast 開始 ===")
-
-    # 1️⃣ 抓取今日正常營運車輛
-    df_routes = pd.DataFrame(MySQL_Doing.run('''
-        SELECT route_no, direction, license_plate 
-        FROM route_schedule 
-        WHERE operation_status = "正常營運"
-    '''))
+    """回傳背景執行緒最後一次建好（並已序列化）的快照，快照年齡放在 Age / X-Snapshot-Age 標頭"""
+    try:
+        body, age = GisSnapshot.get()
+    except RuntimeError as e:
+        raise HTTPException(status_code=503, detail=str(e))
+    return FastJSONResponse(body, headers={"Age": str(int(age)), "X-Snapshot-Age": f"{age:.1f}"})
+
+_gis_last_anomalies = {}
+
+def build_gis_snapshot():
+    # 1️⃣ 今日正常營運車輛（RouteResolver 每分鐘從 route_schedule 更新一次）
+    df_routes = pd.DataFrame(Resolver.assignments())
     if df_routes.empty:
-        print("[WARN] 無正常營運路線")
         return {}
 
     df_routes["direction"] = df_routes["direction"].map(normalize_direction)
-    print(f"[DEBUG] 讀取 route_schedule 共 {len(df_routes)} 筆")
-
-    # 2️⃣ 讀取所有站點
-    df_stops = pd.DataFrame(MySQL_Doing.run('''
-        SELECT route_id, direction, latitude, longitude, stop_name 
-        FROM bus_route_stations
-    '''))
-    df_stops["direction"] = df_stops["direction"].map(normalize_direction)
-    print(f"[DEBUG] 讀取 bus_route_stations 共 {len(df_stops)} 筆")
 
-    results = []
-
-    # 3️⃣ 每台車找最近站點
-    for _, r in df_routes.iterrows():
+    # 2️⃣ 路線折線（預先轉成 NumPy 線段陣列，站點異動才重建）
+    matcher = RouteMatcherHolder.get()
+
+    # 3️⃣ 最新 GPS 來自即時狀態；冷啟動時沒有狀態的車才一次查 ttcarimport
+    latest_fix = {}
+    missing = []
+    for plate in df_routes["license_plate"].astype(str).unique():
+        st = LiveStore.latest(plate)
+        if st:
+            latest_fix[plate] = {"longitude": st["lon"], "latitude": st["lat"],
+                                 "heading": st.get("heading"), "speed": st.get("speed")}
+        else:
+            missing.append(plate)
+    if missing:
+        latest_fix.update(fetch_latest_fixes(missing))
+
+    # 背景執行緒每次重建都會跑：異常只在最後彙整成一行
+    anomalies = {}
+    vehicles = []
+    seen = set()
+    for r in df_routes.to_dict(orient="records"):
         route_id = int(r["route_no"])
         plate = str(r["license_plate"])
         direction = r["direction"]
 
-        print(f"\n[DEBUG] 處理路線 {route_id}, 車牌 {plate}, 方向 {direction}")
-
-        # --- 抓車機資料 ---
-        sql = f'''
-            SELECT 
-                X AS longitude,
-                Y AS latitude
-            FROM ttcarimport 
-            WHERE car_licence = "{plate}" 
-            ORDER BY seq DESC 
-            LIMIT 1
-        '''
-        df_car = pd.DataFrame(MySQL_Doing.run(sql))
-        print(f"[DEBUG] 車牌 {plate} GPS 筆數: {len(df_car)}")
-
-        if df_car.empty:
-            print(f"[WARN] 車牌 {plate} 無最新位置，略過")
+        # 同一台車排了去程與回程時只算一次，方向交給比對結果決定
+        if (route_id, plate) in seen:
+            continue
+        seen.add((route_id, plate))
+
+        fix = latest_fix.get(plate)
+        if not fix:
+            anomalies.setdefault("無最新位置", []).append(plate)
             continue
 
         # --- 經緯度轉換 + 檢查 ---
         try:
-            car_lat = float(df_car.iloc[0]["latitude"])   # 緯度（應約23.x）
-            car_lon = float(df_car.iloc[0]["longitude"])  # 經度（應約121.x）
-        except Exception as e:
-            print(f"[ERROR] 無法轉換經緯度 ({plate}): {e}")
+            car_lat = float(fix["latitude"])   # 緯度（應約23.x）
+            car_lon = float(fix["longitude"])  # 經度（應約121.x）
+        except Exception:
+            anomalies.setdefault("經緯度無法轉換", []).append(plate)
             continue
 
         # 自動偵測經緯度是否顛倒
         if abs(car_lat) > 90 or abs(car_lon) > 180:
-            print(f"[WARN] 座標顛倒 lat={car_lat}, lon={car_lon} → 交換")
+            anomalies.setdefault("座標顛倒（已交換）", []).append(plate)
             car_lat, car_lon = car_lon, car_lat
 
         # 粗略檢查是否在台灣範圍內
         if not (21.5 <= car_lat <= 25.5 and 119.0 <= car_lon <= 123.0):
-            print(f"[WARN] 座標異常 lat={car_lat}, lon={car_lon}")
-
-        print(f"[DEBUG] 正常化後座標: lat={car_lat}, lon={car_lon}")
+            anomalies.setdefault("座標不在台灣範圍", []).append(plate)
 
-        # --- 尋找相同路線、方向的站 ---
-        df_route_stops = df_stops.loc[
-            (df_stops["route_id"] == route_id) &
-            (df_stops["direction"] == direction)
-        ].copy()
+        vehicles.append((route_id, direction, plate, car_lat, car_lon, fix.get("heading"), fix.get("speed")))
 
-        print(f"[DEBUG] 匹配站點數: {len(df_route_stops)}")
-        if df_route_stops.empty:
-            print(f"[WARN] 路線 {route_id} ({direction}) 無對應站點")
-            continue
+    # 4️⃣ 所有車一次向量化投影到路線折線（去程/回程都比對，依距離與航向選方向）
+    matches = matcher.match_many(
+        [v[0] for v in vehicles], [v[3] for v in vehicles], [v[4] for v in vehicles],
+        headings=[v[5] for v in vehicles], speeds=[v[6] for v in vehicles],
+        directions=[v[1] for v in vehicles],
+    )
 
-        # --- 計算距離 ---
-        try:
-            df_route_stops.loc[:, "distance_m"] = df_route_stops.apply(
-                lambda s: haversine(car_lat, car_lon, float(s["latitude"]), float(s["longitude"])),
-                axis=1
-            )
-        except Exception as e:
-            print(f"[ERROR] 計算距離失敗: {e}")
+    results = []
+    for (route_id, direction, plate, car_lat, car_lon, _, _), hit in zip(vehicles, matches):
+        if hit is None:
+            anomalies.setdefault("路線無對應站點", []).append(f"{plate}@{route_id}{direction}")
             continue
-
-        nearest_idx = df_route_stops["distance_m"].idxmin()
-        nearest = df_route_stops.loc[nearest_idx]
-        print(f"[DEBUG] 最接近站點: {nearest['stop_name']} (距離 {nearest['distance_m']:.2f} 公尺)")
-
-        # --- 輸出 ---
         results.append({
             "route": route_id,
             "X": car_lon,      # 經度
             "Y": car_lat,      # 緯度
-            "direction": direction,
-            "Current_Loaction": nearest["stop_name"]
+            "direction": hit["direction"],
+            "Current_Loaction": hit["current_stop"],
+            "last_stop": hit["last_stop"],
+            "next_stop": hit["next_stop"],
+            "distance_along_m": hit["distance_along_m"],
+            "route_length_m": hit["route_length_m"],
         })
 
-    print(f"\n[DEBUG] 結果共 {len(results)} 筆")
-    for i, r in enumerate(results):
-        print(f"  [{i}] route={r['route']}, dir={r['direction']}, stop={r['Current_Loaction']}")
-
-    print("=== [DEBUG] /GIS_AllFast 結束 ===\n")
+    # 同樣的異常持續存在時不重複輸出，內容改變才印
+    global _gis_last_anomalies
+    if anomalies and anomalies != _gis_last_anomalies:
+        print("[GIS] 車輛資料異常: " + "；".join(f"{k} {', '.join(v)}" for k, v in anomalies.items()))
+    _gis_last_anomalies = anomalies
 
     return pd.DataFrame(results).to_dict()
 
 
+# 今日正常營運路線摘要：每 30 秒由背景執行緒重建一次
+_GIS_ALL_TTL = 30  # seconds
+# 每次重建只序列化一次，請求直接送出 bytes
+GisSnapshot = SnapshotCache("gis_all", lambda: fast_dumps(build_gis_snapshot()), interval=_GIS_ALL_TTL)
+LiveStore.add_listener(lambda state: GisSnapshot.poke())  # 有新定位就提早重建
+
 @api.post("/reservation", tags=["Client"], summary="送出預約")
 def push_reservation(req: Define.ReservationReq):
     sql = f"""
@@ -771,31 +962,16 @@ def push_reservation(req: Define.ReservationReq):
 
 @api.get("/reservations/my", tags=["Client"], summary="預約查詢")
 def show_reservations(user_id: str):
-    sql = f"""
+    sql = """
     SELECT reservation_id, user_id, booking_time, booking_number, 
            booking_start_station_name, booking_end_station_name,
            review_status, payment_status, dispatch_status
     FROM reservation
-    WHERE user_id = '{user_id}'
+    WHERE user_id = %s
       AND (review_status IS NULL OR review_status <> 'canceled')
     ORDER BY booking_time DESC
     """
-    results = MySQL_Doing.run(sql)
-
-    # 如果是 DataFrame，轉成 dict
-    if hasattr(results, "to_dict"):
-        records = results.where(pd.notnull(results), None).to_dict(orient="records")
-    else:
-        # 已經是 list/dict 的情況
-        records = results
-
-    # 確保 numpy.int64 → int
-    for r in records:
-        for k, v in r.items():
-            if isinstance(v, (pd._libs.missing.NAType, type(None))):
-                r[k] = None
-            elif hasattr(v, "item"):  # numpy scalar
-                r[k] = v.item()
+    records = MySQL_Doing.rows(sql, (user_id,))
 
     return {"status": "success", "data": records}
 
@@ -825,92 +1001,140 @@ def Cancled_reservation(req: Define.CancelReq):
     WHERE reservation_id = {req.reservation_id};
     """
     Results = MySQL_Doing.run(sql)
+    Events.publish("reservation", reservation_id=req.reservation_id)
     return {"status": "success", "sql": Results}
 
+# 隱私權政策：啟動時載入（磁碟快取 → 遠端），之後背景非同步更新
+Privacy = PrivacyDocument()
+
 @api.get("/privacy", tags=["Client"], summary="privacy")
-async def get_privacy():
-    gist_url = "https://gist.githubusercontent.com/Cody20179/ef17eeb9e2880a3a677bb5c74232c003/raw/gistfile1.txt"
-    resp = requests.get(gist_url)
-    return {"content": resp.text}
+async def get_privacy(request: Request):
+    if not await Privacy.ensure():
+        raise HTTPException(status_code=503, detail="隱私權政策暫時無法取得")
+    headers = {"ETag": Privacy.etag, "Cache-Control": "public, max-age=300, must-revalidate"}
+    if not_modified(request, Privacy.etag):
+        return Response(status_code=304, headers=headers)
+    return FastJSONResponse(Privacy.body, headers=headers)
+
+# === 車輛定位寫入（單筆與批次共用） ===
+CAR_BACKUP_INSERT_SQL = """
+INSERT INTO car_backup (
+    rcv_dt, car_licence, Gpstime, X, Y, Speed, Deg, acc, route, direction, Current_Loaction
+) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
+"""
+CAR_INSERT_SQL = """
+INSERT INTO ttcarimport (rcv_dt, car_licence, Gpstime, X, Y, Speed, Deg, acc)
+VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
+"""
+CAR_BATCH_MAX = int(os.getenv("CAR_BATCH_MAX", 5000))  # 單次批次上傳筆數上限
 
-@api.post("/car_backup_insert", tags=["Car"], summary="插入車輛備份資料")
-def insert_car_backup(data: Define.CarBackupInsert):
 
-    # 若未提供 rcv_dt，使用伺服器當前時間
-    rcv_dt = data.rcv_dt or datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+def _car_backup_params(data: Define.CarBackupInsert, rcv_dt):
+    return (
+        rcv_dt, data.car_licence, data.Gpstime, data.X, data.Y, data.Speed, data.Deg,
+        None if data.acc is None else int(bool(data.acc)),
+        data.route or None, data.direction or None, data.Current_Loaction or None,
+    )
 
-    acc_value = "b'1'" if data.acc else "b'0'" if data.acc is not None else "NULL"
 
-    sql = f"""
-    INSERT INTO car_backup (
-        rcv_dt, car_licence, Gpstime, X, Y, Speed, Deg, acc, route, direction, Current_Loaction
-    ) VALUES (
-        '{rcv_dt}', '{data.car_licence}', '{data.Gpstime}',
-        {data.X}, {data.Y}, {data.Speed}, {data.Deg},
-        {acc_value},
-        {f"'{data.route}'" if data.route else "NULL"},
-        {f"'{data.direction}'" if data.direction else "NULL"},
-        {f"'{data.Current_Loaction}'" if data.Current_Loaction else "NULL"}
-    );
+def _car_params(data: Define.CarInsertRequest, rcv_dt):
+    return (
+        rcv_dt, data.car_licence, data.Gpstime, data.X, data.Y, data.Speed, data.Deg,
+        1 if str(data.acc) in ["1", "true", "True"] else 0,
+    )
+
+
+def _ingest_car_batch(records, model, sql, to_params):
+    """
+    批次定位（車機斷線後補傳）：逐筆驗證，合格的一次寫入並更新即時狀態。
+    回傳每筆的接受結果，不合格的不影響其他筆。
     """
+    if not isinstance(records, list):
+        raise HTTPException(status_code=422, detail="body 必須是陣列")
+    if len(records) > CAR_BATCH_MAX:
+        raise HTTPException(status_code=413, detail=f"單次最多 {CAR_BATCH_MAX} 筆")
+
+    now = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    results, fixes, params = [], [], []
+    for i, record in enumerate(records):
+        try:
+            data = model.model_validate(record)
+        except ValidationError as e:
+            errors = [{"loc": list(err["loc"]), "msg": err["msg"]} for err in e.errors()]
+            results.append({"index": i, "accepted": False, "errors": errors})
+            continue
+        rcv_dt = data.rcv_dt or now
+        fix = data.model_dump()
+        fix["rcv_dt"] = rcv_dt
+        fixes.append(fix)
+        params.append(to_params(data, rcv_dt))
+        results.append({"index": i, "accepted": True})
 
     try:
-        MySQL_Doing.run(sql)
-        return {"status": "success", "rcv_dt": rcv_dt, "sql": sql}
+        MySQL_Doing.run_many(sql, params)
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
+    # 寫入成功後才更新即時狀態；每台車只廣播最新一筆
+    LiveStore.ingest_many(fixes)
 
+    return {
+        "status": "success",
+        "accepted": len(params),
+        "rejected": len(records) - len(params),
+        "results": results,
+    }
 
-    qr_text = str(data.get("qrcode", "")).strip()
-    if not qr_text:
-        raise HTTPException(status_code=400, detail="Empty QRCode")
-
-    try:
-        # 嘗試解密
-        decrypted = decrypt_aes(qr_text, KEY, IV)
-        obj = json.loads(decrypted)
 
-        rid = obj.get("reservation_id")
-        uid = obj.get("user_id")
-        lid = obj.get("line_id")
+@api.post("/car_backup_insert", tags=["Car"], summary="插入車輛備份資料")
+def insert_car_backup(data: Define.CarBackupInsert):
 
-        if not rid or not uid:
-            raise HTTPException(status_code=400, detail="Missing fields")
+    # 若未提供 rcv_dt，使用伺服器當前時間
+    rcv_dt = data.rcv_dt or datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    fix = data.model_dump()
+    fix["rcv_dt"] = rcv_dt
 
-        return {"status": "success", "data": obj}
+    # 先更新即時狀態（讀取端不再查 car_backup），資料庫只做持久化
+    LiveStore.ingest(fix)
 
+    try:
+        MySQL_Doing.run(CAR_BACKUP_INSERT_SQL, _car_backup_params(data, rcv_dt))
+        return {"status": "success", "rcv_dt": rcv_dt, "sql": CAR_BACKUP_INSERT_SQL}
     except Exception as e:
-        raise HTTPException(status_code=400, detail=f"QRCode decrypt failed: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+@api.post("/car_backup_insert_batch", tags=["Car"], summary="批次插入車輛備份資料")
+def insert_car_backup_batch(records: list = Body(...)):
+    """body 為 CarBackupInsert 陣列；回傳每筆是否接受"""
+    return _ingest_car_batch(records, Define.CarBackupInsert, CAR_BACKUP_INSERT_SQL, _car_backup_params)
 
 @api.post("/car_insert", tags=["Car"], summary="插入車輛即時定位資料")
 def insert_car(data: Define.CarInsertRequest):
     rcv_dt = data.rcv_dt or datetime.now().strftime("%Y-%m-%d %H:%M:%S")
 
-    sql = f"""
-    INSERT INTO ttcarimport (rcv_dt, car_licence, Gpstime, X, Y, Speed, Deg, acc)
-    VALUES (
-        '{rcv_dt}',
-        '{data.car_licence}',
-        '{data.Gpstime}',
-        {data.X},
-        {data.Y},
-        {data.Speed},
-        {data.Deg},
-        {1 if str(data.acc) in ["1", "true", "True"] else 0}
-    );
-    """
+    fix = data.model_dump()
+    fix["rcv_dt"] = rcv_dt
 
-    MySQL_Doing.run(sql)
+    # 先更新即時狀態（GIS_AllFast 直接讀），ttcarimport 只做持久化
+    LiveStore.ingest(fix)
+
+    MySQL_Doing.run(CAR_INSERT_SQL, _car_params(data, rcv_dt))
     
     return {"status": "success", "message": "資料已插入"}
 
+@api.post("/car_insert_batch", tags=["Car"], summary="批次插入車輛即時定位資料")
+def insert_car_batch(records: list = Body(...)):
+    """body 為 CarInsertRequest 陣列（車機斷線後補傳）；回傳每筆是否接受"""
+    return _ingest_car_batch(records, Define.CarInsertRequest, CAR_INSERT_SQL, _car_params)
+
 @api.get("/announcements", tags=["Client"], summary="取得服務公告列表")
-def get_announcements():
-    sql = "SELECT id, title, content, created_at FROM announcements ORDER BY created_at DESC"
-    rows = MySQL_Doing.run(sql)
-    if hasattr(rows, "to_dict"):
-        return {"status": "success", "data": rows.to_dict(orient="records")}
-    return {"status": "success", "data": rows}
+def get_announcements(request: Request):
+    def load():
+        sql = "SELECT id, title, content, created_at FROM announcements ORDER BY created_at DESC"
+        rows = MySQL_Doing.run(sql)
+        if hasattr(rows, "to_dict"):
+            return {"status": "success", "data": rows.to_dict(orient="records")}
+        return {"status": "success", "data": rows}
+    return Conditional.respond(request, "announcements", (), load)
 
 @api.post("/announcements/add", tags=["Admin"], summary="新增服務公告")
 def add_announcement(title: str = Body(...), content: str = Body(...)):
@@ -919,12 +1143,14 @@ def add_announcement(title: str = Body(...), content: str = Body(...)):
     VALUES ('{title}', '{content}');
     """
     MySQL_Doing.run(sql)
+    _bump_dataset("announcements")
     return {"status": "success"}
 
 @api.delete("/announcements/delete/{ann_id}", tags=["Admin"], summary="刪除公告")
 def delete_announcement(ann_id: int):
     sql = f"DELETE FROM announcements WHERE id = {ann_id}"
     MySQL_Doing.run(sql)
+    _bump_dataset("announcements")
     return {"status": "success"}
 
 @api.get("/Generate_QRCode", tags=["Utility"], summary="產生路線站點 QRCode 並下載")
@@ -1015,6 +1241,22 @@ def delete_route_schedule(id: int):
     MySQL_Doing.run(sql)
     return {"status": "success", "message": f"排班 {id} 已刪除"}
 
+# === 使用者資料快取（/me）：profile:{line_id}，只有 miss 時才以 line_id（唯一索引）查 DB ===
+PROFILE_CACHE_TTL = 6 * 3600
+PROFILE_COLUMNS = "user_id, line_id, username, email, phone, last_login, session_token"
+
+def _profile_key(line_id):
+    return f"profile:{line_id}"
+
+def _refresh_profile_cache(user_id):
+    """users 寫入後呼叫：重新讀一次並覆蓋快取（write-through）"""
+    try:
+        row = MySQL_Doing.fetch_one(f"SELECT {PROFILE_COLUMNS} FROM users WHERE user_id = %s", (user_id,))
+        if row and row.get("line_id"):
+            r.setex(_profile_key(row["line_id"]), PROFILE_CACHE_TTL, fast_dumps(row))
+    except Exception as e:
+        print(f"[Profile] 更新快取失敗（{PROFILE_CACHE_TTL} 秒內可能讀到舊資料）: {e}")
+
 # === 使用者更新資訊 ===
 @api.post("/users/update_mail", tags=["Users"], summary="更新使用者Email")
 def update_mail(user_id: int, email: str):
@@ -1025,6 +1267,7 @@ def update_mail(user_id: int, email: str):
     WHERE user_id = {user_id};
     """
     results = MySQL_Doing.run(sql)
+    _refresh_profile_cache(user_id)
     return {"status": "success", "sql": sql, "results": results}
 
 @api.post("/users/update_phone", tags=["Users"], summary="更新使用者Email")
@@ -1036,6 +1279,7 @@ def update_phone(user_id: int, phone: str):
     WHERE user_id = {user_id};
     """
     results = MySQL_Doing.run(sql)
+    _refresh_profile_cache(user_id)
     return {"status": "success", "sql": sql, "results": results}
 
 # === LINE 登入與使用者權限相關API資訊 ===
@@ -1077,12 +1321,12 @@ def logout(request: Request):
 
 @app.get("/auth/line/callback", tags=["Auth"], summary="Line 登入回呼")
 async def callback(request: Request, code: str | None = None, state: str | None = None):
-    data = r.get(f"login_state:{state}")
+    data = await ar.get(f"login_state:{state}")
     if not code or not state or not data:
         raise HTTPException(400, "Invalid state or code")
 
     st = json.loads(data)
-    r.delete(f"login_state:{state}")
+    await ar.delete(f"login_state:{state}")
     verifier = st["verifier"]
     return_to = st.get("return_to")
 
@@ -1094,14 +1338,16 @@ async def callback(request: Request, code: str | None = None, state: str | None
     app_token = SessionManager.make_session_token(uid)
 
     # ===== 3. 存到 Redis (短期快取) =====
-    r.setex(f"user:{uid}", token["expires_in"], json.dumps({
-        "profile": profile,
-        "access_token": token["access_token"],
-        "refresh_token": token["refresh_token"],
-        "exp": int(time.time()) + token["expires_in"],
-        "session_token": app_token
-    }))
-    r.setex(f"session:{app_token}", 7*24*3600, uid)
+    async with ar.pipeline(transaction=False) as pipe:
+        pipe.setex(f"user:{uid}", token["expires_in"], json.dumps({
+            "profile": profile,
+            "access_token": token["access_token"],
+            "refresh_token": token["refresh_token"],
+            "exp": int(time.time()) + token["expires_in"],
+            "session_token": app_token
+        }))
+        pipe.setex(f"session:{app_token}", 7*24*3600, uid)
+        await pipe.execute()
 
     # ===== 4. 寫入 MySQL (長期存放) =====
     LineID = profile["userId"]
@@ -1109,11 +1355,12 @@ async def callback(request: Request, code: str | None = None, state: str | None
     # print(f"[DEBUG] LINE Profile: {profile}")
     # print(f"[DEBUG] LineID={LineID}, UserName={UserName}, AppToken={app_token}")
     try:
-        MySQL_Doing.run(f"""
+        await ADB.run("""
         INSERT INTO users (line_id, username, password, session_token, last_login)
-        VALUES ('{LineID}', '{UserName}', '', '{app_token}', NOW())
-        ON DUPLICATE KEY UPDATE session_token='{app_token}', last_login=NOW();
-        """)
+        VALUES (%s, %s, '', %s, NOW())
+        ON DUPLICATE KEY UPDATE session_token = VALUES(session_token), last_login = NOW();
+        """, (LineID, UserName, app_token))
+        await ar.delete(_profile_key(LineID))  # session_token 已換新，下次 /me 重新載入
     except Exception as e:
         print(f"MySQL insert error: {e}")
 
@@ -1136,23 +1383,31 @@ async def me(request: Request):
     if not app_token:
         return _unauthorized_response(request, "not logged in")
 
-    result = MySQL_Doing.run(f"""
-        SELECT user_id, line_id, username, email, phone, last_login
-        FROM users
-        WHERE session_token = '{app_token}'
-        LIMIT 1;
-    """)
+    # 身分由簽章 token 離線驗證；資料與目前有效的 session_token 來自 profile 快取
+    uid = SessionManager.verify_session_token(app_token)
+    if not uid:
+        return _unauthorized_response(request, "session not found")
 
-    if result.empty:
-        # 防呆：自動清理 Redis 裡壞掉的 session
-        uid = SessionManager.verify_session_token(app_token)
-        if uid:
-            r.delete(f"user:{uid}")
-            r.delete(f"session:{app_token}")
-            # print(f"[CLEANUP] 清掉無效 session: user={uid}")
+    row = None
+    try:
+        raw = await ar.get(_profile_key(uid))
+        row = json.loads(raw) if raw else None
+    except Exception as e:
+        print(f"[Profile] 讀取快取失敗，改查資料庫: {e}")
+    if row is None or row.get("session_token") != app_token:
+        # 快取沒有、或快取中的 session 與 cookie 不同（可能是快取過舊）時以資料庫為準
+        row = await ADB.fetch_one(f"SELECT {PROFILE_COLUMNS} FROM users WHERE line_id = %s LIMIT 1", (uid,))
+        if row:
+            try:
+                await ar.setex(_profile_key(uid), PROFILE_CACHE_TTL, fast_dumps(row))
+            except Exception as e:
+                print(f"[Profile] 寫入快取失敗: {e}")
+
+    if not row or row.get("session_token") != app_token:
+        # 防呆：自動清理 Redis 裡壞掉的 session（已在別處重新登入時保留新的 user 快取）
+        await ar.delete(f"session:{app_token}", *([] if row else [f"user:{uid}"]))
         return _unauthorized_response(request, "session not found")
 
-    row = result.iloc[0].to_dict()
     return {
         "user_id": row["user_id"],
         "line_id": row["line_id"],
@@ -1162,6 +1417,9 @@ async def me(request: Request):
         "last_login": row["last_login"],
     }
 
+# 乘車 QR 圖片：同一個 token 只產生一次，放在記憶體直到 token 過期
+BoardingQRImages = QRImageCache()
+
 @api.get("/boarding_qr/{reservation_id}", tags=["Client"], summary="產生乘車用 QRCode（PNG）")
 def create_boarding_qr(reservation_id: int, download: bool = False):
     """
@@ -1176,25 +1434,12 @@ def create_boarding_qr(reservation_id: int, download: bool = False):
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"產生失敗: {e}")
 
-    import tempfile, os
-    temp_dir = tempfile.mkdtemp(prefix="boarding_")
-    img_path = os.path.join(temp_dir, f"boarding_{reservation_id}.png")
-    save_qr_png(token, img_path)
-
+    png = BoardingQRImages.get(token)
+    headers = {"Cache-Control": f"private, max-age={max(0, token_exp(token) - int(time.time()))}"}
     if download:
         # 讓用戶直接下載
-        return FileResponse(
-            img_path,
-            media_type="image/png",
-            filename=f"boarding_{reservation_id}.png"
-        )
-    else:
-        # 預設直接串流圖片
-        buf = BytesIO()
-        img = qrcode.make(token)
-        img.save(buf, format="PNG")
-        buf.seek(0)
-        return StreamingResponse(buf, media_type="image/png")
+        headers["Content-Disposition"] = f'attachment; filename="boarding_{reservation_id}.png"'
+    return Response(png, media_type="image/png", headers=headers)
 
 
 @api.post("/boarding_qr/verify", tags=["Client"], summary="驗證乘車 QRCode")
@@ -1206,41 +1451,79 @@ def verify_boarding_qr(data: Define.BoardingQRVerifyRequest):
     if not token:
         raise HTTPException(status_code=400, detail="缺少 qrcode")
 
-    result = verify_boarding_token(token)
+    result = verify_boarding_token(token, lookup=Eligibility.lookup)
 
     if not result.get("ok"):
-        print("[DEBUG] verify_boarding_token 驗證失敗:", result)
+        print("[Boarding] 驗證失敗:", result)
         return {"status": "error", "reason": result.get("reason")}
 
-    print("[DEBUG] verify_boarding_token 驗證通過:", result)
+    # 驗證通過：dispatch_status 交給背景批次寫入，不在掃碼當下等資料庫
+    reservation_id = result["reservation_id"]
+    Eligibility.mark_dispatched(reservation_id)
+    DispatchQueue.enqueue(reservation_id)
 
-    # --- 驗證通過後，自動更新 dispatch_status ---
-    try:
-        reservation_id = result.get("reservation_id") or result.get("data", {}).get("reservation_id")
-
-        print(f"[DEBUG] 抓到 reservation_id = {reservation_id}")
-
-        if reservation_id:
-            sql = f"""
-                UPDATE reservation
-                SET dispatch_status = 'assigned', updated_at = NOW()
-                WHERE reservation_id = {int(reservation_id)};
-            """
-            print(f"[DEBUG] 準備執行 SQL:\n{sql.strip()}")
-            MySQL_Doing.run(sql)
-            print("[DEBUG] SQL 執行完成")
-
-            # 驗證是否真的有更新
-            check_sql = f"SELECT dispatch_status FROM reservation WHERE reservation_id = {int(reservation_id)};"
-            df = MySQL_Doing.run(check_sql)
-            print(f"[DEBUG] 更新後查詢結果:\n{df}")
-        else:
-            print("[DEBUG] reservation_id 沒抓到，跳過更新。")
+    return {"status": "success", "data": result}
 
-    except Exception as e:
-        print(f"[ERROR] 更新 dispatch_status 失敗: {e}")
+# === 離線乘客名單：司機端下載後可在無網路路段驗證，回線後批次上傳掃碼紀錄 ===
+Manifests = ManifestSigner()
+driver_auth = HTTPBearer()
 
-    return {"status": "success", "data": result}
+def get_driver_credential(credentials: HTTPAuthorizationCredentials = Depends(driver_auth)):
+    """後台 POST /api/schedules/{id}/driver_credential 發給司機的憑證；Redis 只存 sha256"""
+    try:
+        raw = r.get(f"driver_cred:{hashlib.sha256(credentials.credentials.encode()).hexdigest()}")
+    except redis.RedisError as e:
+        print(f"[Manifest] 讀取司機憑證失敗: {e}")
+        raise HTTPException(status_code=503, detail="暫時無法驗證憑證")
+    if not raw:
+        raise HTTPException(status_code=401, detail="憑證無效或已過期")
+    return json.loads(raw)
+
+def _trip_credential(trip_id: int, credential: dict):
+    if int(credential["trip_id"]) != trip_id:
+        raise HTTPException(status_code=403, detail="憑證不屬於這個班次")
+    return datetime.strptime(credential["service_date"], "%Y-%m-%d").date()
+
+@api.get("/boarding_manifest/public_key", tags=["Driver"], summary="乘客名單驗章公鑰")
+def manifest_public_key(credential: dict = Depends(get_driver_credential)):
+    return Manifests.public_info()
+
+@api.get("/boarding_manifest/{trip_id}", tags=["Driver"], summary="下載班次乘客名單（已簽章）")
+def download_boarding_manifest(trip_id: int, credential: dict = Depends(get_driver_credential)):
+    """
+    依 route_schedule.id 產生該班次的乘客名單（base64url(JSON).簽章）。
+    營運日取自司機憑證，只能下載憑證綁定的班次
+    """
+    day = _trip_credential(trip_id, credential)
+    manifest = build_trip_manifest(MySQL_Doing, trip_id, day)
+    if manifest is None:
+        raise HTTPException(status_code=404, detail="查無班次")
+
+    filename = f"manifest_{trip_id}_{manifest['trip']['date']}.hbm"
+    # 內含乘客訂位資料，不讓中間快取保存
+    headers = {"Cache-Control": "no-store", "Content-Disposition": f'attachment; filename="{filename}"'}
+    return Response(Manifests.sign(manifest), media_type="text/plain", headers=headers)
+
+@api.post("/boarding_manifest/{trip_id}/checkins", tags=["Driver"], summary="上傳離線掃碼紀錄")
+def upload_manifest_checkins(trip_id: int, data: Define.ManifestCheckinUpload,
+                             credential: dict = Depends(get_driver_credential)):
+    """
+    司機端回到有網路時上傳整批掃碼紀錄；dispatch_status 在同一個交易內寫入，
+    不能套用的（不是這個班次、已取消、使用者不符、重複等）列在 conflicts
+    """
+    day = _trip_credential(trip_id, credential)
+    try:
+        allowed = trip_reservation_ids(MySQL_Doing, trip_id, day)
+        report = apply_checkins(MySQL_Doing, [c.model_dump() for c in data.checkins], allowed_ids=allowed)
+    except Exception as e:
+        print(f"[Manifest] 班次 {trip_id} 掃碼紀錄寫入失敗: {e}")
+        raise HTTPException(status_code=500, detail="寫入失敗，請稍後重新上傳")
+
+    for reservation_id in report["applied"]:
+        Eligibility.mark_dispatched(reservation_id)
+    if report["conflicts"]:
+        print(f"[Manifest] 班次 {trip_id} 有 {len(report['conflicts'])} 筆衝突: {report['conflicts']}")
+    return {"status": "success", "trip_id": trip_id, **report}
 # ====================================
 # 🧾 建立付款連結
 # ====================================
@@ -1298,8 +1581,8 @@ async def callback(request: Request):
         data = decrypt_aes(enc_data)
         order_number = data.get("pos_order_number")
         if order_number:
-            sql = f"UPDATE reservation SET payment_status = 'paid' WHERE reservation_id = '{order_number}'"
-            MySQL_Doing.run(sql)
+            await ADB.run("UPDATE reservation SET payment_status = 'paid' WHERE reservation_id = %s", (order_number,))
+            await Events.publish_async(ar, "reservation", reservation_id=order_number)
 
         # return {"status": "ok", "data": data}
     except Exception as e:
@@ -1314,13 +1597,6 @@ def return_page():
 
 # === 前端靜態檔案服務 ===
 
-# ------------------------------
-# 新增：今日正常營運路線的即時摘要（30秒快取）
-# ------------------------------
-_GIS_ALL_CACHE = {"ts": 0.0, "data": None}
-_GIS_ALL_TTL = 30  # seconds
-_GIS_ALL_LOCK = RLock()
-
 app.include_router(api)
 app.mount('/', StaticFiles(directory='dist', html=True), name='client')
 
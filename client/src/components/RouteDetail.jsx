@@ -1,8 +1,8 @@
 ﻿import React, { useEffect, useMemo, useRef, useState } from 'react'
-import { getRouteStops, getCarPositions } from '../services/api'
+import { getRouteStops } from '../services/api'
+import { subscribeLiveVehicles } from '../services/live'
 import { getRouteScheduleTime } from "../services/api"
 import haversine from 'haversine-distance';
-import debounce from 'lodash.debounce'
 import dayjs from "dayjs"
 
 export default function RouteDetail({ route, onClose, highlightStop }) {
@@ -24,38 +24,26 @@ export default function RouteDetail({ route, onClose, highlightStop }) {
     return () => clearInterval(id)
   }, [])
 
-  // 一進頁：等站點與車輛資料都載入完才解除初始載入
+  // 即時車輛位置：SSE 推播（live.js 在不支援或被拒絕時改回輪詢）；第一份資料到了才解除初始載入
   useEffect(() => {
-    let cancelled = false
-
-    async function loadAll() {
-      try {
-        setInitialLoading(true)
-        setLoading(true)
-        setLoadingCars(true)
-        setError(null)
-
-      // 同步抓取站點與車輛
-      const carData = await getCarPositions()
-      if (!cancelled) setCars(carData || [])
-      } catch (err) {
-        if (!cancelled) {
-          console.warn("初始載入失敗:", err)
-          setError("無法載入資料")
-          setStops([])
-        }
-      } finally {
-        if (!cancelled) {
-          setInitialLoading(false)   // ✅ 真正載完才解除
-          setLoading(false)
-          setLoadingCars(false)
-        }
-      }
+    if (!route?.id) {
+      setInitialLoading(false)
+      return
     }
-
-    loadAll()
-    return () => { cancelled = true }
-  }, [route, selectedDir])
+    setInitialLoading(true)
+    setLoadingCars(true)
+    const giveUp = setTimeout(() => setInitialLoading(false), 8000)
+    const unsubscribe = subscribeLiveVehicles([route.id], (data) => {
+      clearTimeout(giveUp)
+      setCars(data)
+      setInitialLoading(false)
+      setLoadingCars(false)
+    })
+    return () => {
+      clearTimeout(giveUp)
+      unsubscribe()
+    }
+  }, [route?.id])
 
   // 抓取站點
   useEffect(() => {
@@ -86,38 +74,6 @@ export default function RouteDetail({ route, onClose, highlightStop }) {
   }, [route, selectedDir])
 
 
-  // 抓取車輛位置
-  useEffect(() => {
-    let cancelled = false
-    const [loadingCars, setLoadingCars] = [setLoading, setLoading] // reuse loading state if you already have it
-
-    // 防止太頻繁呼叫 API（3 秒內多次只會執行一次）
-    const fetchCars = debounce(async () => {
-      try {
-        setLoading(true)
-        const data = await getCarPositions()
-        if (!cancelled) {
-          setCars([...data])
-          setTick((t) => t + 1)
-        }
-      } catch (e) {
-        if (!cancelled) console.warn('載入即時車輛位置失敗', e)
-      } finally {
-        if (!cancelled) setLoading(false)
-      }
-    }, 3000)
-
-    // 初次載入 + 每 15 秒刷新
-    fetchCars()
-    const id = setInterval(fetchCars, 30000)
-
-    return () => {
-      cancelled = true
-      clearInterval(id)
-      fetchCars.cancel()
-    }
-  }, [])
-
   // 靜態站點
   const list = useMemo(() => {
     if (!isStatic) return []
@@ -1,7 +1,7 @@
 import React, { useState, useEffect, useRef } from 'react'
 import MyReservations from '../components/MyReservations'
 import { getRoutes, getRouteStops } from '../services/api'
-import { getCarPositions } from '../services/api'
+import { subscribeLiveVehicles } from '../services/live'
 import { useNavigate } from 'react-router-dom'
 
 export default function HomeView({ onAction, user, onNavigateRoutes }) {
@@ -21,6 +21,7 @@ export default function HomeView({ onAction, user, onNavigateRoutes }) {
   const interactTimer = useRef(null)
   const [countdown, setCountdown] = useState(30)
   const nextRefreshRef = useRef(Date.now() + AUTO_REFRESH_MS)
+  const liveCarsRef = useRef([])
 
   useEffect(() => {
     nextRefreshRef.current = Date.now() + AUTO_REFRESH_MS
@@ -152,22 +153,8 @@ export default function HomeView({ onAction, user, onNavigateRoutes }) {
           if (a !== b) setArrivals(next)
           setLastUpdated(new Date())
           try {
-            const res = await fetch('/api/GIS_AllFast')
-            const json = await res.json()
-
-            let cars = []
-            if (Array.isArray(json.data)) {
-              cars = json.data
-            } else if (json && typeof json === 'object' && json.route) {
-              const keys = Object.keys(json.route || {})
-              cars = keys.map((k) => ({
-                route: json.route[k],
-                X: json.Y?.[k] ?? null, // 這裡反過來取
-                Y: json.X?.[k] ?? null, // 這裡反過來取
-                direction: json.direction?.[k] ?? '',
-                Current_Loaction: json.Current_Loaction?.[k] ?? ''
-              }))
-            }
+            // 車輛位置來自即時推播（見下方 subscribeLiveVehicles），不再每次刷新都打 GIS_AllFast
+            const cars = liveCarsRef.current
 
             const pickCur = routes.slice(0, 3)
             const normDir = (d) => {
@@ -192,10 +179,10 @@ export default function HomeView({ onAction, user, onNavigateRoutes }) {
                 id: r.id,
                 route: r.name,
                 directionLabel: car ? `(${normDir(car.direction) === '返程' ? '返' : '去'})` : '',
-                stop: car?.Current_Loaction || car?.nearest_stop_name || '—',
+                stop: car?.currentLocation || '—',
                 eta: '',
                 status: car && car.X != null && car.Y != null ? '當前所在' : '未發車',
-                key: `${r.id}-${car?.station_id || 'none'}`,
+                key: `${r.id}-${car?.licensePlate || 'none'}`,
               }
             })
             .filter(a => a.stop && a.stop !== '—') // ✅ 新增：只顯示有站點名稱的
@@ -220,6 +207,22 @@ export default function HomeView({ onAction, user, onNavigateRoutes }) {
     return () => { cancelled = true }
   }, [tick]) // eslint-disable-line
 
+  // 首頁前三條路線的即時車輛：SSE 推播更新 liveCarsRef，畫面跟著自動刷新的 tick 重算；
+  // 第一份資料到達時立即重算一次
+  const liveRouteIds = allRoutes.slice(0, 3).map(r => r.id).join(',')
+  useEffect(() => {
+    if (!liveRouteIds) return
+    let first = true
+    const unsubscribe = subscribeLiveVehicles(liveRouteIds.split(','), (cars) => {
+      liveCarsRef.current = cars
+      if (first) {
+        first = false
+        setTick((t) => (t + 1) % 1_000_000)
+      }
+    })
+    return unsubscribe
+  }, [liveRouteIds])
+
   return (
     <main className="container">
       {/* 搜尋區 */}
@@ -1,3 +1,5 @@
+import { getCarPositions } from './api'
+
 const envBase = (import.meta.env && import.meta.env.VITE_API_BASE_URL) || ''
 const BASE = (envBase?.trim?.() || (import.meta.env?.DEV ? '/api' : ''))
 
@@ -31,3 +33,83 @@ export async function getLiveSummaries() {
   __LIVE.inflight = p
   try { return await p } finally { __LIVE.inflight = null }
 }
+
+// === 即時車輛推播（SSE）：/live/stream 先送快照，之後逐筆推送 delta ===
+// 網路中斷時 EventSource 會自己帶 Last-Event-ID 重連；瀏覽器不支援或伺服器拒絕（503 連線數已滿）
+// 才改回輪詢 GIS_AllFast
+const FALLBACK_POLL_MS = 30000
+
+const normDir = (d) => (/返|回|1/.test(String(d ?? '').trim()) ? '回程' : '去程')
+
+// 與 getCarPositions 相同的欄位（X=經度, Y=緯度）
+function toCar(v) {
+  return {
+    route: v.route ?? null,
+    X: v.lon != null ? Number(v.lon) : null,
+    Y: v.lat != null ? Number(v.lat) : null,
+    direction: normDir(v.direction),
+    currentLocation: v.current_stop ?? null,
+    licensePlate: v.plate ?? null,
+  }
+}
+
+/**
+ * 訂閱路線的即時車輛；每次有變動就以完整車輛列表呼叫 onChange(cars)
+ * routes 為路線代碼陣列（空陣列為全部路線），回傳取消訂閱的函式
+ */
+export function subscribeLiveVehicles(routes, onChange) {
+  const wanted = (routes || []).filter(r => r != null && r !== '').map(String)
+  const vehicles = new Map() // plate -> car
+  let source = null
+  let timer = null
+  let closed = false
+
+  const emit = () => {
+    if (closed) return
+    onChange([...vehicles.values()].filter(c => c.route != null && c.X != null && c.Y != null))
+  }
+
+  const poll = async () => {
+    try {
+      const cars = await getCarPositions()
+      if (!closed) onChange(wanted.length ? cars.filter(c => wanted.includes(String(c.route))) : cars)
+    } catch (e) {
+      console.warn('[live] 輪詢車輛位置失敗', e)
+    }
+  }
+
+  const fallback = () => {
+    if (closed || timer) return
+    if (source) { source.close(); source = null }
+    poll()
+    timer = setInterval(poll, FALLBACK_POLL_MS)
+  }
+
+  if (typeof EventSource === 'undefined') {
+    fallback()
+  } else {
+    const qs = wanted.length ? `?routes=${encodeURIComponent(wanted.join(','))}` : ''
+    source = new EventSource(`${BASE}/live/stream${qs}`)
+    source.addEventListener('snapshot', (e) => {
+      const data = JSON.parse(e.data)
+      vehicles.clear()
+      for (const v of data.vehicles || []) vehicles.set(v.plate, toCar(v))
+      emit()
+    })
+    source.addEventListener('delta', (e) => {
+      const v = JSON.parse(e.data)
+      vehicles.set(v.plate, toCar(v))
+      emit()
+    })
+    source.onerror = () => {
+      // CONNECTING：瀏覽器正在重連；CLOSED：伺服器回了錯誤狀態，不會再重連
+      if (source && source.readyState === EventSource.CLOSED) fallback()
+    }
+  }
+
+  return () => {
+    closed = true
+    if (source) source.close()
+    clearInterval(timer)
+  }
+}
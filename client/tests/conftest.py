@@ -0,0 +1,5 @@
+import os
+import sys
+
+# 與 Server.py 相同的匯入方式：from Backend.X import Y
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
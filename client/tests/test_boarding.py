@@ -0,0 +1,69 @@
+"""
+EligibilityCache 重新載入：同時大量掃碼時只查一次資料庫
+"""
+from concurrent.futures import ThreadPoolExecutor
+from threading import Event, Lock
+import time
+
+from Backend.Boarding import EligibilityCache
+
+ROW = {"reservation_id": 5, "user_id": 9, "booking_time": None,
+       "payment_status": "paid", "review_status": "approved", "dispatch_status": None}
+
+
+class _SlowDB:
+    """整天的 SELECT 要 delay 秒；記錄被呼叫幾次"""
+
+    def __init__(self, delay=0.2):
+        self.delay = delay
+        self.loads = 0
+        self.release = Event()
+        self.release.set()
+        self._lock = Lock()
+
+    def rows(self, sql, params=None):
+        with self._lock:
+            self.loads += 1
+        self.release.wait(5)
+        time.sleep(self.delay)
+        return [dict(ROW)]
+
+    def fetch_one(self, sql, params=None):
+        return None
+
+
+def _burst(cache, n=20):
+    with ThreadPoolExecutor(n) as pool:
+        return list(pool.map(lambda _: cache.lookup(5), range(n)))
+
+
+def test_cold_start_loads_once():
+    db = _SlowDB()
+    cache = EligibilityCache(db)
+
+    results = _burst(cache)
+
+    assert db.loads == 1
+    assert all(row["user_id"] == 9 for row in results)
+
+
+def test_expired_reload_runs_in_background():
+    db = _SlowDB()
+    cache = EligibilityCache(db)
+    assert cache.warm()
+
+    db.release.clear()              # 讓背景載入卡住，確認掃碼不必等它
+    cache.on_event({"ns": "reservation"})
+    start = time.monotonic()
+    results = _burst(cache)
+    elapsed = time.monotonic() - start
+
+    assert elapsed < db.delay
+    assert all(row["user_id"] == 9 for row in results)
+
+    db.release.set()
+    deadline = time.monotonic() + 5
+    while cache._reloading and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert db.loads == 2
+    assert cache.stats()["warms"] == 2
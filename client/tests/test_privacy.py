@@ -0,0 +1,186 @@
+"""
+PrivacyDocument 對本機替身伺服器（http.server 跑在執行緒）的測試
+"""
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from threading import Lock, Thread
+import asyncio
+import json
+import os
+import socket
+import time
+
+import pytest
+from starlette.requests import Request
+
+from Backend.Privacy import PrivacyDocument
+from Backend.Versioning import not_modified
+
+POLICY = "隱私權政策 v1"
+UPSTREAM_ETAG = '"gist-v1"'
+
+
+class _Upstream:
+    """模擬 gist：支援 If-None-Match，可設定延遲，記錄收到的請求"""
+
+    def __init__(self, body=POLICY, etag=UPSTREAM_ETAG, delay=0.0):
+        self.body = body
+        self.etag = etag
+        self.delay = delay
+        self.requests = []
+        self._lock = Lock()
+        upstream = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                with upstream._lock:
+                    upstream.requests.append(dict(self.headers))
+                if upstream.delay:
+                    time.sleep(upstream.delay)
+                if self.headers.get("If-None-Match") == upstream.etag:
+                    self.send_response(304)
+                    self.end_headers()
+                    return
+                data = upstream.body.encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; charset=utf-8")
+                self.send_header("Content-Length", str(len(data)))
+                self.send_header("ETag", upstream.etag)
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.url = f"http://127.0.0.1:{self.server.server_port}/privacy.txt"
+        self._thread = Thread(target=self.server.serve_forever, daemon=True)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+def _closed_port_url():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        port = s.getsockname()[1]
+    return f"http://127.0.0.1:{port}/privacy.txt"
+
+
+@pytest.fixture
+def cache_path(tmp_path):
+    return str(tmp_path / "cache" / "privacy.json")
+
+
+def test_first_load_fetches_and_writes_disk(cache_path):
+    with _Upstream() as upstream:
+        doc = PrivacyDocument(url=upstream.url, cache_path=cache_path, timeout=5)
+        assert asyncio.run(doc.ensure()) is True
+
+    assert doc.content == POLICY
+    assert json.loads(doc.body) == {"content": POLICY}
+    assert doc.etag.startswith('"privacy-')
+    assert len(upstream.requests) == 1
+    with open(cache_path, encoding="utf-8") as f:
+        saved = json.load(f)
+    assert saved["content"] == POLICY
+    assert saved["upstream_etag"] == UPSTREAM_ETAG
+
+
+def test_upstream_304_keeps_content(cache_path):
+    with _Upstream() as upstream:
+        doc = PrivacyDocument(url=upstream.url, cache_path=cache_path, timeout=5)
+
+        async def twice():
+            await doc.refresh()
+            etag = doc.etag
+            assert await doc.refresh() is True
+            return etag
+
+        etag = asyncio.run(twice())
+
+    assert upstream.requests[1].get("If-None-Match") == UPSTREAM_ETAG
+    assert doc.stats()["not_modified"] == 1
+    assert doc.stats()["refreshes"] == 1
+    assert doc.content == POLICY
+    assert doc.etag == etag
+
+
+def test_cold_start_from_disk_when_upstream_down(cache_path):
+    with _Upstream() as upstream:
+        asyncio.run(PrivacyDocument(url=upstream.url, cache_path=cache_path, timeout=5).refresh())
+
+    doc = PrivacyDocument(url=_closed_port_url(), cache_path=cache_path, timeout=2)
+
+    async def cold_start():
+        await doc.start()
+        # start() 讀到磁碟就立即可用；背景更新失敗時沿用磁碟內容
+        assert doc.content == POLICY
+        assert await doc.refresh() is False
+        doc.stop()
+
+    asyncio.run(cold_start())
+    assert doc.content == POLICY
+    assert doc.stats()["errors"] >= 1
+    assert doc.stats()["last_error"]
+
+
+def test_concurrent_refreshes_share_one_request(cache_path):
+    with _Upstream(delay=0.3) as upstream:
+        doc = PrivacyDocument(url=upstream.url, cache_path=cache_path, timeout=5)
+
+        async def burst():
+            return await asyncio.gather(*(doc.refresh() for _ in range(10)))
+
+        results = asyncio.run(burst())
+
+    assert results == [True] * 10
+    assert len(upstream.requests) == 1
+    assert doc.stats()["refreshes"] == 1
+    assert doc.content == POLICY
+
+
+@pytest.mark.parametrize("header, expected", [
+    ('"privacy-abc"', True),
+    ('W/"privacy-abc"', True),
+    ('"other", "privacy-abc"', True),
+    ("*", True),
+    ('"privacy-abcdef"', False),
+    ('"x-privacy-abc"', False),
+])
+def test_if_none_match_parsing(header, expected):
+    request = Request({"type": "http", "headers": [(b"if-none-match", header.encode())]})
+    assert not_modified(request, '"privacy-abc"') is expected
+
+
+def test_concurrent_disk_writes_do_not_clobber(cache_path):
+    # 模擬多個 worker 同時寫同一個磁碟快取：每次都是完整的檔案，也不留下暫存檔
+    docs = [PrivacyDocument(url="http://unused", cache_path=cache_path) for _ in range(8)]
+    for i, doc in enumerate(docs):
+        doc.content = POLICY * (i + 1) * 200
+        doc._upstream_etag = f'"v{i}"'
+
+    errors = []
+
+    def save(doc):
+        try:
+            doc._save_disk()
+        except Exception as e:
+            errors.append(e)
+
+    threads = [Thread(target=save, args=(doc,)) for doc in docs for _ in range(5)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    assert errors == []
+
+    with open(cache_path, encoding="utf-8") as f:
+        saved = json.load(f)
+    assert saved["content"] in {doc.content for doc in docs}
+    assert os.listdir(os.path.dirname(cache_path)) == ["privacy.json"]
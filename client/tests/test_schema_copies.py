@@ -0,0 +1,16 @@
+"""
+TableRegistry 在 client 與 my-bus-system 各有一份（各自的 Docker build context），內容必須一致
+"""
+import os
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+CLIENT_COPY = os.path.join(ROOT, "client", "Backend", "Schema.py")
+ADMIN_COPY = os.path.join(ROOT, "my-bus-system", "Schema.py")
+
+
+@pytest.mark.skipif(not os.path.exists(ADMIN_COPY), reason="只有 client 目錄（例如 Docker image 內）")
+def test_schema_copies_identical():
+    with open(CLIENT_COPY, "rb") as a, open(ADMIN_COPY, "rb") as b:
+        assert a.read() == b.read(), "client/Backend/Schema.py 與 my-bus-system/Schema.py 不一致，請兩邊一起修改"
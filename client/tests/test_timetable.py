@@ -0,0 +1,45 @@
+"""
+CompiledTimetable 查表與原本 now.time() <= head[k] 的規則（含秒數）一致
+"""
+from datetime import datetime, time
+
+import pytest
+
+from Backend.Timetable import CompiledTimetable, lookup_minute
+
+ROWS = [
+    {"stop_name": "頭站", "schedule": "08:00,09:00,23:59"},
+    {"stop_name": "中途", "schedule": "08:10,09:10,23:59"},
+    {"stop_name": "尾站", "schedule": "08:30,09:30,23:59"},
+]
+
+
+def _reference(now):
+    """原本 Route_ScheduleTime 的寫法：只看頭尾站，time 物件直接比較"""
+    head = [datetime.strptime(t, "%H:%M").time() for t in ROWS[0]["schedule"].split(",")]
+    tail = [datetime.strptime(t, "%H:%M").time() for t in ROWS[-1]["schedule"].split(",")]
+    for k, t in enumerate(head):
+        if now <= t:
+            return k
+    for k, t in enumerate(tail):
+        if now <= t:
+            return k
+    return len(head) - 1
+
+
+@pytest.mark.parametrize("now", [
+    time(7, 59, 59), time(8, 0), time(8, 0, 0, 1), time(8, 0, 30), time(8, 29, 59),
+    time(8, 30), time(8, 30, 1), time(9, 0), time(9, 0, 1), time(23, 59), time(23, 59, 30),
+])
+def test_lookup_matches_seconds_rule(now):
+    table = CompiledTimetable(ROWS)
+    assert table.trip_index(lookup_minute(now)) == _reference(now)
+
+
+def test_every_second_of_the_day():
+    table = CompiledTimetable(ROWS)
+    for h in range(24):
+        for m in range(60):
+            for s in (0, 1, 59):
+                now = time(h, m, s)
+                assert table.trip_index(lookup_minute(now)) == _reference(now), now
@@ -0,0 +1,72 @@
+"""
+ETag 與兩層快取的版本一致：漏接廣播時，新 ETag 不會配上舊版內容
+"""
+import json
+
+from starlette.requests import Request
+
+from Backend.Cache import TwoTierCache
+from Backend.Versioning import DatasetVersions, VersionedResponses
+
+
+class _FakeRedis:
+    def __init__(self):
+        self.data = {}
+
+    def get(self, key):
+        return self.data.get(key)
+
+    def mget(self, *keys):
+        return [self.data.get(k) for k in keys]
+
+    def set(self, key, value, nx=False):
+        if nx and key in self.data:
+            return None
+        self.data[key] = str(value)
+        return True
+
+    def setex(self, key, ttl, value):
+        self.data[key] = str(value)
+
+
+def _request():
+    return Request({"type": "http", "headers": []})
+
+
+def test_missed_event_does_not_pin_stale_rows():
+    rds = _FakeRedis()
+    rds.data.update({"route_stops:ver": "1", "route_stops:epoch": "e"})
+    versions = DatasetVersions(rds, ttl=0)
+    conditional = VersionedResponses(versions)
+    stops = TwoTierCache("route_stops", rds, ttl=600)
+    db = {"rows": ["舊站"]}
+
+    def respond():
+        def loader():
+            current = versions.get("route_stops")
+            return stops.get(("stations", 1), lambda: list(db["rows"]), version=current[0])
+        return conditional.respond(_request(), "route_stops", (1,), loader)
+
+    first = respond()
+    assert json.loads(first.body) == ["舊站"]
+
+    # admin 端寫入並把版本 +1，但這個 worker 沒收到廣播（兩個快取都沒有 on_event）
+    db["rows"] = ["新站"]
+    rds.data["route_stops:ver"] = "2"
+
+    second = respond()
+    assert second.headers["etag"] != first.headers["etag"]
+    assert json.loads(second.body) == ["新站"]
+
+
+def test_version_change_clears_l1():
+    cache = TwoTierCache("t", None, ttl=600)
+    loads = []
+
+    def loader():
+        loads.append(1)
+        return len(loads)
+
+    assert cache.get(("k",), loader, version="e.1") == 1
+    assert cache.get(("k",), loader, version="e.1") == 1
+    assert cache.get(("k",), loader, version="e.2") == 2
@@ -1,7 +1,11 @@
 import pymysql
 import sqlite3
 import os
+from contextlib import contextmanager
+from contextvars import ContextVar
+from urllib.parse import quote_plus
 from dotenv import load_dotenv
+from sqlalchemy import create_engine
 
 # 載入 .env 檔
 load_dotenv()
@@ -28,25 +32,160 @@ def init(Parameter):
     )
     return mydb
 
+# ============================================================
+# 共用連線池：預設與 app.py 的 SQLAlchemy engine 共用（bind_engine）
+# ============================================================
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", 5))
+DB_POOL_OVERFLOW = int(os.getenv("DB_POOL_OVERFLOW", 10))
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", 1800))
+DB_POOL_TIMEOUT = int(os.getenv("DB_POOL_TIMEOUT", 10))
+
+POOL_OPTIONS = {
+    "pool_size": DB_POOL_SIZE,
+    "max_overflow": DB_POOL_OVERFLOW,
+    "pool_recycle": DB_POOL_RECYCLE,
+    "pool_timeout": DB_POOL_TIMEOUT,
+    "pool_pre_ping": True,
+}
+
+_engine = None
+_current_conn = ContextVar("mysql_current_conn", default=None)
+_after_commit = ContextVar("mysql_after_commit", default=None)
+
+
+def bind_engine(engine):
+    """讓 MySQL_Run 與 ORM 共用同一個 engine 的連線池"""
+    global _engine
+    _engine = engine
+
+
+def get_engine():
+    global _engine
+    if _engine is None:
+        url = (
+            f"mysql+pymysql://{quote_plus(Infor['user'])}:{quote_plus(Infor['password'])}"
+            f"@{Infor['host']}:{Infor['port']}/{Infor['database']}?charset=utf8mb4"
+        )
+        _engine = create_engine(url, **POOL_OPTIONS)
+    return _engine
+
+
+def _execute(conn, query, params=None):
+    """在指定連線上執行，回傳格式與舊版 MySQL_Run 相同"""
+    mycursor = conn.cursor(pymysql.cursors.DictCursor)
+    try:
+        if params:
+            mycursor.execute(query, params)
+        else:
+            mycursor.execute(query)
+
+        if query.strip().lower().startswith(("select", "show", "desc")):
+            return mycursor.fetchall()
+        return {"status": "ok", "lastrowid": mycursor.lastrowid}
+    finally:
+        mycursor.close()
+
+
+@contextmanager
+def transaction():
+    """
+    同一個區塊內的 MySQL_Run 共用一條連線，離開時一次 commit；
+    發生例外則整批 rollback。巢狀使用時併入外層交易。
+    """
+    outer = _current_conn.get()
+    if outer is not None:
+        yield outer
+        return
+
+    conn = get_engine().raw_connection()
+    callbacks = []
+    token = _current_conn.set(conn)
+    cb_token = _after_commit.set(callbacks)
+    try:
+        yield conn
+        conn.commit()
+    except BaseException:
+        conn.rollback()
+        raise
+    finally:
+        _after_commit.reset(cb_token)
+        _current_conn.reset(token)
+        conn.close()  # 歸還連線池
+
+    # commit 成功後才執行（例如通知快取失效）
+    for fn in callbacks:
+        try:
+            fn()
+        except Exception as e:
+            print(f"[MySQL] after_commit 失敗: {e}")
+
+
+def after_commit(fn):
+    """在目前交易 commit 後執行 fn；不在交易內則立即執行"""
+    callbacks = _after_commit.get()
+    if callbacks is not None:
+        callbacks.append(fn)
+        return
+    try:
+        fn()
+    except Exception as e:
+        print(f"[MySQL] after_commit 失敗: {e}")
+
+
 def MySQL_Run(query, params=None, Parameter=Infor):
-    mydb = init(Parameter)
-    mycursor = mydb.cursor()
-    
-    if params:
-        mycursor.execute(query, params)
-    else:
-        mycursor.execute(query)
+    # 指定其他資料庫時維持舊行為：單獨開一條連線
+    if Parameter is not Infor:
+        mydb = init(Parameter)
+        try:
+            result = _execute(mydb, query, params)
+            mydb.commit()
+            return result
+        finally:
+            mydb.close()
+
+    # 在 transaction() 區塊內：沿用同一條連線，由區塊結束時統一 commit
+    conn = _current_conn.get()
+    if conn is not None:
+        return _execute(conn, query, params)
 
-    if query.strip().lower().startswith(("select", "show", "desc")):
-        result = mycursor.fetchall()
-    else:
-        mydb.commit()
-        result = {"status": "ok", "lastrowid": mycursor.lastrowid}
+    conn = get_engine().raw_connection()
+    try:
+        result = _execute(conn, query, params)
+        conn.commit()
+        return result
+    except BaseException:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
 
-    mycursor.close()
-    mydb.close()
+def MySQL_RunMany(query, seq_params):
+    """
+    批次寫入（cursor.executemany）；INSERT ... VALUES (%s, ...) 會由 pymysql 展開成多列 INSERT。
+    在 transaction() 內沿用同一條連線，否則自己 commit
+    """
+    seq_params = list(seq_params)
+    if not seq_params:
+        return {"status": "ok", "rowcount": 0}
 
-    return result
+    conn = _current_conn.get()
+    own = conn is None
+    if own:
+        conn = get_engine().raw_connection()
+    mycursor = conn.cursor()
+    try:
+        count = mycursor.executemany(query, seq_params)
+        if own:
+            conn.commit()
+        return {"status": "ok", "rowcount": count}
+    except BaseException:
+        if own:
+            conn.rollback()
+        raise
+    finally:
+        mycursor.close()
+        if own:
+            conn.close()
 
 def Sqlite_Run(query, db_path=db_path):
     try:
@@ -0,0 +1,363 @@
+"""
+到站時刻表 CSV 匯入（到站時刻.csv 格式）
+
+檔案由多個區塊組成，區塊之間以空白列分隔：
+    市民小巴5,,,,                      ← 路線標題
+    ,,00:11,00:01,...                   ← 各段行駛時間（第 c 欄 = 第 c-1 站到第 c 站）
+    去程,花蓮轉運站,花蓮縣稅務局,...     ← 方向（去程/返程，循環線為 平日班次/假日班次）＋站名
+    1,08:00,08:11,...                   ← 班次
+    2,08:40,08:51,...
+
+流程：parse_timetable_csv → plan_import（比對路線與站點、算出差異，可預覽）→ apply_plan（單一交易批次寫入）
+
+命令列：
+    python TimetableImport.py 到站時刻.csv            只預覽
+    python TimetableImport.py 到站時刻.csv --apply    寫入資料庫並通知 client 清快取
+"""
+from difflib import SequenceMatcher
+import csv
+import io
+import re
+
+LEG_DIRECTIONS = {"去程": "去程", "返程": "回程", "回程": "回程"}
+DAY_TYPES = {"平日班次": "平日", "假日班次": "假日"}
+MATCH_THRESHOLD = 0.6
+
+_TIME_RE = re.compile(r"^\s*(\d{1,2}):(\d{2})\s*$")
+
+
+# === 解析 ===
+def parse_hhmm(value):
+    """'HH:MM' → 午夜起算分鐘；空白或格式錯誤回傳 None"""
+    m = _TIME_RE.match(str(value or ""))
+    if not m:
+        return None
+    hh, mm = int(m.group(1)), int(m.group(2))
+    if hh > 23 or mm > 59:
+        return None
+    return hh * 60 + mm
+
+
+def fmt_minutes(m):
+    return f"{m // 60:02d}:{m % 60:02d}"
+
+
+def clean_stop_name(name):
+    """儲存格內換行（例如 "花蓮縣政府\\n(後門)"）合併成一行"""
+    return re.sub(r"\s*\n\s*", "", str(name or "")).strip()
+
+
+def decode_csv(raw: bytes) -> str:
+    for encoding in ("utf-8-sig", "cp950"):
+        try:
+            return raw.decode(encoding)
+        except UnicodeDecodeError:
+            continue
+    raise UnicodeDecodeError("timetable", raw, 0, 1, "無法以 UTF-8 或 Big5 解碼")
+
+
+def parse_timetable_csv(text):
+    """
+    回傳 (legs, warnings)
+    leg = {"route_label", "leg_label", "direction", "day_type", "line", "offsets", "stops", "trips"}
+    trips 為 [[分鐘或 None, ...]]，長度與 stops 相同
+    """
+    legs, warnings = [], []
+    route_label = None
+    pending_offsets = None
+    leg = None
+
+    for line_no, row in enumerate(csv.reader(io.StringIO(text)), start=1):
+        cells = [c.strip() for c in row]
+        while cells and cells[-1] == "":
+            cells.pop()
+        if not cells:
+            leg = None          # 空白列：區塊結束
+            continue
+
+        head = cells[0]
+        rest = [c for c in cells[1:] if c != ""]
+
+        if head in LEG_DIRECTIONS or head in DAY_TYPES:
+            stops = [clean_stop_name(c) for c in cells[1:]]
+            while stops and not stops[-1]:
+                stops.pop()
+            if route_label is None:
+                warnings.append(f"第 {line_no} 列：方向「{head}」之前沒有路線標題，略過")
+                leg = None
+                continue
+            if not stops:
+                leg = None      # 例如只有「假日班次」標題、沒有站名
+                continue
+            offsets = list(pending_offsets or [])
+            leg = {
+                "route_label": route_label,
+                "leg_label": head,
+                "direction": LEG_DIRECTIONS.get(head, "去程"),
+                "day_type": DAY_TYPES.get(head),
+                "line": line_no,
+                "offsets": offsets,
+                "stops": stops,
+                "trips": [],
+            }
+            legs.append(leg)
+            pending_offsets = None
+            continue
+
+        if head == "" and rest and all(parse_hhmm(c) is not None for c in rest):
+            # 行駛時間列：第 c 欄對應第 c 站（與站名同欄）
+            pending_offsets = [parse_hhmm(c) for c in cells[1:]]
+            continue
+
+        if head.isdigit() and leg is not None:
+            times = [parse_hhmm(c) for c in cells[1:len(leg["stops"]) + 1]]
+            times += [None] * (len(leg["stops"]) - len(times))
+            # 缺的時刻以前一站 + 行駛時間補上
+            for c in range(1, len(times)):
+                if times[c] is None and times[c - 1] is not None and c < len(leg["offsets"]) and leg["offsets"][c] is not None:
+                    times[c] = times[c - 1] + leg["offsets"][c]
+            if all(t is None for t in times):
+                warnings.append(f"第 {line_no} 列：班次 {head} 沒有任何時刻，略過")
+                continue
+            for c in range(1, len(times)):
+                if times[c] is not None and times[c - 1] is not None and times[c] < times[c - 1]:
+                    warnings.append(f"第 {line_no} 列：{leg['route_label']} {leg['leg_label']} 班次 {head} 時刻倒退（{leg['stops'][c]}）")
+                    break
+            leg["trips"].append(times)
+            continue
+
+        if not rest and not head.isdigit():
+            route_label = head.strip()      # 路線標題
+            pending_offsets = None
+            leg = None
+            continue
+
+        warnings.append(f"第 {line_no} 列：無法辨識，略過")
+
+    return legs, warnings
+
+
+# === 比對 ===
+def _norm(name):
+    s = re.sub(r"[\s()（）\-－_·‧]", "", str(name or ""))
+    return s.replace("縣", "").replace("臺", "台")
+
+
+def name_score(a, b):
+    na, nb = _norm(a), _norm(b)
+    if not na or not nb:
+        return 0.0
+    if na == nb:
+        return 1.0
+    if na in nb or nb in na:
+        return 0.6 + 0.3 * min(len(na), len(nb)) / max(len(na), len(nb))
+    return SequenceMatcher(None, na, nb).ratio()
+
+
+def align_stops(csv_stops, db_stops):
+    """
+    依順序比對：每個 CSV 站名只往後找（循環線同名站才不會配錯），取分數最高、同分取最前面。
+    回傳 [(csv_index, db_index 或 None, score)]
+    """
+    result, pos = [], 0
+    for i, name in enumerate(csv_stops):
+        best, best_score = None, 0.0
+        for j in range(pos, len(db_stops)):
+            score = name_score(name, db_stops[j]["stop_name"])
+            if score > best_score:
+                best, best_score = j, score
+        if best is not None and best_score >= MATCH_THRESHOLD:
+            result.append((i, best, round(best_score, 3)))
+            pos = best + 1
+        else:
+            result.append((i, None, round(best_score, 3)))
+    return result
+
+
+def _find_route(label, routes):
+    key = _norm(label)
+    hits = []
+    for r in routes:
+        name = _norm(r["route_name"])
+        # 「市民小巴5」不可配到「市民小巴51」
+        if name == key or (name.startswith(key) and not name[len(key):len(key) + 1].isdigit()):
+            hits.append(r)
+    return hits
+
+
+def _current_times(run, station_ids):
+    """目前各站的時刻（bus_stop_times 優先，沒有則解析 schedule 字串）"""
+    if not station_ids:
+        return {}
+    ph = ", ".join(["%s"] * len(station_ids))
+    current = {sid: [] for sid in station_ids}
+    for row in run(f"""SELECT station_id, departure_min FROM bus_stop_times
+                       WHERE station_id IN ({ph}) ORDER BY station_id, trip_no""", list(station_ids)) or []:
+        current[row["station_id"]].append(int(row["departure_min"]))
+    missing = [sid for sid, times in current.items() if not times]
+    if missing:
+        ph = ", ".join(["%s"] * len(missing))
+        for row in run(f"SELECT station_id, schedule FROM bus_route_stations WHERE station_id IN ({ph})", missing) or []:
+            current[row["station_id"]] = [m for m in (parse_hhmm(t) for t in str(row["schedule"] or "").split(",")) if m is not None]
+    return current
+
+
+def plan_import(legs, run, day_type="平日"):
+    """
+    run 為 MySQL_Run。回傳可直接回給前端預覽的 dict：
+      legs：每段的比對結果；changes：時刻有變動的站；writes：apply_plan 要寫入的資料
+    """
+    routes = run("SELECT route_id, route_name FROM bus_routes_total") or []
+    plan = {"legs": [], "changes": [], "warnings": [], "writes": {}, "route_ids": []}
+
+    station_cache = {}
+    for leg in legs:
+        summary = {
+            "route_label": leg["route_label"], "leg": leg["leg_label"], "direction": leg["direction"],
+            "trips": len(leg["trips"]), "route_id": None, "matched": [], "unmatched_csv": [], "unmatched_db": [],
+        }
+        plan["legs"].append(summary)
+
+        if leg["day_type"] and leg["day_type"] != day_type:
+            summary["skipped"] = f"只匯入{day_type}班次"
+            continue
+
+        hits = _find_route(leg["route_label"], routes)
+        if len(hits) != 1:
+            msg = "找不到對應路線" if not hits else f"對應到多條路線：{', '.join(r['route_name'] for r in hits)}"
+            plan["warnings"].append(f"{leg['route_label']} {leg['leg_label']}：{msg}")
+            summary["skipped"] = msg
+            continue
+        route = hits[0]
+        summary["route_id"] = route["route_id"]
+        summary["route_name"] = route["route_name"]
+
+        key = (route["route_id"], leg["direction"])
+        if key not in station_cache:
+            station_cache[key] = run(
+                """SELECT station_id, stop_name, stop_order FROM bus_route_stations
+                   WHERE route_id = %s AND direction = %s ORDER BY stop_order""",
+                key,
+            ) or []
+        db_stops = station_cache[key]
+
+        used = set()
+        for i, j, score in align_stops(leg["stops"], db_stops):
+            if j is None:
+                summary["unmatched_csv"].append(leg["stops"][i])
+                continue
+            st = db_stops[j]
+            used.add(j)
+            times = [trip[i] for trip in leg["trips"] if trip[i] is not None]
+            if st["station_id"] in plan["writes"]:
+                plan["warnings"].append(f"{route['route_name']} {st['stop_name']} 被多個區塊對應，以後者為準")
+            plan["writes"][st["station_id"]] = times
+            summary["matched"].append({
+                "csv_name": leg["stops"][i], "station_id": st["station_id"],
+                "stop_name": st["stop_name"], "stop_order": st["stop_order"], "score": score,
+            })
+        summary["unmatched_db"] = [s["stop_name"] for j, s in enumerate(db_stops) if j not in used]
+        if route["route_id"] not in plan["route_ids"]:
+            plan["route_ids"].append(route["route_id"])
+
+    current = _current_times(run, list(plan["writes"]))
+    names = {m["station_id"]: m for leg in plan["legs"] for m in leg["matched"]}
+    for sid, times in plan["writes"].items():
+        if current.get(sid) != times:
+            plan["changes"].append({
+                "station_id": sid,
+                "stop_name": names[sid]["stop_name"],
+                "old": ",".join(fmt_minutes(m) for m in current.get(sid, [])),
+                "new": ",".join(fmt_minutes(m) for m in times),
+            })
+    return plan
+
+
+# === 寫入 ===
+def apply_plan(plan, run, run_many):
+    """
+    只寫入有變動的站：清掉舊的 bus_stop_times → 多列 INSERT → 一次 UPDATE 同步 schedule 字串。
+    呼叫端需包在 transaction() 內。
+    """
+    changed = [c["station_id"] for c in plan["changes"]]
+    if not changed:
+        return {"stations": 0, "stop_times": 0}
+
+    ph = ", ".join(["%s"] * len(changed))
+    run(f"DELETE FROM bus_stop_times WHERE station_id IN ({ph})", changed)
+
+    rows = [
+        (sid, trip_no, minute)
+        for sid in changed
+        for trip_no, minute in enumerate(plan["writes"][sid], start=1)
+    ]
+    run_many("INSERT INTO bus_stop_times (station_id, trip_no, departure_min) VALUES (%s, %s, %s)", rows)
+
+    cases, params = [], []
+    for sid in changed:
+        cases.append("WHEN %s THEN %s")
+        params += [sid, ",".join(fmt_minutes(m) for m in plan["writes"][sid]) or None]
+    run(
+        f"UPDATE bus_route_stations SET schedule = CASE station_id {' '.join(cases)} END WHERE station_id IN ({ph})",
+        params + changed,
+    )
+    return {"stations": len(changed), "stop_times": len(rows)}
+
+
+def preview_summary(plan):
+    """給前端與命令列用的精簡結果（不含 writes）"""
+    return {k: v for k, v in plan.items() if k != "writes"}
+
+
+if __name__ == "__main__":
+    import argparse
+    import json
+    import os
+    import secrets
+    import time
+
+    from MySQL import MySQL_Run, MySQL_RunMany, transaction
+
+    parser = argparse.ArgumentParser(description="匯入到站時刻表 CSV")
+    parser.add_argument("csv_path")
+    parser.add_argument("--apply", action="store_true", help="寫入資料庫（預設只預覽）")
+    parser.add_argument("--day-type", default="平日", choices=sorted(set(DAY_TYPES.values())))
+    args = parser.parse_args()
+
+    with open(args.csv_path, "rb") as f:
+        legs, warnings = parse_timetable_csv(decode_csv(f.read()))
+    plan = plan_import(legs, MySQL_Run, day_type=args.day_type)
+    plan["warnings"] = warnings + plan["warnings"]
+
+    for leg in plan["legs"]:
+        status = leg.get("skipped") or f"{len(leg['matched'])} 站對應、{leg['trips']} 班"
+        print(f"[TimetableImport] {leg['route_label']} {leg['leg']} → {leg.get('route_name', '-')}：{status}")
+        if leg["unmatched_csv"]:
+            print(f"    CSV 站名未對應：{', '.join(leg['unmatched_csv'])}")
+        if leg["unmatched_db"]:
+            print(f"    資料庫站點未出現在 CSV：{', '.join(leg['unmatched_db'])}")
+    for w in plan["warnings"]:
+        print(f"[TimetableImport] 警告：{w}")
+    print(f"[TimetableImport] 時刻有變動的站：{len(plan['changes'])}")
+
+    if args.apply:
+        with transaction():
+            result = apply_plan(plan, MySQL_Run, MySQL_RunMany)
+        print(f"[TimetableImport] 已寫入 {result['stations']} 站、{result['stop_times']} 筆時刻")
+        # 通知 client 各 worker 清掉站點/時刻表快取（與 app.py 的 _invalidate_cache 相同格式）
+        try:
+            import redis
+            rds = redis.Redis.from_url(os.getenv("REDIS_URL", "redis://localhost:6379/0"), decode_responses=True)
+            # Redis 清空過時 :ver 會重新計數，:epoch 讓 ETag 不會與清空前的版本相同
+            rds.set("route_stops:epoch", secrets.token_hex(4), nx=True)
+            epoch = rds.get("route_stops:epoch")
+            version = rds.incr("route_stops:ver")
+            mtime = time.time()
+            rds.set("route_stops:mtime", mtime)
+            for route_id in plan["route_ids"]:
+                rds.publish("hbus:invalidate", json.dumps({"ns": "route_stops", "version": version, "epoch": epoch,
+                                                           "mtime": mtime, "route_id": route_id}))
+        except Exception as e:
+            print(f"[TimetableImport] 快取失效通知失敗（client 會在快取過期後更新）: {e}")
+    else:
+        print("[TimetableImport] 預覽模式，加上 --apply 才會寫入")
@@ -1,4 +1,4 @@
-from fastapi import FastAPI, HTTPException, Depends, Query, HTTPException, File, UploadFile
+from fastapi import FastAPI, HTTPException, Depends, Query, HTTPException, File, UploadFile, Request, Response
 from fastapi.responses import FileResponse
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
@@ -9,13 +9,16 @@ from sqlalchemy.orm import sessionmaker, Session
 from pydantic import BaseModel,Field
 from pathlib import Path
 from typing import Optional, Literal, List, Tuple, Dict, Set
-import bcrypt, os
+import bcrypt, os, json, secrets
+from email.utils import formatdate
 from dotenv import load_dotenv
 from collections import defaultdict
 from calendar import monthrange
 from datetime import datetime, timezone, timedelta, date, time
 import pytz
-from MySQL import MySQL_Run
+from MySQL import MySQL_Run, MySQL_RunMany, transaction, after_commit, bind_engine, POOL_OPTIONS
+from Schema import TableRegistry
+import TimetableImport
 import pandas as pd
 import hashlib
 import xml.etree.ElementTree as ET
@@ -171,7 +174,8 @@ DATABASE_URL = os.getenv(
     "DATABASE_URL",
     f"mysql+pymysql://{DB_USER}:{DB_PASSWORD}@{DB_HOST}:{DB_PORT}/{DB_NAME}"
 )
-engine = create_engine(DATABASE_URL, echo=True)
+engine = create_engine(DATABASE_URL, echo=True, **POOL_OPTIONS)
+bind_engine(engine)  # MySQL_Run 與 ORM 共用同一個連線池
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 Base = declarative_base()
 
@@ -250,7 +254,9 @@ class InMemoryRedis:
             return None
         return self._store.get(key, (None, None))[0]
 
-    def set(self, key, value):
+    def set(self, key, value, nx=False):
+        if nx and not self._expired(key):
+            return None
         self._store[key] = (str(value), None)
         return True
 
@@ -482,6 +488,8 @@ def get_role_name(db: Session, role_id: Optional[int]) -> Optional[str]:
     return (role.role_name if role else None)
 
 # Redis 相關輔助函數
+REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379/0")
+
 def get_redis():
     if redis is None:
         # 若無 redis 模組，回退至記憶體版（僅開發用）
@@ -517,6 +525,87 @@ def _otp_keys(purpose: str, acc_hash: str):
 def _ip_key(ip: str) -> str:
     return f"otp:rl:ip:{ip}"
 
+# === client 端快取失效通知 ===
+CACHE_CHANNEL = "hbus:invalidate"
+
+def _dataset_epoch(rds, ns: str) -> str:
+    """
+    {ns}:ver 在 Redis 被清空（或無持久化重啟）後會從 1 重新計數；
+    {ns}:epoch 是跟著存放的隨機值，不存在時重新產生，ETag 帶上它，舊 ETag 就不會對到新內容
+    """
+    epoch = rds.get(f"{ns}:epoch")
+    if not epoch:
+        rds.set(f"{ns}:epoch", secrets.token_hex(4), nx=True)
+        epoch = rds.get(f"{ns}:epoch")
+    return epoch
+
+def _invalidate_cache(ns: str, **payload):
+    """版本號 +1、記下修改時間並廣播，client 各 worker 收到後清掉該 namespace 的快取（ETag 也隨版本改變）"""
+    try:
+        rds = get_redis()
+        epoch = _dataset_epoch(rds, ns)
+        version = rds.incr(f"{ns}:ver")
+        mtime = datetime.now().timestamp()
+        rds.set(f"{ns}:mtime", mtime)
+        if hasattr(rds, "publish"):
+            rds.publish(CACHE_CHANNEL, json.dumps({"ns": ns, "version": version, "epoch": epoch, "mtime": mtime, **payload},
+                                                  ensure_ascii=False))
+    except Exception as e:
+        print(f"[Cache] 廣播 {ns} 失效失敗: {e}")
+
+def _invalidate_route_stations(route_id=None):
+    """bus_route_stations 有寫入時呼叫（交易內會等 commit 後才送出）"""
+    after_commit(lambda: _invalidate_cache("route_stops", route_id=route_id))
+
+def _invalidate_routes():
+    """bus_routes_total 有寫入時呼叫"""
+    after_commit(lambda: _invalidate_cache("routes"))
+
+def _invalidate_reservation(reservation_id):
+    """reservation 付款 / 審核 / 取消狀態有寫入時呼叫，client 的上車資格快取移除該筆"""
+    after_commit(lambda: _invalidate_cache("reservation", reservation_id=reservation_id))
+
+def _invalidate_profile(*line_ids):
+    """users 有修改 / 刪除時呼叫：移除 client /me 的 profile:{line_id} 快取，下次查詢重新讀 DB"""
+    def drop():
+        keys = [f"profile:{line_id}" for line_id in {x for x in line_ids if x}]
+        if not keys:
+            return
+        try:
+            get_redis().delete(*keys)
+        except Exception as e:
+            print(f"[Cache] 移除會員快取失敗: {e}")
+    after_commit(drop)
+
+def _dataset_version(ns: str):
+    """("{epoch}.{version}", mtime)；Redis 不可用時回傳 None"""
+    try:
+        rds = get_redis()
+        epoch = _dataset_epoch(rds, ns)
+        version, mtime = rds.get(f"{ns}:ver"), rds.get(f"{ns}:mtime")
+    except Exception as e:
+        print(f"[Cache] 讀取 {ns} 版本失敗: {e}")
+        return None
+    return f"{epoch}.{version or 0}", float(mtime) if mtime else None
+
+def _conditional(request: Request, response: Response, ns: str):
+    """
+    依資料集版本設定 ETag / Last-Modified；If-None-Match 命中時回傳 304 Response，否則回傳 None
+    （呼叫端照常查詢並回傳資料）
+    """
+    current = _dataset_version(ns)
+    if current is None:
+        return None
+    version, mtime = current
+    headers = {"ETag": f'"{ns}-v{version}"', "Cache-Control": "private, max-age=0, must-revalidate"}
+    if mtime is not None:
+        headers["Last-Modified"] = formatdate(mtime, usegmt=True)
+    inm = request.headers.get("if-none-match")
+    if inm and ("*" in inm or headers["ETag"] in {t.strip().removeprefix("W/") for t in inm.split(",")}):
+        return Response(status_code=304, headers=headers)
+    response.headers.update(headers)
+    return None
+
 # 排班調度數據模型
 class ScheduleCreate(BaseModel):
     route_no: str = Field(..., min_length=1, max_length=20)  # 對應 bus_routes_total.route_id
@@ -544,6 +633,9 @@ class ScheduleUpdate(BaseModel):
 # FastAPI 應用
 app = FastAPI()
 
+# 資料表欄位快取（與 client 共用 Redis 上的 schema 版本號）
+Tables = TableRegistry(MySQL_Run, get_redis)
+
 # 動態 CORS 設定函數
 def is_allowed_origin(origin: str) -> bool:
     """檢查來源是否被允許"""
@@ -1883,33 +1975,16 @@ def root():
     }
 
 @app.get("/All_Route", response_model=List[Route])
-def All_Route():
+def All_Route(request: Request, response: Response):
+    not_modified = _conditional(request, response, "routes")
+    if not_modified is not None:
+        return not_modified
     try:
-        rows = MySQL_Run("SELECT * FROM bus_routes_total")
+        cols = Tables.select_list("bus_routes_total")
+        rows = MySQL_Run(f"SELECT {cols} FROM bus_routes_total")
 
-        # MySQL_Run may return list of dicts (DictCursor) or list of tuples.
-        if not rows:
-            return []
-
-        # If rows are dicts, build DataFrame directly
-        if isinstance(rows, list) and isinstance(rows[0], dict):
-            df = pd.DataFrame(rows)
-        else:
-            # fallback: get columns and construct DataFrame
-            cols = MySQL_Run("SHOW COLUMNS FROM bus_routes_total")
-            try:
-                columns = [c[0] for c in cols]
-            except Exception:
-                # if cols are dicts
-                columns = [c.get('Field') or list(c.values())[0] for c in cols]
-            df = pd.DataFrame(rows, columns=columns)
-
-        if "created_at" in df.columns:
-            df["created_at"] = pd.to_datetime(df["created_at"], errors="coerce") \
-                .apply(lambda x: x.to_pydatetime() if pd.notnull(x) else None)
-
-        records = df.where(pd.notnull(df), None).to_dict(orient="records")
-        return records
+        # MySQL_Run 使用 DictCursor，欄位名稱已在 row 裡，直接回傳
+        return rows or []
     except Exception as e:
         print(f"All_Route error: {e}")
         raise HTTPException(status_code=500, detail=str(e))
@@ -1961,6 +2036,7 @@ def create_route(route: RouteCreate, current_user: AdminUser = Depends(get_curre
 
         sql = f"INSERT INTO bus_routes_total ({', '.join(cols)}) VALUES ({', '.join(placeholders)})"
         insert_res = MySQL_Run(sql, tuple(params))
+        _invalidate_routes()
 
         # MySQL_Run 對非 SELECT 會回傳 dict {status, lastrowid}
         new_route_id = None
@@ -2050,6 +2126,7 @@ def update_route(route: RouteUpdate, current_user: AdminUser = Depends(get_curre
         params.append(route.route_id)
         sql = f"UPDATE bus_routes_total SET {', '.join(updates)} WHERE route_id = %s"
         MySQL_Run(sql, tuple(params))
+        _invalidate_routes()
 
         return {"message": "路線更新成功", "ok": True}
     except HTTPException:
@@ -2088,17 +2165,21 @@ def delete_route(req: RouteDelete, current_user: AdminUser = Depends(get_current
         if not exists:
             raise HTTPException(status_code=404, detail="找不到指定的路線")
 
-        # 刪除該路線的站點（若有）
-        try:
-            MySQL_Run("DELETE FROM bus_route_stations WHERE route_id = %s", (rid,))
-        except TypeError:
-            MySQL_Run(f"DELETE FROM bus_route_stations WHERE route_id = {rid}")
+        # 站點與路線一起刪除，避免只刪一半
+        with transaction():
+            _invalidate_route_stations(rid)
+            _invalidate_routes()
+            # 刪除該路線的站點（若有）
+            try:
+                MySQL_Run("DELETE FROM bus_route_stations WHERE route_id = %s", (rid,))
+            except TypeError:
+                MySQL_Run(f"DELETE FROM bus_route_stations WHERE route_id = {rid}")
 
-        # 刪除 bus_routes_total 中的路線紀錄（若有）
-        try:
-            MySQL_Run("DELETE FROM bus_routes_total WHERE route_id = %s", (rid,))
-        except TypeError:
-            MySQL_Run(f"DELETE FROM bus_routes_total WHERE route_id = {rid}")
+            # 刪除 bus_routes_total 中的路線紀錄（若有）
+            try:
+                MySQL_Run("DELETE FROM bus_routes_total WHERE route_id = %s", (rid,))
+            except TypeError:
+                MySQL_Run(f"DELETE FROM bus_routes_total WHERE route_id = {rid}")
 
         return {"message": "路線刪除成功", "ok": True}
     except HTTPException:
@@ -2107,79 +2188,31 @@ def delete_route(req: RouteDelete, current_user: AdminUser = Depends(get_current
         print(f"刪除路線失敗: {e}")
         raise HTTPException(status_code=500, detail=f"刪除路線失敗: {str(e)}")
 
+# Route_Stations 輸出欄位，以及 DB 欄位名稱不同時的對應
+STATION_OUT_COLS = [
+    "route_id", "route_name", "direction", "stop_name",
+    "latitude", "longitude", "eta_from_start", "stop_order", "created_at"
+]
+STATION_COL_ALIASES = {
+    "stop_name": ["station_name"],
+    "eta_from_start": ["est_time"],
+    "stop_order": ["order_no", "seq"],
+}
+
 @app.post("/Route_Stations", response_model=List[StationOut])
 def get_route_stations(q: RouteStationsQuery):
-    # --- 參數化查詢（你的 MySQL_Run 若支援 params，優先這個寫法） ---
-    sql = "SELECT * FROM bus_route_stations WHERE route_id = %s"
+    # 欄位由 Tables 快取決定（不再每次 SHOW COLUMNS），查詢結果直接對應 StationOut
+    cols = Tables.select_list("bus_route_stations", STATION_OUT_COLS, STATION_COL_ALIASES)
+    sql = f"SELECT {cols} FROM bus_route_stations WHERE route_id = %s"
     params = [q.route_id]
     if q.direction:
         sql += " AND direction = %s"
         params.append(q.direction)
 
-    try:
-        rows = MySQL_Run(sql, params)  # 若你的 MySQL_Run 不支援 params，就 fallback 用 f-string，但要小心注入
-    except TypeError:
-        # Fallback：有些自寫函式沒有 params 參數
-        # 請務必確認 direction 的字串來源可信
-        if q.direction:
-            rows = MySQL_Run(f"SELECT * FROM bus_route_stations WHERE route_id = {int(q.route_id)} AND direction = '{q.direction}'")
-        else:
-            rows = MySQL_Run(f"SELECT * FROM bus_route_stations WHERE route_id = {int(q.route_id)}")
-
-    columns = [c[0] for c in MySQL_Run("SHOW COLUMNS FROM bus_route_stations")]
-    df = pd.DataFrame(rows, columns=columns)
+    rows = MySQL_Run(sql, params)
 
-    # --- 沒資料的處理（擇一：回404 或 回[]）---
-    if df.empty:
-        # 選擇一：回空陣列（前端好處理）
-        return []
-        # 選擇二：回 404
-        # raise HTTPException(status_code=404, detail=f"route_id={q.route_id} 無站點資料")
-
-    # --- 欄位名稱正規化（把 DB 欄位映射成 API 欄位）---
-    col_map = {
-        "station_name": "stop_name",
-        "stop_name": "stop_name",
-        "est_time": "eta_from_start",
-        "eta_from_start": "eta_from_start",
-        "order_no": "stop_order",
-        "seq": "stop_order",
-        # 你若有 station_id 欄位但不打算輸出，就不要映射
-    }
-    # 只 rename 存在的欄位，避免 KeyError
-    df = df.rename(columns={k: v for k, v in col_map.items() if k in df.columns})
-
-    # --- 型別防呆：數值、時間、NaN 轉換 ---
-    # 經緯度
-    if "latitude" in df.columns:
-        df["latitude"] = pd.to_numeric(df["latitude"], errors="coerce")
-    if "longitude" in df.columns:
-        df["longitude"] = pd.to_numeric(df["longitude"], errors="coerce")
-
-    # 到站時間 / 順序
-    if "eta_from_start" in df.columns:
-        df["eta_from_start"] = pd.to_numeric(df["eta_from_start"], errors="coerce").astype("Int64")
-    if "stop_order" in df.columns:
-        df["stop_order"] = pd.to_numeric(df["stop_order"], errors="coerce").astype("Int64")
-
-    # created_at -> datetime（避免 pandas.Timestamp 造成驗證錯誤）
-    if "created_at" in df.columns:
-        df["created_at"] = pd.to_datetime(df["created_at"], errors="coerce") \
-            .apply(lambda x: x.to_pydatetime() if pd.notnull(x) else None)
-
-    # 只保留我們要輸出的欄位（避免多餘欄位觸發驗證錯）
-    desired_cols = [
-        "route_id", "route_name", "direction", "stop_name",
-        "latitude", "longitude", "eta_from_start", "stop_order", "created_at"
-    ]
-    keep_cols = [c for c in desired_cols if c in df.columns]
-    df = df[keep_cols]
-
-    # NaN -> None
-    records = df.where(pd.notnull(df), None).to_dict(orient="records")
-
-    # （可選）逐筆建模，能更早在後端發現資料異常
-    data: List[StationOut] = [StationOut(**r) for r in records]
+    # 沒資料回空陣列（前端好處理）
+    data: List[StationOut] = [StationOut(**r) for r in rows]
     return data
 
 # ===== 路線站點管理 API =====
@@ -2267,61 +2300,107 @@ def create_route_station(station: StationCreate, current_user: AdminUser = Depen
         print(f"調試: replace_existing={replace_existing}, auto_reorder={auto_reorder}")
         print(f"調試: station_data keys: {list(station_data.keys())}")
 
-        if replace_existing:
-            # 交換位置模式：先確保沒有衝突，再插入新站點
-            try:
-                # 查找目標位置的所有信息
-                conflict_result = MySQL_Run(
-                    """SELECT station_id, route_id, route_name, direction, stop_name, 
-                           latitude, longitude, stop_order, eta_from_start, address
-                       FROM bus_route_stations 
-                       WHERE route_id = %s AND direction = %s AND stop_order = %s""",
-                    (station.route_id, station.direction, station.stop_order)
-                )
+        # 交換 / 自動調整 / 一般新增都在同一個交易內，失敗時整批 rollback
+        with transaction():
+            _invalidate_route_stations(station.route_id)
+            if replace_existing:
+                # 交換位置模式：先確保沒有衝突，再插入新站點
+                try:
+                    # 查找目標位置的所有信息
+                    conflict_result = MySQL_Run(
+                        """SELECT station_id, route_id, route_name, direction, stop_name, 
+                               latitude, longitude, stop_order, eta_from_start, address
+                           FROM bus_route_stations 
+                           WHERE route_id = %s AND direction = %s AND stop_order = %s""",
+                        (station.route_id, station.direction, station.stop_order)
+                    )
                 
-                if conflict_result:
-                    conflict_station = conflict_result[0]
+                    if conflict_result:
+                        conflict_station = conflict_result[0]
                     
-                    # 找到最大順序並準備新位置
-                    max_order_result = MySQL_Run(
-                        "SELECT COALESCE(MAX(stop_order), 0) + 1 as next_order FROM bus_route_stations WHERE route_id = %s AND direction = %s",
-                        (station.route_id, station.direction)
-                    )
-                    next_order = max_order_result[0]['next_order'] if max_order_result else station.stop_order + 1
+                        # 找到最大順序並準備新位置
+                        max_order_result = MySQL_Run(
+                            "SELECT COALESCE(MAX(stop_order), 0) + 1 as next_order FROM bus_route_stations WHERE route_id = %s AND direction = %s",
+                            (station.route_id, station.direction)
+                        )
+                        next_order = max_order_result[0]['next_order'] if max_order_result else station.stop_order + 1
+                    
+                        # 第一步：直接刪除衝突站點
+                        MySQL_Run(
+                            "DELETE FROM bus_route_stations WHERE station_id = %s",
+                            (conflict_station['station_id'],)
+                        )
+                    
+                        # 第二步：插入新站點到目標位置
+                        MySQL_Run(
+                            """INSERT INTO bus_route_stations 
+                               (route_id, route_name, direction, stop_name, latitude, longitude, stop_order, eta_from_start, address)
+                               VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s)""",
+                            (station.route_id, station.route_name, station.direction, station.stop_name,
+                             station.latitude, station.longitude, station.stop_order, station.eta_from_start, station.address or "")
+                        )
+                    
+                        # 第三步：重新插入原站點到新位置
+                        MySQL_Run(
+                            """INSERT INTO bus_route_stations 
+                               (route_id, route_name, direction, stop_name, latitude, longitude, stop_order, eta_from_start, address)
+                               VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s)""",
+                            (conflict_station['route_id'], conflict_station['route_name'], conflict_station['direction'], conflict_station['stop_name'],
+                             conflict_station['latitude'], conflict_station['longitude'], next_order, conflict_station['eta_from_start'], conflict_station['address'] or "")
+                        )
                     
-                    # 第一步：直接刪除衝突站點
+                        # 記錄操作歷史（使用正確的枚舉值）
+                        MySQL_Run(
+                            """INSERT INTO station_order_history 
+                               (route_id, direction, operation_type, old_order, new_order, station_name, operator_id)
+                               VALUES (%s, %s, 'UPDATE', %s, %s, %s, %s)""",
+                            (station.route_id, station.direction, conflict_station['stop_order'], 
+                             next_order, conflict_station['stop_name'], current_user.admin_id)
+                        )
+                    
+                        # 記錄新增歷史
+                        MySQL_Run(
+                            """INSERT INTO station_order_history 
+                               (route_id, direction, operation_type, new_order, station_name, operator_id)
+                               VALUES (%s, %s, 'INSERT', %s, %s, %s)""",
+                            (station.route_id, station.direction, station.stop_order, station.stop_name, current_user.admin_id)
+                        )
+                    
+                        # 交換完成，直接返回，不執行後續的一般插入邏輯
+                        return {"message": "站點交換成功", "ok": True}
+                    
+                except Exception as e:
+                    print(f"交換位置失敗: {e}")
+                    raise HTTPException(status_code=500, detail=f"交換位置失敗: {str(e)}")
+
+            elif auto_reorder:
+                # 自動調整模式：安全地將後續站點順序 +1
+                try:
+                    # 一次 UPDATE 把後續站點順序 +1；ORDER BY DESC 讓 MySQL 從最大順序開始改，避免違反唯一鍵
                     MySQL_Run(
-                        "DELETE FROM bus_route_stations WHERE station_id = %s",
-                        (conflict_station['station_id'],)
+                        """UPDATE bus_route_stations SET stop_order = stop_order + 1
+                           WHERE route_id = %s AND direction = %s AND stop_order >= %s
+                           ORDER BY stop_order DESC""",
+                        (station.route_id, station.direction, station.stop_order)
                     )
-                    
-                    # 第二步：插入新站點到目標位置
+                
+                    # 記錄批次調整歷史
                     MySQL_Run(
-                        """INSERT INTO bus_route_stations 
-                           (route_id, route_name, direction, stop_name, latitude, longitude, stop_order, eta_from_start, address)
-                           VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s)""",
-                        (station.route_id, station.route_name, station.direction, station.stop_name,
-                         station.latitude, station.longitude, station.stop_order, station.eta_from_start, station.address or "")
+                        """INSERT INTO station_order_history 
+                           (route_id, direction, operation_type, old_order, new_order, station_name, operator_id)
+                           VALUES (%s, %s, 'REORDER', %s, NULL, 'BATCH_ADJUSTMENT', %s)""",
+                        (station.route_id, station.direction, station.stop_order, current_user.admin_id)
                     )
-                    
-                    # 第三步：重新插入原站點到新位置
+                
+                    # 現在插入新站點到已調整的位置
                     MySQL_Run(
                         """INSERT INTO bus_route_stations 
                            (route_id, route_name, direction, stop_name, latitude, longitude, stop_order, eta_from_start, address)
                            VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s)""",
-                        (conflict_station['route_id'], conflict_station['route_name'], conflict_station['direction'], conflict_station['stop_name'],
-                         conflict_station['latitude'], conflict_station['longitude'], next_order, conflict_station['eta_from_start'], conflict_station['address'] or "")
-                    )
-                    
-                    # 記錄操作歷史（使用正確的枚舉值）
-                    MySQL_Run(
-                        """INSERT INTO station_order_history 
-                           (route_id, direction, operation_type, old_order, new_order, station_name, operator_id)
-                           VALUES (%s, %s, 'UPDATE', %s, %s, %s, %s)""",
-                        (station.route_id, station.direction, conflict_station['stop_order'], 
-                         next_order, conflict_station['stop_name'], current_user.admin_id)
+                        (station.route_id, station.route_name, station.direction, station.stop_name,
+                         station.latitude, station.longitude, station.stop_order, station.eta_from_start, station.address or "")
                     )
-                    
+                
                     # 記錄新增歷史
                     MySQL_Run(
                         """INSERT INTO station_order_history 
@@ -2329,91 +2408,41 @@ def create_route_station(station: StationCreate, current_user: AdminUser = Depen
                            VALUES (%s, %s, 'INSERT', %s, %s, %s)""",
                         (station.route_id, station.direction, station.stop_order, station.stop_name, current_user.admin_id)
                     )
-                    
-                    # 交換完成，直接返回，不執行後續的一般插入邏輯
-                    return {"message": "站點交換成功", "ok": True}
-                    
-            except Exception as e:
-                print(f"交換位置失敗: {e}")
-                raise HTTPException(status_code=500, detail=f"交換位置失敗: {str(e)}")
-
-        elif auto_reorder:
-            # 自動調整模式：安全地將後續站點順序 +1
-            try:
-                # 先獲取需要調整的站點列表（從大到小順序，避免約束衝突）
-                stations_to_update = MySQL_Run(
-                    """SELECT station_id, stop_order FROM bus_route_stations 
-                       WHERE route_id = %s AND direction = %s AND stop_order >= %s
-                       ORDER BY stop_order DESC""",
-                    (station.route_id, station.direction, station.stop_order)
-                )
                 
-                # 從最大順序開始逐個更新（避免中間狀態違反約束）
-                for station_to_update in stations_to_update:
-                    MySQL_Run(
-                        "UPDATE bus_route_stations SET stop_order = %s WHERE station_id = %s",
-                        (station_to_update['stop_order'] + 1, station_to_update['station_id'])
-                    )
-                
-                # 記錄批次調整歷史
-                MySQL_Run(
-                    """INSERT INTO station_order_history 
-                       (route_id, direction, operation_type, old_order, new_order, station_name, operator_id)
-                       VALUES (%s, %s, 'REORDER', %s, NULL, 'BATCH_ADJUSTMENT', %s)""",
-                    (station.route_id, station.direction, station.stop_order, current_user.admin_id)
-                )
-                
-                # 現在插入新站點到已調整的位置
-                MySQL_Run(
-                    """INSERT INTO bus_route_stations 
-                       (route_id, route_name, direction, stop_name, latitude, longitude, stop_order, eta_from_start, address)
-                       VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s)""",
-                    (station.route_id, station.route_name, station.direction, station.stop_name,
-                     station.latitude, station.longitude, station.stop_order, station.eta_from_start, station.address or "")
-                )
-                
-                # 記錄新增歷史
-                MySQL_Run(
-                    """INSERT INTO station_order_history 
-                       (route_id, direction, operation_type, new_order, station_name, operator_id)
-                       VALUES (%s, %s, 'INSERT', %s, %s, %s)""",
-                    (station.route_id, station.direction, station.stop_order, station.stop_name, current_user.admin_id)
-                )
-                
-                # 插入調整完成，直接返回，不執行後續的一般插入邏輯
-                return {"message": "站點插入調整成功", "ok": True}
-            except Exception as e:
-                print(f"自動調整失敗: {e}")
-                raise HTTPException(status_code=500, detail=f"自動調整失敗: {str(e)}")
-
-        # 插入新站點
-        sql = """
-        INSERT INTO bus_route_stations 
-        (route_id, route_name, direction, stop_name, latitude, longitude, stop_order, eta_from_start, address)
-        VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s)
-        """
-        params = (
-            station.route_id,
-            station.route_name,
-            station.direction,
-            station.stop_name,
-            station.latitude,
-            station.longitude,
-            station.stop_order,
-            station.eta_from_start,
-            station.address or ""
-        )
-        MySQL_Run(sql, params)
-        
-        # 記錄新增歷史 (使用正確的欄位名稱)
-        MySQL_Run(
-            """INSERT INTO station_order_history 
-               (route_id, direction, operation_type, new_order, station_name, operator_id)
-               VALUES (%s, %s, 'INSERT', %s, %s, %s)""",
-            (station.route_id, station.direction, station.stop_order, station.stop_name, current_user.admin_id)
-        )
-        
-        return {"message": "站點創建成功", "ok": True}
+                    # 插入調整完成，直接返回，不執行後續的一般插入邏輯
+                    return {"message": "站點插入調整成功", "ok": True}
+                except Exception as e:
+                    print(f"自動調整失敗: {e}")
+                    raise HTTPException(status_code=500, detail=f"自動調整失敗: {str(e)}")
+
+            # 插入新站點
+            sql = """
+            INSERT INTO bus_route_stations 
+            (route_id, route_name, direction, stop_name, latitude, longitude, stop_order, eta_from_start, address)
+            VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s)
+            """
+            params = (
+                station.route_id,
+                station.route_name,
+                station.direction,
+                station.stop_name,
+                station.latitude,
+                station.longitude,
+                station.stop_order,
+                station.eta_from_start,
+                station.address or ""
+            )
+            MySQL_Run(sql, params)
+        
+            # 記錄新增歷史 (使用正確的欄位名稱)
+            MySQL_Run(
+                """INSERT INTO station_order_history 
+                   (route_id, direction, operation_type, new_order, station_name, operator_id)
+                   VALUES (%s, %s, 'INSERT', %s, %s, %s)""",
+                (station.route_id, station.direction, station.stop_order, station.stop_name, current_user.admin_id)
+            )
+        
+            return {"message": "站點創建成功", "ok": True}
     except HTTPException:
         raise
     except Exception as e:
@@ -2429,68 +2458,71 @@ def update_route_station(station: StationUpdate, current_user: AdminUser = Depen
         orig_order = getattr(station, 'original_stop_order', None)
         orig_name = getattr(station, 'original_stop_name', None)
 
-        # 若更改 stop_order：採用列表移動演算法以保持唯一性
-        try:
-            if orig_order is not None and station.stop_order is not None and int(station.stop_order) != int(orig_order):
-                new_order = int(station.stop_order)
-                old_order = int(orig_order)
-                if new_order < old_order:
-                    # 上移：new..old-1 全部 +1
-                    MySQL_Run(
-                        """
-                        UPDATE bus_route_stations
-                        SET stop_order = stop_order + 1
-                        WHERE route_id = %s AND stop_order >= %s AND stop_order < %s
-                        """,
-                        (station.route_id, new_order, old_order)
-                    )
-                else:
-                    # 下移：old+1..new 全部 -1
-                    MySQL_Run(
-                        """
-                        UPDATE bus_route_stations
-                        SET stop_order = stop_order - 1
-                        WHERE route_id = %s AND stop_order <= %s AND stop_order > %s
-                        """,
-                        (station.route_id, new_order, old_order)
-                    )
-        except Exception:
-            # 重排失敗不阻斷
-            pass
-
-        if orig_order is not None:
-            where_sql = "WHERE route_id = %s AND stop_order = %s"
-            where_params = (station.route_id, orig_order)
-        elif orig_name:
-            where_sql = "WHERE route_id = %s AND stop_name = %s"
-            where_params = (station.route_id, orig_name)
-        else:
-            # 最後回退使用 route_id + stop_order（使用者在表單未提供 original_* 時）
-            where_sql = "WHERE route_id = %s AND stop_order = %s"
-            where_params = (station.route_id, station.stop_order)
-
-        sql = f"""
-        UPDATE bus_route_stations
-        SET route_name = %s, direction = %s,
-            stop_name = %s, latitude = %s,
-            longitude = %s, stop_order = %s,
-            eta_from_start = %s,
-            address = %s
-        {where_sql}
-        """
+        # 重排與更新在同一條連線、同一次 commit 完成
+        with transaction():
+            _invalidate_route_stations(station.route_id)
+            # 若更改 stop_order：採用列表移動演算法以保持唯一性
+            try:
+                if orig_order is not None and station.stop_order is not None and int(station.stop_order) != int(orig_order):
+                    new_order = int(station.stop_order)
+                    old_order = int(orig_order)
+                    if new_order < old_order:
+                        # 上移：new..old-1 全部 +1
+                        MySQL_Run(
+                            """
+                            UPDATE bus_route_stations
+                            SET stop_order = stop_order + 1
+                            WHERE route_id = %s AND stop_order >= %s AND stop_order < %s
+                            """,
+                            (station.route_id, new_order, old_order)
+                        )
+                    else:
+                        # 下移：old+1..new 全部 -1
+                        MySQL_Run(
+                            """
+                            UPDATE bus_route_stations
+                            SET stop_order = stop_order - 1
+                            WHERE route_id = %s AND stop_order <= %s AND stop_order > %s
+                            """,
+                            (station.route_id, new_order, old_order)
+                        )
+            except Exception:
+                # 重排失敗不阻斷
+                pass
 
-        params = (
-            station.route_name,
-            station.direction,
-            station.stop_name,
-            station.latitude,
-            station.longitude,
-            station.stop_order,
-            station.eta_from_start,
-            station.address or ""
-        ) + tuple(where_params)
-
-        MySQL_Run(sql, params)
+            if orig_order is not None:
+                where_sql = "WHERE route_id = %s AND stop_order = %s"
+                where_params = (station.route_id, orig_order)
+            elif orig_name:
+                where_sql = "WHERE route_id = %s AND stop_name = %s"
+                where_params = (station.route_id, orig_name)
+            else:
+                # 最後回退使用 route_id + stop_order（使用者在表單未提供 original_* 時）
+                where_sql = "WHERE route_id = %s AND stop_order = %s"
+                where_params = (station.route_id, station.stop_order)
+
+            sql = f"""
+            UPDATE bus_route_stations
+            SET route_name = %s, direction = %s,
+                stop_name = %s, latitude = %s,
+                longitude = %s, stop_order = %s,
+                eta_from_start = %s,
+                address = %s
+            {where_sql}
+            """
+
+            params = (
+                station.route_name,
+                station.direction,
+                station.stop_name,
+                station.latitude,
+                station.longitude,
+                station.stop_order,
+                station.eta_from_start,
+                station.address or ""
+            ) + tuple(where_params)
+
+            MySQL_Run(sql, params)
         return {"message": "站點更新成功", "ok": True}
     except Exception as e:
         print(f"更新站點失敗: {str(e)}")
@@ -2509,6 +2541,7 @@ def delete_route_station(route_id: int, stop_order: int, current_user: AdminUser
 
         sql = "DELETE FROM bus_route_stations WHERE route_id = %s AND stop_order = %s"
         MySQL_Run(sql, (route_id, stop_order))
+        _invalidate_route_stations(route_id)
         return {"message": "站點刪除成功", "ok": True}
     except HTTPException:
         raise
@@ -2516,6 +2549,115 @@ def delete_route_station(route_id: int, stop_order: int, current_user: AdminUser
         print(f"刪除站點失敗: {str(e)}")  # 加入日誌
         raise HTTPException(status_code=500, detail=f"刪除站點失敗: {str(e)}")
 
+# ===== 班次時刻（bus_stop_times：每站每班一列，時刻為午夜起算分鐘）=====
+def _fmt_minutes(m) -> str:
+    m = int(m)
+    return f"{m // 60:02d}:{m % 60:02d}"
+
+@app.get("/api/stop-times")
+def get_stop_times(route_id: int, direction: Optional[str] = None, current_user: AdminUser = Depends(get_current_user)):
+    """路線時刻表矩陣：stops 為依序站點，trips[k] 為第 k+1 班在各站的時刻（沒有該班則為 null）"""
+    try:
+        sql = """
+            SELECT s.station_id, s.direction, s.stop_order, s.stop_name, t.trip_no, t.departure_min
+            FROM bus_route_stations s
+            LEFT JOIN bus_stop_times t ON t.station_id = s.station_id
+            WHERE s.route_id = %s
+        """
+        params = [route_id]
+        if direction:
+            sql += " AND s.direction = %s"
+            params.append(direction)
+        sql += " ORDER BY s.direction, s.stop_order, t.trip_no"
+        rows = MySQL_Run(sql, params) or []
+
+        result = {}
+        for row in rows:
+            d = result.setdefault(row["direction"], {"stops": [], "times": {}})
+            sid = row["station_id"]
+            if sid not in d["times"]:
+                d["stops"].append({"station_id": sid, "stop_order": row["stop_order"], "stop_name": row["stop_name"]})
+                d["times"][sid] = {}
+            if row["trip_no"] is not None:
+                d["times"][sid][int(row["trip_no"])] = _fmt_minutes(row["departure_min"])
+
+        data = []
+        for dir_name, d in result.items():
+            n_trips = max((max(t) for t in d["times"].values() if t), default=0)
+            trips = [
+                [d["times"][stop["station_id"]].get(k) for stop in d["stops"]]
+                for k in range(1, n_trips + 1)
+            ]
+            data.append({"direction": dir_name, "stops": d["stops"], "trips": trips})
+        return {"route_id": route_id, "data": data}
+    except Exception as e:
+        print(f"讀取班次時刻失敗: {e}")
+        raise HTTPException(status_code=500, detail=f"讀取班次時刻失敗: {str(e)}")
+
+@app.get("/api/stop-times/departures")
+def get_stop_departures(station_id: int, after: str = "00:00", limit: int = 20, current_user: AdminUser = Depends(get_current_user)):
+    """某站在指定時間之後的班次（走 idx_station_departure 索引）"""
+    try:
+        hh, mm = after.strip().split(":")
+        after_min = int(hh) * 60 + int(mm)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="after 格式須為 HH:MM")
+    rows = MySQL_Run(
+        """SELECT trip_no, departure_min FROM bus_stop_times
+           WHERE station_id = %s AND departure_min >= %s
+           ORDER BY departure_min LIMIT %s""",
+        (station_id, after_min, max(1, min(limit, 200)))
+    ) or []
+    return {
+        "station_id": station_id,
+        "after": _fmt_minutes(after_min),
+        "data": [{"trip_no": r["trip_no"], "departure": _fmt_minutes(r["departure_min"])} for r in rows],
+    }
+
+# ===== 到站時刻表 CSV 匯入（格式見 TimetableImport.py）=====
+# 比對與寫入都是同步的 MySQL_Run，端點用一般 def 讓 FastAPI 放到 threadpool，不卡住 event loop
+def _read_timetable_upload(file: UploadFile, day_type: str):
+    if not file.filename.lower().endswith(".csv"):
+        raise HTTPException(status_code=400, detail="請上傳CSV檔案")
+    try:
+        text = TimetableImport.decode_csv(file.file.read())
+    except UnicodeDecodeError:
+        raise HTTPException(status_code=400, detail="檔案編碼錯誤，請使用UTF-8或Big5編碼")
+    legs, warnings = TimetableImport.parse_timetable_csv(text)
+    if not legs:
+        raise HTTPException(status_code=400, detail="CSV中沒有找到有效的時刻表區塊")
+    plan = TimetableImport.plan_import(legs, MySQL_Run, day_type=day_type)
+    plan["warnings"] = warnings + plan["warnings"]
+    return plan
+
+@app.post("/api/timetable/preview")
+def preview_timetable_import(file: UploadFile = File(...), day_type: str = "平日", current_user: AdminUser = Depends(get_current_user)):
+    """解析時刻表CSV、比對路線與站點，回傳每站新舊時刻差異（不寫入）"""
+    try:
+        plan = _read_timetable_upload(file, day_type)
+        return {"success": True, **TimetableImport.preview_summary(plan)}
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"預覽失敗: {str(e)}")
+
+@app.post("/api/timetable/apply")
+def apply_timetable_import(file: UploadFile = File(...), day_type: str = "平日", current_user: AdminUser = Depends(get_current_user)):
+    """重新解析並比對後，在同一個交易內寫入 bus_stop_times 與 schedule 字串"""
+    try:
+        plan = _read_timetable_upload(file, day_type)
+        with transaction():
+            for route_id in plan["route_ids"]:
+                _invalidate_route_stations(route_id)
+            result = TimetableImport.apply_plan(plan, MySQL_Run, MySQL_RunMany)
+        return {"success": True, "message": f"已更新 {result['stations']} 站時刻", **result,
+                "warnings": plan["warnings"], "changes": plan["changes"]}
+    except HTTPException:
+        raise
+    except Exception as e:
+        print(f"時刻表匯入失敗: {e}")
+        raise HTTPException(status_code=500, detail=f"時刻表匯入失敗: {str(e)}")
+
 @app.get("/api/routes")
 def get_all_routes():
     """獲取所有路線（從 bus_route_stations 表中提取）"""
@@ -2779,6 +2921,7 @@ def update_reservation(reservation_id: int, payload: ReservationUpdate, current_
         params.append(reservation_id)
         sql = f"UPDATE reservation SET {', '.join(sets)} WHERE reservation_id = %s"
         MySQL_Run(sql, tuple(params))
+        _invalidate_reservation(reservation_id)
         return {"success": True}
     except Exception as e:
         print("update_reservation error:", e)
@@ -2792,6 +2935,7 @@ def delete_reservation(reservation_id: int, current_user: AdminUser = Depends(ge
         if not chk or chk[0]['c'] == 0:
             raise HTTPException(status_code=404, detail='預約不存在')
         MySQL_Run("DELETE FROM reservation WHERE reservation_id = %s", (reservation_id,))
+        _invalidate_reservation(reservation_id)
         return {"success": True}
     except HTTPException:
         raise
@@ -3109,6 +3253,7 @@ def update_user(user_id: int, user: UserUpdate, db: Session = Depends(get_db), c
         if k in user_data and isinstance(user_data[k], str) and not user_data[k].strip():
             user_data[k] = None
 
+    old_line_id = target.line_id
     for key, value in user_data.items():
         setattr(target, key, value)
     try:
@@ -3116,6 +3261,8 @@ def update_user(user_id: int, user: UserUpdate, db: Session = Depends(get_db), c
     except Exception:
         pass
     db.commit()
+    # line_id 被改時舊的 key 也要清掉
+    _invalidate_profile(old_line_id, target.line_id)
     return {"message": "用戶更新成功"}
 
 @app.delete("/users/{user_id}")
@@ -3127,8 +3274,10 @@ def delete_user(user_id: int, db: Session = Depends(get_db), current_user: Admin
     user = db.query(User).filter(User.user_id == user_id).first()
     if not user:
         raise HTTPException(status_code=404, detail="用戶不存在")
+    line_id = user.line_id
     db.delete(user)
     db.commit()
+    _invalidate_profile(line_id)
     return {"message": "用戶刪除成功"}
 
 # ===== XML 匯入功能 API =====
@@ -3356,83 +3505,87 @@ def import_xml_data(request_data: dict, current_user: AdminUser = Depends(get_cu
         
         for route_data in routes_data:
             try:
-                # 檢查路線是否已存在
-                existing_route = MySQL_Run("SELECT route_id FROM bus_routes_total WHERE route_name = %s", (route_data.route_name,))
+                # 每條路線（含其站點）在同一個交易內完成
+                with transaction():
+                    _invalidate_route_stations()
+                    _invalidate_routes()
+                    # 檢查路線是否已存在
+                    existing_route = MySQL_Run("SELECT route_id FROM bus_routes_total WHERE route_name = %s", (route_data.route_name,))
                 
-                route_id = None
-                if existing_route:
-                    if options.overwrite_existing:
-                        # 刪除現有路線和站點
-                        route_id = existing_route[0]["route_id"]
-                        MySQL_Run("DELETE FROM bus_route_stations WHERE route_id = %s", (route_id,))
-                        MySQL_Run("DELETE FROM bus_routes_total WHERE route_id = %s", (route_id,))
-                    else:
-                        errors.append(f"路線 '{route_data.route_name}' 已存在，跳過匯入")
-                        continue
+                    route_id = None
+                    if existing_route:
+                        if options.overwrite_existing:
+                            # 刪除現有路線和站點
+                            route_id = existing_route[0]["route_id"]
+                            MySQL_Run("DELETE FROM bus_route_stations WHERE route_id = %s", (route_id,))
+                            MySQL_Run("DELETE FROM bus_routes_total WHERE route_id = %s", (route_id,))
+                        else:
+                            errors.append(f"路線 '{route_data.route_name}' 已存在，跳過匯入")
+                            continue
                 
-                # 建立路線
-                route_cols = ['route_name', 'stop_count', 'direction', 'start_stop', 'end_stop', 'status']
-                route_values = [
-                    route_data.route_name,
-                    len(route_data.stations),
-                    route_data.direction,
-                    route_data.start_stop,
-                    route_data.end_stop,
-                    route_data.status
-                ]
+                    # 建立路線
+                    route_cols = ['route_name', 'stop_count', 'direction', 'start_stop', 'end_stop', 'status']
+                    route_values = [
+                        route_data.route_name,
+                        len(route_data.stations),
+                        route_data.direction,
+                        route_data.start_stop,
+                        route_data.end_stop,
+                        route_data.status
+                    ]
                 
-                placeholders = ', '.join(['%s'] * len(route_values))
-                sql = f"INSERT INTO bus_routes_total ({', '.join(route_cols)}) VALUES ({placeholders})"
-                result = MySQL_Run(sql, route_values)
+                    placeholders = ', '.join(['%s'] * len(route_values))
+                    sql = f"INSERT INTO bus_routes_total ({', '.join(route_cols)}) VALUES ({placeholders})"
+                    result = MySQL_Run(sql, route_values)
                 
-                if isinstance(result, dict) and 'lastrowid' in result:
-                    route_id = result['lastrowid']
-                else:
-                    # 如果沒有取得lastrowid，查詢路線ID
-                    route_query = MySQL_Run("SELECT route_id FROM bus_routes_total WHERE route_name = %s", (route_data.route_name,))
-                    if route_query:
-                        route_id = route_query[0]["route_id"]
+                    if isinstance(result, dict) and 'lastrowid' in result:
+                        route_id = result['lastrowid']
+                    else:
+                        # 如果沒有取得lastrowid，查詢路線ID
+                        route_query = MySQL_Run("SELECT route_id FROM bus_routes_total WHERE route_name = %s", (route_data.route_name,))
+                        if route_query:
+                            route_id = route_query[0]["route_id"]
                 
-                if not route_id:
-                    errors.append(f"建立路線 '{route_data.route_name}' 失敗")
-                    continue
+                    if not route_id:
+                        errors.append(f"建立路線 '{route_data.route_name}' 失敗")
+                        continue
                 
-                # 建立站點
-                stations_imported = 0
-                for station in route_data.stations:
-                    try:
-                        station_cols = ['route_id', 'route_name', 'direction', 'stop_name', 'latitude', 'longitude', 'stop_order', 'eta_from_start', 'address']
-                        station_values = [
-                            route_id,
-                            route_data.route_name,
-                            station.direction,
-                            station.stop_name,
-                            station.latitude,
-                            station.longitude,
-                            station.stop_order,
-                            station.eta_from_start,
-                            station.address
-                        ]
+                    # 建立站點
+                    stations_imported = 0
+                    for station in route_data.stations:
+                        try:
+                            station_cols = ['route_id', 'route_name', 'direction', 'stop_name', 'latitude', 'longitude', 'stop_order', 'eta_from_start', 'address']
+                            station_values = [
+                                route_id,
+                                route_data.route_name,
+                                station.direction,
+                                station.stop_name,
+                                station.latitude,
+                                station.longitude,
+                                station.stop_order,
+                                station.eta_from_start,
+                                station.address
+                            ]
                         
-                        station_placeholders = ', '.join(['%s'] * len(station_values))
-                        station_sql = f"INSERT INTO bus_route_stations ({', '.join(station_cols)}) VALUES ({station_placeholders})"
-                        MySQL_Run(station_sql, station_values)
-                        stations_imported += 1
+                            station_placeholders = ', '.join(['%s'] * len(station_values))
+                            station_sql = f"INSERT INTO bus_route_stations ({', '.join(station_cols)}) VALUES ({station_placeholders})"
+                            MySQL_Run(station_sql, station_values)
+                            stations_imported += 1
                         
-                    except Exception as station_error:
-                        if options.skip_invalid_data:
-                            errors.append(f"站點 '{station.stop_name}' 匯入失敗: {str(station_error)}")
-                        else:
-                            raise station_error
+                        except Exception as station_error:
+                            if options.skip_invalid_data:
+                                errors.append(f"站點 '{station.stop_name}' 匯入失敗: {str(station_error)}")
+                            else:
+                                raise station_error
                 
-                import_results.append({
-                    "route_name": route_data.route_name,
-                    "route_id": route_id,
-                    "stations_imported": stations_imported,
-                    "success": True
-                })
-                total_imported_routes += 1
-                total_imported_stations += stations_imported
+                    import_results.append({
+                        "route_name": route_data.route_name,
+                        "route_id": route_id,
+                        "stations_imported": stations_imported,
+                        "success": True
+                    })
+                    total_imported_routes += 1
+                    total_imported_stations += stations_imported
                 
             except Exception as route_error:
                 if options.skip_invalid_data:
@@ -3766,6 +3919,49 @@ def delete_schedule(schedule_id: int, current_user: AdminUser = Depends(get_curr
         print("delete_schedule error:", e)
         raise HTTPException(status_code=500, detail=str(e))
 
+# === 司機端憑證：下載該班次離線乘客名單、上傳掃碼紀錄用（client 端以同一個 Redis 驗證） ===
+DRIVER_CREDENTIAL_GRACE_SEC = int(os.getenv("DRIVER_CREDENTIAL_GRACE_SEC", 6 * 3600))  # 營運日結束後仍可上傳的秒數
+
+class DriverCredentialIn(BaseModel):
+    service_date: Optional[date] = None  # 排班沒有日期時使用，預設今天
+
+@app.post("/api/schedules/{schedule_id}/driver_credential")
+def issue_driver_credential(schedule_id: int, payload: Optional[DriverCredentialIn] = None, current_user: AdminUser = Depends(get_current_user), db: Session = Depends(get_db)):
+    """
+    發給該班次司機的隨機憑證（只回傳一次，Redis 只存 sha256）
+    有效到營運日結束 + DRIVER_CREDENTIAL_GRACE_SEC，只能存取這個班次的名單與掃碼上傳
+    """
+    _ensure_admin_or_super(db, current_user)
+    rows = MySQL_Run("SELECT id, date, employee_id, driver_name FROM route_schedule WHERE id = %s", (schedule_id,))
+    if not rows:
+        raise HTTPException(status_code=404, detail="排班記錄不存在")
+    schedule = rows[0]
+
+    service_date = schedule.get("date") or (payload.service_date if payload else None) or get_taipei_time().date()
+    if isinstance(service_date, str):
+        service_date = date.fromisoformat(service_date)
+    expires_at = TAIPEI_TZ.localize(datetime.combine(service_date + timedelta(days=1), time.min)) \
+        + timedelta(seconds=DRIVER_CREDENTIAL_GRACE_SEC)
+    ttl = int((expires_at - get_taipei_time()).total_seconds())
+    if ttl <= 0:
+        raise HTTPException(status_code=400, detail="班次營運日已結束")
+
+    rds = get_redis()
+    if isinstance(rds, InMemoryRedis):
+        # 憑證要由 client 端讀取，記憶體版無法共用
+        raise HTTPException(status_code=503, detail="Redis 無法使用，無法發放司機憑證")
+
+    token = secrets.token_urlsafe(32)
+    rds.setex(f"driver_cred:{_hash_key(token)}", ttl, json.dumps({
+        "trip_id": int(schedule["id"]),
+        "service_date": service_date.isoformat(),
+        "employee_id": schedule.get("employee_id"),
+        "issued_by": current_user.admin_id,
+    }))
+    print(f"[DriverCredential] 班次 {schedule_id}（{service_date}）由 admin {current_user.admin_id} 發放，{ttl} 秒後失效")
+    return {"success": True, "token": token, "trip_id": int(schedule["id"]),
+            "service_date": service_date.isoformat(), "expires_at": expires_at.isoformat()}
+
 @app.get("/api/schedules/routes")
 def get_schedule_routes(current_user: AdminUser = Depends(get_current_user)):
     """取得可用路線選項"""